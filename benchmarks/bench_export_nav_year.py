@@ -0,0 +1,112 @@
+"""Compare export_nav_year.py full rebuild against an incremental run.
+
+    python benchmarks/bench_export_nav_year.py --schemes 3000 --changed 500
+
+Copies ``--schemes`` files from data/nav_history into a temp directory,
+builds the year files once, appends ``--days`` new business-day rows to
+``--changed`` schemes, then times the incremental update and a full rebuild
+of the same tree and checks both produce identical bytes.  ``--memory``
+also reports peak traced allocations (tracemalloc slows both modes a lot).
+"""
+
+import argparse
+import contextlib
+import filecmp
+import io
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import date, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "scripts"))
+
+import export_nav_year  # noqa: E402
+import nav_state  # noqa: E402
+
+SOURCE_DIR = os.path.join(ROOT, "data", "nav_history")
+
+
+def append_rows(state, nav_dir, code, days):
+    path = os.path.join(nav_dir, f"{code}.csv")
+    last = state.last_date(code, path)
+    d = date.fromisoformat(last) if last else date(2026, 1, 1)
+    rows = []
+    while len(rows) < days:
+        d += timedelta(days=1)
+        if d.weekday() < 5:
+            rows.append((d.isoformat(), f"{random.uniform(10, 500):.5f}"))
+    state.append(code, path, rows)
+
+
+def timed(fn, *args, memory=False):
+    if memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        result = fn(*args)
+    wall = time.perf_counter() - start
+    peak = None
+    if memory:
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return result, wall, peak
+
+
+def describe(name, wall, peak, rows):
+    mem = f"  peak {peak / 2**20:7.1f} MiB" if peak is not None else ""
+    return f"{name:>11}: {wall:7.2f} s{mem}  ({rows:,} rows)"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--schemes", type=int, default=2000)
+    parser.add_argument("--changed", type=int, default=300)
+    parser.add_argument("--days", type=int, default=1)
+    parser.add_argument("--memory", action="store_true", help="Measure peak memory with tracemalloc")
+    args = parser.parse_args()
+
+    random.seed(7)
+    work = tempfile.mkdtemp(prefix="bench_nav_year_")
+    nav_dir = os.path.join(work, "nav_history")
+    inc_dir = os.path.join(work, "incremental")
+    full_dir = os.path.join(work, "rebuild")
+    for d in (nav_dir, inc_dir, full_dir):
+        os.makedirs(d)
+
+    try:
+        files = sorted(f for f in os.listdir(SOURCE_DIR) if f.endswith(".csv"))
+        for f in files[:args.schemes]:
+            shutil.copy(os.path.join(SOURCE_DIR, f), nav_dir)
+        codes = [os.path.splitext(f)[0] for f in files[:args.schemes]]
+
+        with nav_state.NavState(os.path.join(work, "inc.db")) as state:
+            timed(export_nav_year.full_rebuild, nav_dir, inc_dir, state)
+            for code in random.sample(codes, min(args.changed, len(codes))):
+                append_rows(state, nav_dir, code, args.days)
+            inc_rows, inc_wall, inc_peak = timed(
+                export_nav_year.incremental_update, nav_dir, inc_dir, state,
+                memory=args.memory)
+
+        with nav_state.NavState(os.path.join(work, "full.db")) as state:
+            full_rows, full_wall, full_peak = timed(
+                export_nav_year.full_rebuild, nav_dir, full_dir, state,
+                memory=args.memory)
+
+        cmp = filecmp.dircmp(inc_dir, full_dir)
+        same = not (cmp.diff_files or cmp.left_only or cmp.right_only)
+
+        print(f"📊 {len(codes)} schemes, {args.changed} changed × {args.days} rows\n")
+        print(describe("incremental", inc_wall, inc_peak, inc_rows))
+        print(describe("rebuild", full_wall, full_peak, full_rows))
+        print(f"\n{'✅ identical output' if same else '❌ outputs differ: ' + str(cmp.diff_files)}")
+    finally:
+        shutil.rmtree(work, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+"""Compare the threaded and async NAV fetch engines against a local stub.
+
+    python benchmarks/bench_fetch_engines.py --schemes 2000 --latency 0.05
+    python benchmarks/bench_fetch_engines.py --error-rate 0.05 --max-inflight 12
+
+Every run starts from an empty NAV directory so each scheme costs one
+request plus retries; reports wall time, schemes/sec, requests sent and
+schemes left in the retry queue per engine.  ``async`` keeps concurrency
+and rate fixed, ``aimd`` lets the controller move them.
+"""
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "scripts"))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import fetch_engine  # noqa: E402
+import fetch_nav_history  # noqa: E402
+import nav_state  # noqa: E402
+from stub_mfapi import StubMfapi  # noqa: E402
+
+
+def run_engine(name, stub, schemes, args):
+    nav_dir = tempfile.mkdtemp(prefix=f"bench_{name}_")
+    stub.reset_counters()
+    state = nav_state.NavState(os.path.join(nav_dir, "state.db"))
+    controller = None
+    try:
+        start = time.perf_counter()
+        if name == "threads":
+            fetch_nav_history.run_threaded(
+                schemes, state, nav_dir=nav_dir, api_url=stub.url,
+                workers=args.concurrency, rate=args.rate, on_result=lambda *a: None,
+                retries=args.retries,
+            )
+        else:
+            if name == "aimd":
+                controller = fetch_engine.AimdController(
+                    args.concurrency, args.rate,
+                    max_concurrency=args.max_concurrency,
+                    max_rate=args.rate * 3,
+                )
+            fetch_nav_history.run_async(
+                schemes, state, nav_dir=nav_dir, api_url=stub.url,
+                concurrency=args.concurrency, rate=args.rate,
+                on_result=lambda *a: None, controller=controller,
+                retries=args.retries,
+            )
+        wall = time.perf_counter() - start
+        failed = len(state.retry_queue(fetch_nav_history.RETRY_CONSUMER))
+    finally:
+        state.close()
+        shutil.rmtree(nav_dir, ignore_errors=True)
+
+    return wall, stub.requests, failed, controller
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--schemes", type=int, default=1000)
+    parser.add_argument("--latency", type=float, default=0.02,
+                        help="Stub server delay per request in seconds")
+    parser.add_argument("--days", type=int, default=250,
+                        help="History length per scheme")
+    parser.add_argument("--concurrency", type=int, default=fetch_nav_history.MAX_WORKERS)
+    parser.add_argument("--rate", type=float, default=fetch_nav_history.RATE_LIMIT)
+    parser.add_argument("--max-concurrency", type=int, default=fetch_nav_history.MAX_CONCURRENCY)
+    parser.add_argument("--retries", type=int, default=fetch_nav_history.RETRIES)
+    parser.add_argument("--error-rate", type=float, default=0.0,
+                        help="Share of stub responses that are 503")
+    parser.add_argument("--max-inflight", type=int,
+                        help="Stub answers 429 above this many concurrent requests")
+    args = parser.parse_args()
+
+    schemes = [{"SchemeCode": str(100000 + i)} for i in range(args.schemes)]
+    engines = ["threads"]
+    if fetch_engine.engine_available():
+        engines += ["async", "aimd"]
+    else:
+        print("⚠️ httpx not installed, async engines skipped")
+
+    with StubMfapi(latency=args.latency, days=args.days, error_rate=args.error_rate,
+                   max_inflight=args.max_inflight) as stub:
+        print(f"📊 {args.schemes} schemes, latency {args.latency * 1000:.0f} ms, "
+              f"concurrency {args.concurrency}, rate {args.rate:.1f} req/s, "
+              f"errors {args.error_rate:.0%}, max in-flight {args.max_inflight or '∞'}\n")
+        for name in engines:
+            wall, requests, failed, controller = run_engine(name, stub, schemes, args)
+            extra = ""
+            if controller is not None:
+                extra = (f"  → concurrency {controller.limit} (peak {controller.peak}), "
+                         f"{controller.backoffs} backoffs")
+            print(f"{name:>8}: {wall:8.2f} s  {args.schemes / wall:8.1f} schemes/s  "
+                  f"{requests:6} requests  {failed:4} queued{extra}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+"""Bytes saved by scripts/http_cache.py on repeated NAV fetches.
+
+    python benchmarks/bench_http_cache.py --schemes 1000 --changed 50
+
+Runs fetch_nav_history against the local stub three times per engine —
+cold, warm with nothing published, and after ``--changed`` schemes gain a
+day — with and without the cache, and reports bytes served, 304s and rows
+written.  ``--no-validators`` makes the stub omit ETag/Last-Modified so
+only the content-hash check applies (no bytes saved, parsing still skipped).
+A last pass checks LRU eviction keeps stored bodies under the bound.
+"""
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "scripts"))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import fetch_engine  # noqa: E402
+import fetch_nav_history  # noqa: E402
+import http_cache  # noqa: E402
+import nav_state  # noqa: E402
+from stub_mfapi import StubMfapi  # noqa: E402
+
+
+class Tally:
+    def __init__(self):
+        self.updated = 0
+        self.unchanged = 0
+
+    def __call__(self, status_line, result_line):
+        if result_line.startswith("✅"):
+            self.updated += 1
+        elif result_line == fetch_nav_history.UNCHANGED:
+            self.unchanged += 1
+
+
+def fetch(engine, stub, schemes, state, nav_dir, cache, args):
+    tally = Tally()
+    stub.reset_counters()
+    start = time.perf_counter()
+    if engine == "threads":
+        fetch_nav_history.run_threaded(
+            schemes, state, nav_dir=nav_dir, api_url=stub.url,
+            workers=args.concurrency, rate=args.rate, on_result=tally, cache=cache,
+        )
+    else:
+        fetch_nav_history.run_async(
+            schemes, state, nav_dir=nav_dir, api_url=stub.url,
+            concurrency=args.concurrency, rate=args.rate,
+            on_result=tally, cache=cache,
+        )
+    wall = time.perf_counter() - start
+    return wall, stub.bytes_sent, stub.not_modified, tally
+
+
+def run_engine(engine, use_cache, schemes, args):
+    work = tempfile.mkdtemp(prefix=f"bench_http_cache_{engine}_")
+    nav_dir = os.path.join(work, "nav_history")
+    os.makedirs(nav_dir)
+    state = nav_state.NavState(os.path.join(work, "state.db"))
+    cache = http_cache.HttpCache(os.path.join(work, "http"), "nav_history") if use_cache else None
+    # A week back, so last_date never equals today and every pass hits the stub.
+    end = date.today() - timedelta(days=7)
+
+    try:
+        with StubMfapi(latency=args.latency, days=args.days, end=end,
+                       validators=not args.no_validators) as stub:
+            label = f"{engine}{' +cache' if use_cache else ''}"
+            passes = [("cold", None), ("warm", None), (f"+{args.changed} new", args.changed)]
+            for name, bump in passes:
+                if bump:
+                    for scheme in schemes[:bump]:
+                        stub.bump(scheme["SchemeCode"])
+                wall, sent, n304, tally = fetch(engine, stub, schemes, state, nav_dir, cache, args)
+                print(f"{label:>14} {name:>9}: {wall:6.2f} s  {sent / 2**20:8.2f} MiB  "
+                      f"{n304:6} × 304  {tally.updated:6} updated  {tally.unchanged:6} skipped")
+    finally:
+        if cache is not None:
+            cache.close()
+        state.close()
+        shutil.rmtree(work, ignore_errors=True)
+
+
+def check_lru():
+    work = tempfile.mkdtemp(prefix="bench_http_lru_")
+    try:
+        bound = 1 << 20
+        cache = http_cache.HttpCache(work, "lru", max_bytes=bound)
+        body = b"x" * (100 * 1024)
+        for i in range(20):
+            url = f"http://stub/{i}"
+            cache.commit(cache.resolve(url, 200, {"ETag": f'"{i}"'}, body + bytes([i]), store_body=True))
+        kept = [i for i in range(20) if cache.conditional_headers(f"http://stub/{i}")]
+        stored = cache.stored_bytes()
+        cache.close()
+    finally:
+        shutil.rmtree(work, ignore_errors=True)
+    ok = stored <= bound and kept == list(range(20 - len(kept), 20))
+    print(f"🧹 LRU: {stored / 1024:.0f} KiB stored (bound {bound / 1024:.0f} KiB), "
+          f"kept newest {len(kept)}/20 {'✅' if ok else '❌'}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--schemes", type=int, default=500)
+    parser.add_argument("--changed", type=int, default=25,
+                        help="Schemes that publish a new NAV before the last pass")
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--days", type=int, default=250)
+    parser.add_argument("--concurrency", type=int, default=fetch_nav_history.MAX_WORKERS)
+    parser.add_argument("--rate", type=float, default=0,
+                        help="Request budget per second (0 = unpaced)")
+    parser.add_argument("--no-validators", action="store_true",
+                        help="Stub sends no ETag/Last-Modified (hash check only)")
+    args = parser.parse_args()
+
+    schemes = [{"SchemeCode": str(100000 + i)} for i in range(args.schemes)]
+    engines = ["threads"]
+    if fetch_engine.engine_available():
+        engines.append("async")
+
+    print(f"📊 {args.schemes} schemes × {args.days} days, "
+          f"validators {'off' if args.no_validators else 'on'}\n")
+    for engine in engines:
+        for use_cache in (False, True):
+            run_engine(engine, use_cache, schemes, args)
+        print()
+
+    check_lru()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+"""Micro-benchmarks for scripts/nav_reader.py against csv.DictReader + strptime.
+
+    python benchmarks/bench_nav_reader.py --schemes 500
+
+Each case runs over the same files, checks that both implementations give
+identical results, and reports rows/sec.  A date fuzz pass compares
+``is_iso_date``/``iso_date`` with ``strptime`` on odd inputs.
+"""
+
+import argparse
+import csv
+import os
+import random
+import sys
+import time
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "scripts"))
+
+import nav_reader  # noqa: E402
+
+SOURCE_DIR = os.path.join(ROOT, "data", "nav_history")
+
+
+# ---------- BASELINES (the loops the exporters used to run) ----------
+def baseline_rows(path):
+    with open(path, newline="", encoding="utf-8") as f:
+        return [(r.get("Date"), r.get("NAV")) for r in csv.DictReader(f)]
+
+
+def baseline_valid(path):
+    out = []
+    with open(path, newline="", encoding="utf-8") as f:
+        for r in csv.DictReader(f):
+            date_str = r.get("Date")
+            nav = r.get("NAV")
+            if not date_str or not nav:
+                continue
+            try:
+                d = datetime.strptime(date_str, "%Y-%m-%d").date()
+            except ValueError:
+                continue
+            out.append((d.isoformat(), nav))
+    return out
+
+
+def fast_rows(path):
+    return list(nav_reader.iter_rows(path))
+
+
+def fast_valid(path):
+    out = []
+    for date_str, nav in nav_reader.iter_rows(path):
+        if not date_str or not nav:
+            continue
+        d = nav_reader.iso_date(date_str)
+        if d is None:
+            continue
+        out.append((d, nav))
+    return out
+
+
+CASES = [
+    ("rows", baseline_rows, fast_rows),
+    ("rows+dates", baseline_valid, fast_valid),
+]
+
+
+def run(fn, paths):
+    start = time.perf_counter()
+    results = [fn(p) for p in paths]
+    return results, time.perf_counter() - start
+
+
+# ---------- DATE FUZZ ----------
+def strptime_iso(s):
+    try:
+        return datetime.strptime(s, "%Y-%m-%d").date().isoformat()
+    except ValueError:
+        return None
+
+
+def fuzz_dates(n):
+    rng = random.Random(11)
+    samples = [
+        "2024-02-29", "2023-02-29", "1900-02-29", "2000-02-29", "0000-01-01",
+        "2024-13-01", "2024-00-10", "2024-01-00", "2024-1-5", "2024-01-5",
+        " 2024-01-05", "2024-01-05 ", "２０２４-01-05", "2024/01/05", "",
+    ]
+    for _ in range(n):
+        y = rng.choice(["%04d" % rng.randint(0, 9999), str(rng.randint(1, 99))])
+        m = rng.choice(["%02d" % rng.randint(0, 13), str(rng.randint(1, 12))])
+        d = rng.choice(["%02d" % rng.randint(0, 32), str(rng.randint(1, 31))])
+        samples.append(f"{y}-{m}-{d}")
+
+    bad = [s for s in samples if nav_reader.iso_date(s) != strptime_iso(s)
+           or nav_reader.is_iso_date(s) != (strptime_iso(s) is not None)]
+    return len(samples), bad
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--schemes", type=int, default=500)
+    parser.add_argument("--fuzz", type=int, default=20000)
+    args = parser.parse_args()
+
+    files = sorted(f for f in os.listdir(SOURCE_DIR) if f.endswith(".csv"))
+    random.Random(3).shuffle(files)
+    paths = [os.path.join(SOURCE_DIR, f) for f in files[:args.schemes]]
+
+    # Warm the page cache so both sides read from memory.
+    for p in paths:
+        with open(p, "rb") as f:
+            f.read()
+
+    print(f"📊 {len(paths)} scheme files\n")
+    for name, slow, fast in CASES:
+        expected, slow_wall = run(slow, paths)
+        got, fast_wall = run(fast, paths)
+        rows = sum(len(r) for r in expected)
+        status = "✅" if got == expected else "❌ MISMATCH"
+        print(f"{name:>11}: baseline {rows / slow_wall:12,.0f} rows/s  "
+              f"fast {rows / fast_wall:12,.0f} rows/s  "
+              f"×{slow_wall / fast_wall:4.1f}  {status}")
+
+    total, bad = fuzz_dates(args.fuzz)
+    print(f"\n📅 date fuzz: {total} inputs, {len(bad)} mismatches"
+          + (f" e.g. {bad[:5]}" if bad else " ✅"))
+
+
+if __name__ == "__main__":
+    main()
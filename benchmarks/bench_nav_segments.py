@@ -0,0 +1,119 @@
+"""Size and daily churn of scripts/nav_segments.py against the CSV history.
+
+    python benchmarks/bench_nav_segments.py --schemes 14229 --days 20
+
+Copies the first ``--schemes`` files to a temporary directory, builds the
+segments, then simulates ``--days`` daily runs: one row appended to every
+scheme through the state index, then ``sync``.  For each run it counts
+the files and bytes that changed under ``nav_history`` and under
+``nav_segments`` (what ``git add data/`` has to hash and commit).  Ends
+with a compaction, a ``checkout`` into an empty directory and a byte for
+byte ``verify``.
+"""
+
+import argparse
+import hashlib
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "scripts"))
+
+import nav_segments  # noqa: E402
+import nav_state  # noqa: E402
+
+SOURCE_DIR = os.path.join(ROOT, "data", "nav_history")
+NEXT_DAY = "2099-01-01"
+
+
+def snapshot(root):
+    """``{name: (size, sha1)}`` for the files under ``root``."""
+    out = {}
+    for name in os.listdir(root):
+        with open(os.path.join(root, name), "rb") as f:
+            data = f.read()
+        out[name] = (len(data), hashlib.sha1(data).digest())
+    return out
+
+
+def churn(before, after):
+    """Files added or changed and their total bytes."""
+    changed = [n for n, v in after.items() if before.get(n) != v]
+    return len(changed), sum(after[n][0] for n in changed)
+
+
+def timed(fn):
+    start = time.perf_counter()
+    result = fn()
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--schemes", type=int, default=2000)
+    parser.add_argument("--days", type=int, default=5, help="Daily appends to simulate")
+    parser.add_argument("--hot-limit", type=int, default=nav_segments.HOT_LIMIT)
+    args = parser.parse_args()
+
+    if not nav_segments.available():
+        parser.error("numpy and zstandard are required (pip install zstandard)")
+
+    files = sorted(f for f in os.listdir(SOURCE_DIR) if f.endswith(".csv"))[:args.schemes]
+    work = tempfile.mkdtemp(prefix="bench_nav_segments_")
+    try:
+        nav_dir = os.path.join(work, "nav_history")
+        root = os.path.join(work, "nav_segments")
+        os.makedirs(nav_dir)
+        for f in files:
+            shutil.copy(os.path.join(SOURCE_DIR, f), nav_dir)
+        csv_bytes = sum(os.path.getsize(os.path.join(nav_dir, f)) for f in files)
+
+        _, build = timed(lambda: nav_segments.rebuild(nav_dir, root))
+        seg = snapshot(root)
+        seg_bytes = sum(v[0] for v in seg.values())
+        print(f"\n📊 {len(files):,} CSVs, {csv_bytes:,} bytes → {len(seg)} segments, "
+              f"{seg_bytes:,} bytes ({csv_bytes / seg_bytes:.1f}×) in {build:.1f}s\n")
+
+        csv_total = [0, 0]
+        seg_total = [0, 0]
+        with nav_state.NavState(os.path.join(work, "state.db")) as state:
+            nav_segments.sync(state, nav_dir, root, args.hot_limit)
+            day = nav_segments.np.datetime64(NEXT_DAY)
+            print(f"   {'day':<4} {'CSV files':>10} {'CSV bytes':>13} {'seg files':>10} "
+                  f"{'seg bytes':>12} {'sync s':>7}")
+            for i in range(args.days):
+                before_csv, before_seg = snapshot(nav_dir), snapshot(root)
+                stamp = str(day + i)
+                for f in files:
+                    state.append(f[:-4], os.path.join(nav_dir, f), [(stamp, f"{100 + i}.12345")])
+                _, took = timed(lambda: nav_segments.sync(state, nav_dir, root, args.hot_limit))
+                c = churn(before_csv, snapshot(nav_dir))
+                s = churn(before_seg, snapshot(root))
+                csv_total = [a + b for a, b in zip(csv_total, c)]
+                seg_total = [a + b for a, b in zip(seg_total, s)]
+                print(f"   {i + 1:<4} {c[0]:>10,} {c[1]:>13,} {s[0]:>10,} {s[1]:>12,} {took:>7.2f}")
+            print(f"   {'all':<4} {csv_total[0]:>10,} {csv_total[1]:>13,} "
+                  f"{seg_total[0]:>10,} {seg_total[1]:>12,}")
+
+            with nav_segments.SegmentStore(root) as store:
+                done, compact = timed(lambda: store.compact())
+            print(f"\n🧱 compact: {len(done)} segments in {compact:.2f}s")
+
+            out_dir = os.path.join(work, "checkout")
+            with nav_state.NavState(os.path.join(work, "checkout.db")) as fresh:
+                n, checkout = timed(lambda: nav_segments.checkout(fresh, out_dir, root))
+            print(f"📤 checkout: {n:,} CSVs in {checkout:.2f}s")
+
+        bad, verify = timed(lambda: nav_segments.verify(nav_dir, root))
+        print(f"{'❌' if bad else '✅'} verify: {len(bad)} mismatches in {verify:.2f}s")
+        same = snapshot(out_dir) == snapshot(nav_dir)
+        print(f"{'✅' if same else '❌'} checkout is byte for byte identical to the CSVs")
+    finally:
+        shutil.rmtree(work, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
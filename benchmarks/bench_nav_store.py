@@ -0,0 +1,100 @@
+"""Query latency of scripts/nav_store.py against scanning the CSV history.
+
+    python benchmarks/bench_nav_store.py --schemes 2000
+
+Builds a store for the first ``--schemes`` files in a temporary directory,
+then answers "NAV on a date for every scheme" and a one-year return both
+by reading the CSVs (``nav_reader.iter_valid``) and from the memory-mapped
+store, checks the answers agree and reports the times.
+"""
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "scripts"))
+
+import numpy as np  # noqa: E402
+
+import nav_reader  # noqa: E402
+import nav_state  # noqa: E402
+import nav_store  # noqa: E402
+
+SOURCE_DIR = os.path.join(ROOT, "data", "nav_history")
+
+
+def scan_nav_on(paths, date):
+    """Last NAV on or before ``date`` per file, the CSV way."""
+    out = []
+    for path in paths:
+        best_date, best = "", np.nan
+        for d, nav in nav_reader.iter_valid(path):
+            iso = nav_reader.iso_date(d)
+            if best_date <= iso <= date:
+                try:
+                    best_date, best = iso, float(nav)
+                except ValueError:
+                    continue
+        out.append(best)
+    return np.array(out)
+
+
+def timed(fn):
+    start = time.perf_counter()
+    result = fn()
+    return result, time.perf_counter() - start
+
+
+def same(a, b):
+    return bool(np.all((a == b) | (np.isnan(a) & np.isnan(b))))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--schemes", type=int, default=2000)
+    parser.add_argument("--start", default="2024-01-31")
+    parser.add_argument("--end", default="2025-01-31")
+    args = parser.parse_args()
+
+    files = sorted(f for f in os.listdir(SOURCE_DIR) if f.endswith(".csv"))[:args.schemes]
+    work = tempfile.mkdtemp(prefix="bench_nav_store_")
+    try:
+        nav_dir = os.path.join(work, "nav_history")
+        os.makedirs(nav_dir)
+        for f in files:
+            shutil.copy(os.path.join(SOURCE_DIR, f), nav_dir)
+        store_dir = os.path.join(work, "store")
+        paths = [os.path.join(nav_dir, f) for f in sorted(files, key=lambda f: int(f[:-4]))]
+
+        with nav_state.NavState(os.path.join(work, "state.db")) as state:
+            (store, _), build = timed(lambda: nav_store.refresh(state, nav_dir, store_dir))
+            _, noop = timed(lambda: nav_store.refresh(state, nav_dir, store_dir))
+        store, load = timed(lambda: nav_store.NavStore.load(store_dir))
+        print(f"📊 {len(store):,} schemes, {store.rows:,} rows")
+        print(f"   build {build:.2f}s  refresh (no change) {noop * 1000:.0f} ms  "
+              f"load {load * 1000:.1f} ms\n")
+
+        expected, scan = timed(lambda: scan_nav_on(paths, args.end))
+        got, query = timed(lambda: store.nav_on(args.end))
+        print(f"nav_on : csv {scan:7.2f}s  store {query * 1000:7.2f} ms  "
+              f"×{scan / query:,.0f}  {'✅' if same(got, expected) else '❌ MISMATCH'}")
+
+        def scan_returns():
+            first = scan_nav_on(paths, args.start)
+            with np.errstate(divide="ignore", invalid="ignore"):
+                return np.where(first > 0, expected / first, np.nan) - 1
+
+        expected_r, scan = timed(scan_returns)
+        got_r, query = timed(lambda: store.returns(args.start, args.end))
+        print(f"returns: csv {scan:7.2f}s  store {query * 1000:7.2f} ms  "
+              f"×{scan / query:,.0f}  {'✅' if same(got_r, expected_r) else '❌ MISMATCH'}")
+    finally:
+        shutil.rmtree(work, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
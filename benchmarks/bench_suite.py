@@ -0,0 +1,274 @@
+"""Time every pipeline stage on a synthetic dataset and keep the results.
+
+    python benchmarks/bench_suite.py                          # 2,000 schemes × 10 years
+    python benchmarks/bench_suite.py --schemes 14000 --years 20
+    python benchmarks/bench_suite.py --cases nav_year_rebuild,fetch_delta
+    python benchmarks/bench_suite.py --compare HEAD~3
+
+The dataset (``synthetic.py``) is generated once per parameter set under
+``.cache/bench/datasets`` and copied to a scratch directory for each run.
+Cases run in the order of ``CASES`` on that one copy, each as its own
+process started there, the way the workflows run the scripts, with
+``MF_QUIET=1`` and ``MF_METRICS`` set.  A case records wall time, child
+CPU time and peak RSS, plus the rows written and HTTP percentiles from its
+``instrument`` report.
+
+``fetch_delta`` runs ``fetch_nav_history.py --delta`` on the dataset's
+NAVAll.txt against the stub mfapi server (``--latency``, ``--jitter``,
+``--error-rate``), which serves the dataset's own series, so lagging
+schemes get backfilled and the incremental cases after it have new rows
+to export.
+
+Every run is appended to ``.cache/bench/results.jsonl`` with the commit it
+measured.  The table compares each case with the previous run of the same
+parameters, or with the latest one at ``--compare <commit>``.
+"""
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCRIPTS = os.path.join(ROOT, "scripts")
+sys.path.insert(0, SCRIPTS)
+
+import synthetic  # noqa: E402
+from stub_mfapi import StubMfapi  # noqa: E402
+
+BENCH_DIR = os.path.join(ROOT, ".cache", "bench")
+RESULTS_FILE = os.path.join(BENCH_DIR, "results.jsonl")
+THRESHOLD = 0.10   # slower than the baseline by more than this is flagged
+NOISE = 0.05       # ... unless it is within this many seconds
+
+# (case, script, arguments): run in this order on one working copy
+CASES = [
+    ("state_index", "nav_state.py", []),
+    ("nav_year_rebuild", "export_nav_year.py", ["--rebuild"]),
+    ("nav_year_noop", "export_nav_year.py", []),
+    ("history_all_rebuild", "export_nav_history_all.py", ["--rebuild"]),
+    ("history_all_noop", "export_nav_history_all.py", []),
+    ("merge_full", "merge_scheme_metadata.py", ["--full"]),
+    ("merge_noop", "merge_scheme_metadata.py", []),
+    ("metrics_full", "nav_metrics.py", ["--full"]),
+    ("validate_full", "nav_validate.py", ["--full"]),
+    ("fetch_delta", "fetch_nav_history.py", ["--delta", "--navall", "NAVAll.txt"]),
+    ("nav_year_incremental", "export_nav_year.py", []),
+    ("history_all_incremental", "export_nav_history_all.py", []),
+    ("history_all_compact", "export_nav_history_all.py", ["--compact"]),
+    ("metrics_incremental", "nav_metrics.py", []),
+    ("validate_incremental", "nav_validate.py", []),
+]
+
+
+# ---------- RUN ----------
+def run_case(name, script, args, work, env):
+    """Run one script in ``work``; returns the case's result dict."""
+    logs = os.path.join(work, ".bench")
+    report_path = os.path.join(logs, f"{name}.json")
+    env = dict(env, MF_QUIET="1", MF_METRICS=report_path)
+    cmd = [sys.executable, os.path.join(SCRIPTS, script), *args]
+
+    start = time.perf_counter()
+    with open(os.path.join(logs, f"{name}.log"), "w", encoding="utf-8") as log:
+        proc = subprocess.Popen(cmd, cwd=work, env=env, stdout=log, stderr=subprocess.STDOUT)
+        usage = None
+        if hasattr(os, "wait4"):
+            _, status, usage = os.wait4(proc.pid, 0)
+            proc.returncode = os.waitstatus_to_exitcode(status)
+        else:
+            proc.wait()
+    wall = time.perf_counter() - start
+
+    result = {"status": "ok" if proc.returncode == 0 else f"exit {proc.returncode}",
+              "wall": round(wall, 3)}
+    if usage is not None:
+        result["cpu"] = round(usage.ru_utime + usage.ru_stime, 3)
+        # ru_maxrss is KiB on Linux, bytes on macOS
+        scale = 1 if sys.platform == "darwin" else 1024
+        result["max_rss_mb"] = round(usage.ru_maxrss * scale / 2 ** 20, 1)
+
+    try:
+        with open(report_path, encoding="utf-8") as f:
+            report = json.load(f)
+    except (OSError, ValueError):
+        return result
+    totals = report.get("totals", {})
+    for key in ("rows_read", "rows_written", "bytes_written", "http_requests"):
+        if totals.get(key):
+            result[key] = totals[key]
+    http = report.get("http", {}).get("all")
+    if http:
+        for key in ("p50_ms", "p95_ms", "p99_ms"):
+            result[f"http_{key}"] = http[key]
+    result["stages"] = {s["stage"]: s["wall"] for s in report.get("stages", [])}
+    return result
+
+
+def run_suite(dataset, cases, params, keep=False):
+    work = tempfile.mkdtemp(prefix="mf-bench-")
+    results = {}
+    try:
+        print(f"📁 Copying dataset → {work}")
+        shutil.copytree(os.path.join(dataset, "data"), os.path.join(work, "data"))
+        shutil.copy(os.path.join(dataset, "NAVAll.txt"), work)
+        os.makedirs(os.path.join(work, ".bench"))
+
+        days = synthetic.calendar(params["seed"], params["years"])
+        stub = StubMfapi(
+            latency=params["latency"], jitter=params["jitter"],
+            error_rate=params["error_rate"],
+            history=lambda code: synthetic.mfapi_history(
+                code, params["seed"], params["years"], days=days),
+        )
+        with stub:
+            env = dict(os.environ)
+            for name, script, args in cases:
+                if name == "fetch_delta":
+                    args = args + ["--api-url", stub.url]
+                print(f"⏱️ {name} ...", end=" ", flush=True)
+                results[name] = run_case(name, script, args, work, env)
+                print(f"{results[name]['wall']:.2f}s {results[name]['status']}")
+                if results[name]["status"] != "ok":
+                    with open(os.path.join(work, ".bench", f"{name}.log"), encoding="utf-8") as f:
+                        print("".join(f.readlines()[-15:]))
+    finally:
+        if keep:
+            print(f"📂 Working copy kept at {work}")
+        else:
+            shutil.rmtree(work, ignore_errors=True)
+    return results
+
+
+# ---------- RESULTS ----------
+def git(*args):
+    try:
+        out = subprocess.run(["git", *args], cwd=ROOT, capture_output=True, text=True, check=True)
+        return out.stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def load_results(path):
+    if not os.path.exists(path):
+        return []
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def baseline(history, params, ref=None):
+    """Latest earlier run with the same parameters (at commit ``ref``)."""
+    same = [r for r in history if r.get("params") == params]
+    if ref:
+        sha = git("rev-parse", "--verify", f"{ref}^{{commit}}") or ref
+        same = [r for r in same if (r.get("commit") or "").startswith(sha)]
+    return same[-1] if same else None
+
+
+def _num(x, digits):
+    return "-" if x is None else f"{x:.{digits}f}"
+
+
+def print_table(results, base, threshold=THRESHOLD):
+    """Print the comparison; returns the cases that got slower."""
+    where = ""
+    if base:
+        where = f" vs {(base.get('commit') or '?')[:10]}{' (dirty)' if base.get('dirty') else ''}"
+    print(f"\n📊 Benchmark results{where}")
+    print(f"   {'case':<24} {'wall s':>8} {'base s':>8} {'change':>8} {'cpu s':>8} "
+          f"{'rss MB':>8}  notes")
+    slower = []
+    for name, r in results.items():
+        before = (base or {}).get("cases", {}).get(name, {}).get("wall")
+        change, flag = "", ""
+        if before:
+            delta = r["wall"] / before - 1
+            change = f"{delta:+.0%}"
+            if delta > threshold and r["wall"] - before > NOISE:
+                flag = "⚠️ slower"
+                slower.append(name)
+            elif delta < -threshold and before - r["wall"] > NOISE:
+                flag = "🚀 faster"
+        notes = [flag] if flag else []
+        if r["status"] != "ok":
+            notes.append(f"❌ {r['status']}")
+        if r.get("rows_written"):
+            notes.append(f"{r['rows_written']:,} rows")
+        if r.get("http_requests"):
+            notes.append(f"{r['http_requests']:,} req p50/p95/p99 "
+                         f"{r['http_p50_ms']}/{r['http_p95_ms']}/{r['http_p99_ms']} ms")
+        print(f"   {name:<24} {r['wall']:8.2f} {_num(before, 2):>8} {change:>8} "
+              f"{_num(r.get('cpu'), 2):>8} {_num(r.get('max_rss_mb'), 1):>8}  {'  '.join(notes)}")
+    return slower
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--schemes", type=int, default=2000)
+    parser.add_argument("--years", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--lag", type=float, default=synthetic.LAG,
+                        help="Share of schemes needing an API backfill in fetch_delta")
+    parser.add_argument("--latency", type=float, default=0.02, help="Stub delay per request (s)")
+    parser.add_argument("--jitter", type=float, default=0.01,
+                        help="Mean extra exponential stub delay (s)")
+    parser.add_argument("--error-rate", type=float, default=0.02,
+                        help="Share of stub responses that are 503")
+    parser.add_argument("--cases", help=f"Comma-separated subset of: {', '.join(c[0] for c in CASES)}")
+    parser.add_argument("--compare", metavar="COMMIT", help="Baseline commit (default: previous run)")
+    parser.add_argument("--threshold", type=float, default=THRESHOLD,
+                        help="Relative slowdown reported as a regression")
+    parser.add_argument("--fail-on-regression", action="store_true",
+                        help="Exit 1 when a case is slower than the baseline")
+    parser.add_argument("--results", default=RESULTS_FILE, help="Results history (JSON lines)")
+    parser.add_argument("--datasets", default=os.path.join(BENCH_DIR, "datasets"),
+                        help="Where generated datasets are kept")
+    parser.add_argument("--keep", action="store_true", help="Keep the working copy")
+    parser.add_argument("--no-save", action="store_true", help="Do not record this run")
+    args = parser.parse_args()
+
+    cases = CASES
+    if args.cases:
+        wanted = {c.strip() for c in args.cases.split(",") if c.strip()}
+        unknown = wanted - {c[0] for c in CASES}
+        if unknown:
+            parser.error(f"unknown cases: {', '.join(sorted(unknown))}")
+        cases = [c for c in CASES if c[0] in wanted]
+
+    params = {"schemes": args.schemes, "years": args.years, "seed": args.seed,
+              "lag": args.lag, "latency": args.latency, "jitter": args.jitter,
+              "error_rate": args.error_rate}
+    dataset = synthetic.ensure(args.datasets, args.schemes, args.years, args.seed, lag=args.lag)
+    results = run_suite(dataset, cases, params, keep=args.keep)
+
+    history = load_results(args.results)
+    slower = print_table(results, baseline(history, params, args.compare), args.threshold)
+
+    if not args.no_save:
+        record = {
+            "commit": git("rev-parse", "HEAD"),
+            "dirty": bool(git("status", "--porcelain", "--untracked-files=no")),
+            "subject": git("log", "-1", "--format=%s"),
+            "date": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "machine": f"{platform.system()} {platform.machine()} ({os.cpu_count()} CPUs)",
+            "params": params,
+            "cases": results,
+        }
+        os.makedirs(os.path.dirname(args.results) or ".", exist_ok=True)
+        with open(args.results, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record) + "\n")
+        print(f"\n💾 Results appended → {args.results}")
+
+    if slower and args.fail_on_regression:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
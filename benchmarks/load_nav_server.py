@@ -0,0 +1,299 @@
+"""Load-test the NAV query service and report latency percentiles.
+
+    python benchmarks/load_nav_server.py                         # 2,000 schemes × 10 years
+    python benchmarks/load_nav_server.py --connections 64 --duration 30 --update 200
+    python benchmarks/load_nav_server.py --url http://127.0.0.1:8080 --index data/scheme_index.csv
+
+Without ``--url`` the synthetic dataset (``synthetic.py``) is copied to a
+scratch directory, ``merge_scheme_metadata.py --full`` builds its
+``scheme_index.csv`` and ``scripts/nav_server.py`` is started there on a
+free port.  ``--update N`` appends a NAV row to N schemes through the state
+index half-way through, so the run also covers an incremental reload.
+
+Each of ``--connections`` keep-alive clients sends requests back to back
+for ``--duration`` seconds, drawn from a mix of whole scheme histories,
+one-year ranges, ``/nav/latest``, category snapshots and revalidations of
+an earlier response with ``If-None-Match``.  Scheme codes are skewed
+(``HOT_SHARE`` of the requests go to ``HOT_CODES`` of the schemes), the
+way app traffic is.  The report gives throughput and p50/p95/p99/max
+latency per request kind, the status codes, and the server's cache hit
+rate from ``/stats``.
+"""
+
+import argparse
+import asyncio
+import csv
+import gzip
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import date, timedelta
+from urllib.parse import quote, urlsplit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCRIPTS = os.path.join(ROOT, "scripts")
+sys.path.insert(0, SCRIPTS)
+
+import nav_state  # noqa: E402
+import synthetic  # noqa: E402
+
+BENCH_DIR = os.path.join(ROOT, ".cache", "bench")
+HOT_CODES = 0.1    # share of schemes that get ...
+HOT_SHARE = 0.8    # ... this share of the scheme requests
+
+# (kind, weight)
+MIX = [
+    ("scheme_full", 25),
+    ("scheme_year", 35),
+    ("latest", 5),
+    ("category", 15),
+    ("revalidate", 20),
+]
+
+
+# ---------- SERVER ----------
+def start_server(work, poll):
+    """Start nav_server.py in ``work``; returns ``(process, url)``."""
+    cmd = [sys.executable, os.path.join(SCRIPTS, "nav_server.py"), "--port", "0", "--poll", str(poll)]
+    proc = subprocess.Popen(cmd, cwd=work, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                            text=True, env=dict(os.environ, MF_QUIET="1"))
+    for line in proc.stdout:
+        print(f"   {line.rstrip()}")
+        if "Serving on " in line:
+            url = line.split("Serving on ", 1)[1].strip()
+            break
+    else:
+        raise SystemExit(f"❌ nav_server.py exited with {proc.wait()}")
+
+    def drain():
+        for line in proc.stdout:
+            print(f"\n   {line.rstrip()}")
+
+    threading.Thread(target=drain, daemon=True).start()
+    return proc, url
+
+
+def prepare(dataset):
+    work = tempfile.mkdtemp(prefix="mf-serve-")
+    print(f"📁 Copying dataset → {work}")
+    shutil.copytree(os.path.join(dataset, "data"), os.path.join(work, "data"))
+    subprocess.run([sys.executable, os.path.join(SCRIPTS, "merge_scheme_metadata.py"), "--full"],
+                   cwd=work, check=True, stdout=subprocess.DEVNULL,
+                   env=dict(os.environ, MF_QUIET="1"))
+    return work
+
+
+def append_rows(work, codes):
+    """Append one NAV row (a day after the last) to each of ``codes``."""
+    nav_dir = os.path.join(work, nav_state.NAV_DIR)
+    with nav_state.NavState(os.path.join(work, nav_state.STATE_FILE)) as state:
+        for code in codes:
+            path = os.path.join(nav_dir, f"{code}.csv")
+            last = state.lookup(str(code), path).last_date
+            if last:
+                day = (date.fromisoformat(last) + timedelta(days=1)).isoformat()
+                state.append(str(code), path, [(day, "10.0")])
+        state.commit()
+
+
+# ---------- CLIENT ----------
+class Client:
+    """One keep-alive connection speaking just enough HTTP/1.1."""
+
+    def __init__(self, host, port):
+        self.host, self.port = host, port
+        self.reader = self.writer = None
+
+    async def get(self, path, etag=None):
+        """``(status, etag, body bytes)``."""
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        head = f"GET {path} HTTP/1.1\r\nHost: {self.host}\r\nAccept-Encoding: gzip\r\n"
+        if etag:
+            head += f"If-None-Match: {etag}\r\n"
+        self.writer.write((head + "\r\n").encode("latin-1"))
+        await self.writer.drain()
+        lines = (await self.reader.readuntil(b"\r\n\r\n")).decode("latin-1").split("\r\n")
+        headers = {}
+        for line in lines[1:]:
+            name, _, value = line.partition(":")
+            headers[name.strip().lower()] = value.strip()
+        body = await self.reader.readexactly(int(headers.get("content-length", 0)))
+        if headers.get("connection", "").lower() == "close":
+            await self.close()
+        return int(lines[0].split(" ")[1]), headers.get("etag"), body
+
+    async def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.reader = self.writer = None
+
+
+class Workload:
+    def __init__(self, codes, categories, last_day, seed):
+        self.rng = random.Random(seed)
+        codes = list(codes)
+        self.rng.shuffle(codes)
+        self.hot = codes[:max(1, int(len(codes) * HOT_CODES))]
+        self.codes = codes
+        self.categories = categories
+        self.last_day = last_day
+        self.kinds = [k for k, _ in MIX]
+        self.weights = [w for _, w in MIX]
+
+    def code(self):
+        return self.rng.choice(self.hot if self.rng.random() < HOT_SHARE else self.codes)
+
+    def next(self, seen):
+        """``(kind, path, etag)``; ``seen`` holds this client's ETags."""
+        kind = self.rng.choices(self.kinds, self.weights)[0]
+        if kind == "revalidate" and seen:
+            path = self.rng.choice(list(seen))
+            return kind, path, seen[path]
+        if kind in ("revalidate", "scheme_full"):
+            return "scheme_full", f"/scheme/{self.code()}/nav", None
+        if kind == "scheme_year":
+            end = self.last_day - timedelta(days=self.rng.randrange(0, 3650, 30))
+            return kind, f"/scheme/{self.code()}/nav?from={end - timedelta(days=365)}&to={end}", None
+        if kind == "latest":
+            return kind, "/nav/latest", None
+        name = self.rng.choice(self.categories)
+        start = self.last_day - timedelta(days=365)
+        return kind, f"/category/{quote(name, safe='')}/snapshot?date={self.last_day}&start={start}", None
+
+
+async def worker(url, workload, deadline, samples, statuses):
+    parts = urlsplit(url)
+    client = Client(parts.hostname, parts.port)
+    seen = {}
+    try:
+        while time.perf_counter() < deadline:
+            kind, path, etag = workload.next(seen)
+            start = time.perf_counter()
+            status, tag, _ = await client.get(path, etag)
+            samples.setdefault(kind, []).append(time.perf_counter() - start)
+            statuses[status] = statuses.get(status, 0) + 1
+            if tag and status == 200:
+                seen[path] = tag
+                if len(seen) > 64:
+                    seen.pop(next(iter(seen)))
+    finally:
+        await client.close()
+
+
+async def fetch_json(url, path):
+    parts = urlsplit(url)
+    client = Client(parts.hostname, parts.port)
+    try:
+        status, _, body = await client.get(path)
+    finally:
+        await client.close()
+    if body[:2] == b"\x1f\x8b":
+        body = gzip.decompress(body)
+    if status != 200:
+        raise SystemExit(f"❌ {path}: HTTP {status}")
+    return json.loads(body)
+
+
+async def run_load(url, args, categories, work=None):
+    latest = await fetch_json(url, "/nav/latest")
+    codes = [row[0] for row in latest["data"]]
+    last_day = date.fromisoformat(max(row[1] for row in latest["data"]))
+    before = await fetch_json(url, "/stats")
+
+    samples, statuses = {}, {}
+    start = time.perf_counter()
+    deadline = start + args.duration
+    tasks = [asyncio.ensure_future(worker(url, Workload(codes, categories, last_day, args.seed + i),
+                                          deadline, samples, statuses))
+             for i in range(args.connections)]
+    if args.update and work:
+        await asyncio.sleep(args.duration / 2)
+        changed = random.Random(args.seed).sample(codes, min(args.update, len(codes)))
+        print(f"✏️ Appending a row to {len(changed):,} schemes ...", flush=True)
+        await asyncio.to_thread(append_rows, work, changed)
+    await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - start
+    after = await fetch_json(url, "/stats")
+    return samples, statuses, elapsed, before, after
+
+
+# ---------- REPORT ----------
+def percentile(sorted_values, q):
+    return sorted_values[min(len(sorted_values) - 1, int(q * len(sorted_values)))]
+
+
+def report(samples, statuses, elapsed, before, after):
+    total = sum(len(v) for v in samples.values())
+    print(f"\n📊 {total:,} requests in {elapsed:.1f}s = {total / elapsed:,.0f} req/s")
+    print(f"   {'kind':<14} {'count':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'max ms':>8}")
+    rows = sorted(samples.items()) + [("all", [x for v in samples.values() for x in v])]
+    for kind, values in rows:
+        values = sorted(values)
+        ms = [percentile(values, q) * 1000 for q in (0.5, 0.95, 0.99)] + [values[-1] * 1000]
+        print(f"   {kind:<14} {len(values):>8,} " + " ".join(f"{x:8.2f}" for x in ms))
+    print(f"🔢 Status: {', '.join(f'{k} × {v:,}' for k, v in sorted(statuses.items()))}")
+    hits = after["cache"]["hits"] - before["cache"]["hits"]
+    misses = after["cache"]["misses"] - before["cache"]["misses"]
+    print(f"🗄️ Cache: {hits / max(1, hits + misses):.1%} hits, {after['cache']['entries']:,} entries, "
+          f"{after['cache']['bytes'] / 2 ** 20:.1f} MB; reloads {after.get('reloads', 0) - before.get('reloads', 0)}")
+
+
+def read_categories(index_file):
+    names = set()
+    with open(index_file, newline="", encoding="utf-8") as f:
+        for row in csv.DictReader(f):
+            names.update(n for n in (row.get("Category"), row.get("SubCategory")) if n)
+    return sorted(names)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", help="Load-test a running server instead of starting one")
+    parser.add_argument("--index", help="scheme_index.csv for category names (with --url)")
+    parser.add_argument("--schemes", type=int, default=2000)
+    parser.add_argument("--years", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--connections", type=int, default=32)
+    parser.add_argument("--duration", type=float, default=10.0, help="Seconds of load")
+    parser.add_argument("--update", type=int, default=0,
+                        help="Append a row to this many schemes half-way through")
+    parser.add_argument("--poll", type=float, default=1.0, help="Server reload poll interval (s)")
+    parser.add_argument("--datasets", default=os.path.join(BENCH_DIR, "datasets"),
+                        help="Where generated datasets are kept")
+    parser.add_argument("--keep", action="store_true", help="Keep the working copy")
+    args = parser.parse_args()
+    if args.url and not args.index:
+        parser.error("--url needs --index")
+
+    proc = work = None
+    try:
+        if args.url:
+            url, index_file = args.url, args.index
+        else:
+            dataset = synthetic.ensure(args.datasets, args.schemes, args.years, args.seed)
+            work = prepare(dataset)
+            proc, url = start_server(work, args.poll)
+            index_file = os.path.join(work, "data", "scheme_index.csv")
+        categories = read_categories(index_file)
+        print(f"🚀 {args.connections} connections for {args.duration:g}s against {url}")
+        report(*asyncio.run(run_load(url, args, categories, work)))
+    finally:
+        if proc is not None:
+            proc.terminate()
+            proc.wait()
+        if work:
+            if args.keep:
+                print(f"📂 Working copy kept at {work}")
+            else:
+                shutil.rmtree(work, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,191 @@
+"""Local stand-in for ``https://api.mfapi.in/mf/<code>`` used by benchmarks.
+
+Serves deterministic synthetic histories with keep-alive enabled, an
+optional per-request latency and a request counter.  Responses carry an
+``ETag`` and ``Last-Modified``; matching conditional requests get a bodiless
+304.  ``bump(code)`` publishes one more business day for a scheme.
+``error_rate`` answers that share of requests with a 503 (``Retry-After:
+0``); ``max_inflight`` answers 429 once more requests than that are being
+served at once, like a rate-limiting front end.  ``jitter`` adds an
+exponentially distributed delay with that mean on top of ``latency``, for
+a realistic latency tail.  ``history(code)`` replaces the built-in series
+(e.g. ``synthetic.mfapi_history`` to serve a generated dataset).
+"""
+
+import hashlib
+import json
+import random
+import threading
+import time
+from datetime import date, timedelta
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def synthetic_history(code, days=250, end=None):
+    """mfapi-style ``data`` list (newest first) for ``days`` business days."""
+    rng = random.Random(int(code))
+    end = end or date.today()
+    nav = 10 + rng.random() * 90
+    rows = []
+    d = end
+    while len(rows) < days:
+        if d.weekday() < 5:
+            rows.append({"date": d.strftime("%d-%m-%Y"), "nav": f"{nav:.5f}"})
+            nav *= 1 + rng.uniform(-0.01, 0.0105)
+        d -= timedelta(days=1)
+    return rows
+
+
+class StubMfapi:
+    def __init__(self, latency=0.0, days=250, end=None, validators=True,
+                 error_rate=0.0, max_inflight=None, seed=5,
+                 host="127.0.0.1", port=0, jitter=0.0, history=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.history = history
+        self.error_rate = error_rate
+        self.max_inflight = max_inflight
+        self.errors = 0
+        self.throttled = 0
+        self._inflight = 0
+        self._rng = random.Random(seed)
+        self.validators = validators
+        self.days = days
+        self.end = end
+        self.requests = 0
+        self.not_modified = 0
+        self.bytes_sent = 0
+        self._lock = threading.Lock()
+        self._cache = {}
+        self._ends = {}
+
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True
+
+            def do_GET(self):
+                parts = self.path.strip("/").split("/")
+                if len(parts) != 2 or parts[0] != "mf" or not parts[1].isdigit():
+                    self.send_error(404)
+                    return
+                status = stub.admit()
+                if status is not None:
+                    self.send_response(status)
+                    self.send_header("Retry-After", "0")
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                try:
+                    delay = stub.delay()
+                    if delay:
+                        time.sleep(delay)
+                finally:
+                    with stub._lock:
+                        stub._inflight -= 1
+                body, etag, modified = stub.body_for(parts[1])
+                if stub.validators and (
+                        self.headers.get("If-None-Match") == etag
+                        or self.headers.get("If-Modified-Since") == modified):
+                    self.send_response(304)
+                    self.send_header("ETag", etag)
+                    self.send_header("Last-Modified", modified)
+                    self.end_headers()
+                    with stub._lock:
+                        stub.not_modified += 1
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                if stub.validators:
+                    self.send_header("ETag", etag)
+                    self.send_header("Last-Modified", modified)
+                self.end_headers()
+                self.wfile.write(body)
+                with stub._lock:
+                    stub.bytes_sent += len(body)
+
+            def log_message(self, *args):
+                pass
+
+        class Server(ThreadingHTTPServer):
+            # The default backlog of 5 drops SYNs under a burst of new
+            # connections, which shows up as 1 s retransmit latencies.
+            request_queue_size = 256
+            daemon_threads = True
+
+        self.server = Server((host, port), Handler)
+        self._thread = None
+
+    def admit(self):
+        """``None`` to serve the request, else the error status to send."""
+        with self._lock:
+            self.requests += 1
+            if self.max_inflight is not None and self._inflight >= self.max_inflight:
+                self.throttled += 1
+                return 429
+            if self.error_rate and self._rng.random() < self.error_rate:
+                self.errors += 1
+                return 503
+            self._inflight += 1
+            return None
+
+    def delay(self):
+        if not self.jitter:
+            return self.latency
+        with self._lock:
+            return self.latency + self._rng.expovariate(1 / self.jitter)
+
+    def body_for(self, code):
+        """``(body, etag, last_modified)`` for the scheme's current history."""
+        cached = self._cache.get(code)
+        if cached is None:
+            end = self._ends.get(code, self.end or date.today())
+            payload = {
+                "meta": {
+                    "scheme_code": int(code),
+                    "fund_house": "Stub Mutual Fund",
+                    "scheme_type": "Open Ended Schemes",
+                    "scheme_category": "Equity Scheme - Large Cap Fund",
+                },
+                "data": (self.history(code) if self.history
+                         else synthetic_history(code, self.days, end)),
+                "status": "SUCCESS",
+            }
+            body = json.dumps(payload).encode()
+            etag = '"%s"' % hashlib.sha1(body).hexdigest()
+            modified = formatdate(time.mktime(end.timetuple()), usegmt=True)
+            cached = self._cache[code] = (body, etag, modified)
+        return cached
+
+    def bump(self, code):
+        """Publish the next business day's NAV for ``code``."""
+        end = self._ends.get(code, self.end or date.today()) + timedelta(days=1)
+        while end.weekday() >= 5:
+            end += timedelta(days=1)
+        self._ends[code] = end
+        self._cache.pop(code, None)
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}/mf/{{code}}"
+
+    def reset_counters(self):
+        with self._lock:
+            self.requests = 0
+            self.errors = 0
+            self.throttled = 0
+            self.not_modified = 0
+            self.bytes_sent = 0
+
+    def __enter__(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
@@ -0,0 +1,235 @@
+"""Synthetic NAV datasets for the benchmark suite.
+
+    python benchmarks/synthetic.py --schemes 14000 --years 20 --out /tmp/navdata
+
+Writes the tree the pipeline scripts run on, rooted at ``--out``::
+
+    data/nav_history/<code>.csv     Date,NAV on business days, ascending
+    data/scheme_codes.csv           as fetch_scheme_codes.py writes it
+    data/scheme_categories.csv      as fetch_scheme_categories.py writes it
+    NAVAll.txt                      AMFI's latest-NAV file dated ``end``
+    dataset.json                    the parameters (written last)
+
+Every series follows from ``(seed, code)``, so :func:`mfapi_history` serves
+the same NAVs through the stub mfapi server.  Schemes start on staggered
+dates (a share of them run the whole ``years``), a few closed early (they
+have history but are missing from NAVAll.txt and scheme_codes.csv), and
+market holidays are shared by all schemes.  Live schemes end one business
+day before ``end``, so NAVAll.txt is their next NAV for the daily delta;
+``lag`` of them end a few business days earlier and need an API backfill.
+"""
+
+import argparse
+import csv
+import json
+import os
+import shutil
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "scripts"))
+
+import categories  # noqa: E402
+import navall  # noqa: E402
+
+END = date(2025, 12, 31)
+FIRST_CODE = 100000
+AMCS = 45
+HOLIDAYS_PER_YEAR = 14
+FULL_HISTORY = 0.4    # share of schemes that exist for all ``years``
+CLOSED = 0.03         # share that stopped publishing NAVs
+LAG = 0.05            # share of live schemes a few days behind (API backfill)
+
+# (scheme type, mfapi scheme_category, daily volatility range)
+KINDS = [
+    ("Open Ended Schemes", "Equity Scheme - Large Cap Fund", (0.008, 0.013)),
+    ("Open Ended Schemes", "Equity Scheme - Mid Cap Fund", (0.010, 0.016)),
+    ("Open Ended Schemes", "Equity Scheme - Small Cap Fund", (0.012, 0.019)),
+    ("Open Ended Schemes", "Equity Scheme - Flexi Cap Fund", (0.009, 0.014)),
+    ("Open Ended Schemes", "Equity Scheme - ELSS", (0.009, 0.014)),
+    ("Open Ended Schemes", "Hybrid Scheme - Aggressive Hybrid Fund", (0.006, 0.010)),
+    ("Open Ended Schemes", "Debt Scheme - Liquid Fund", (0.0001, 0.0003)),
+    ("Open Ended Schemes", "Debt Scheme - Short Duration Fund", (0.0005, 0.0015)),
+    ("Open Ended Schemes", "Debt Scheme - Gilt Fund", (0.001, 0.003)),
+    ("Open Ended Schemes", "Other Scheme - Index Funds", (0.008, 0.013)),
+    ("Close Ended Schemes", "Debt Scheme - Fixed Maturity Plan", (0.0003, 0.0008)),
+]
+PLANS = ["Regular Plan - Growth", "Direct Plan - Growth",
+         "Regular Plan - IDCW", "Direct Plan - IDCW"]
+
+
+# ---------- CALENDAR & SERIES ----------
+def calendar(seed, years, end=END):
+    """Business days from ``years`` before ``end`` through ``end``, minus
+    holidays shared by every scheme (none in the last three weeks)."""
+    last = np.datetime64(end, "D")
+    first = last - np.timedelta64(int(years * 365.25), "D")
+    days = np.arange(first, last + np.timedelta64(1, "D"))
+    days = days[np.is_busday(days)]
+
+    rng = np.random.default_rng([seed, 0])
+    eligible = np.flatnonzero(days < last - np.timedelta64(21, "D"))
+    holidays = rng.choice(eligible, size=min(len(eligible), int(years * HOLIDAYS_PER_YEAR)),
+                          replace=False)
+    return np.delete(days, holidays)
+
+
+def scheme(seed, code, n_days, lag=LAG):
+    """Plan for one scheme: ``(first, file_end, series_end, kind, plan, navs)``.
+
+    ``first..file_end`` are calendar positions on disk; ``series_end`` is
+    the last NAV published (``n_days - 1`` for live schemes).  ``navs``
+    covers ``first..series_end`` rounded to 4 decimals, like AMFI.
+    """
+    rng = np.random.default_rng([seed, code])
+    kind = int(rng.integers(len(KINDS)))
+    plan = int(rng.integers(len(PLANS)))
+    first = 0 if rng.random() < FULL_HISTORY or n_days < 600 else int(rng.integers(0, n_days - 300))
+
+    series_end = n_days - 1
+    file_end = n_days - 2
+    if rng.random() < CLOSED and series_end - first > 400:
+        series_end = file_end = int(rng.integers(first + 250, n_days - 60))
+    elif rng.random() < lag:
+        file_end = n_days - 2 - int(rng.integers(2, 9))
+
+    lo, hi = KINDS[kind][2]
+    sigma = rng.uniform(lo, hi)
+    drift = rng.uniform(-0.2, 1.0) * sigma ** 2 * 20 + 0.00008
+    steps = rng.normal(drift, sigma, series_end - first + 1)
+    steps[0] = 0.0
+    navs = np.round(rng.uniform(10, 200) * np.exp(np.cumsum(steps)), 4)
+    return first, file_end, series_end, kind, plan, navs
+
+
+def amc_of(code):
+    return f"Synthetic {(code * 7919) % AMCS + 1:02d} Mutual Fund"
+
+
+def mfapi_history(code, seed, years, end=END, days=None):
+    """mfapi ``data`` rows (newest first) for everything ``code`` published."""
+    days = calendar(seed, years, end) if days is None else days
+    first, _, series_end, _, _, navs = scheme(seed, int(code), len(days))
+    stamps = days[first:series_end + 1].astype(object)
+    return [{"date": d.strftime("%d-%m-%Y"), "nav": f"{v:.5f}"}
+            for d, v in zip(reversed(stamps), reversed(navs.tolist()))]
+
+
+# ---------- WRITE ----------
+def _write_shard(out, seed, years, end, lag, codes):
+    days = calendar(seed, years, end)
+    iso = np.datetime_as_string(days).tolist()
+    nav_dir = os.path.join(out, "data", "nav_history")
+    rows = []
+    for code in codes:
+        first, file_end, series_end, kind, plan, navs = scheme(seed, code, len(days), lag)
+        body = "".join(f"{d},{v:.5f}\n" for d, v in
+                       zip(iso[first:file_end + 1], navs[:file_end - first + 1].tolist()))
+        with open(os.path.join(nav_dir, f"{code}.csv"), "w", newline="", encoding="utf-8") as f:
+            f.write("Date,NAV\n")
+            f.write(body)
+        live = series_end == len(days) - 1
+        rows.append((code, kind, plan, float(navs[-1]) if live else None))
+    return rows
+
+
+def generate(out, schemes=2000, years=10, seed=1, end=END, lag=LAG, jobs=None):
+    """Write a dataset under ``out`` (replacing it); returns its parameters."""
+    if os.path.exists(out):
+        shutil.rmtree(out)
+    os.makedirs(os.path.join(out, "data", "nav_history"))
+
+    codes = list(range(FIRST_CODE, FIRST_CODE + schemes))
+    jobs = max(1, jobs or os.cpu_count() or 1)
+    chunk = max(1, -(-len(codes) // (jobs * 4)))
+    shards = [codes[i:i + chunk] for i in range(0, len(codes), chunk)]
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        results = pool.map(_write_shard, *zip(*[(out, seed, years, end, lag, s) for s in shards]))
+        rows = [r for shard in results for r in shard]
+
+    amfi_date = end.strftime("%d-%b-%Y")
+    listed = []
+    meta_rows = []
+    for code, kind, plan, last_nav in rows:
+        amc = amc_of(code)
+        scheme_type, category_raw, _ = KINDS[kind]
+        sub = category_raw.split(" - ", 1)[-1]
+        name = f"{amc.replace(' Mutual Fund', '')} {sub} - {PLANS[plan]}"
+        meta_rows.append(categories.category_row(str(code), {
+            "fund_house": amc, "scheme_type": scheme_type, "scheme_category": category_raw,
+        }))
+        if last_nav is not None:
+            listed.append({"SchemeCode": str(code), "AMC": amc, "SchemeName": name,
+                           "ISIN": f"INF{code:09d}", "NAV": f"{last_nav:.4f}",
+                           "Date": amfi_date})
+
+    with open(os.path.join(out, "data", "scheme_codes.csv"), "w", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=navall.FIELDNAMES)
+        writer.writeheader()
+        writer.writerows(listed)
+
+    with open(os.path.join(out, "data", "scheme_categories.csv"), "w", newline="",
+              encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=categories.FIELDNAMES)
+        writer.writeheader()
+        writer.writerows(meta_rows)
+
+    with open(os.path.join(out, "NAVAll.txt"), "w", newline="", encoding="utf-8") as f:
+        f.write("Scheme Code;ISIN Div Payout/ ISIN Growth;ISIN Div Reinvestment;"
+                "Scheme Name;Net Asset Value;Date\r\n\r\n")
+        for amc in sorted({r["AMC"] for r in listed}):
+            f.write(f"{amc}\r\n\r\n")
+            for r in listed:
+                if r["AMC"] == amc:
+                    f.write(f"{r['SchemeCode']};{r['ISIN']};-;{r['SchemeName']};"
+                            f"{r['NAV']};{r['Date']}\r\n")
+            f.write("\r\n")
+
+    params = {"schemes": schemes, "years": years, "seed": seed, "end": end.isoformat(),
+              "lag": lag, "listed": len(listed)}
+    with open(os.path.join(out, "dataset.json"), "w", encoding="utf-8") as f:
+        json.dump(params, f, indent=1)
+    return params
+
+
+def dataset_name(schemes, years, seed=1, end=END, lag=LAG):
+    return f"{schemes}x{years}y-s{seed}-l{lag:g}-{end.isoformat()}"
+
+
+def ensure(base, schemes, years, seed=1, end=END, lag=LAG, jobs=None):
+    """Directory of a generated dataset under ``base``, reusing a complete one."""
+    out = os.path.join(base, dataset_name(schemes, years, seed, end, lag))
+    if not os.path.exists(os.path.join(out, "dataset.json")):
+        start = time.perf_counter()
+        print(f"🧪 Generating {schemes:,} schemes × {years} years → {out}")
+        generate(out, schemes, years, seed, end, lag, jobs)
+        print(f"✅ Dataset ready in {time.perf_counter() - start:.1f}s")
+    return out
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a synthetic NAV dataset")
+    parser.add_argument("--out", required=True, help="Output directory (replaced)")
+    parser.add_argument("--schemes", type=int, default=14000)
+    parser.add_argument("--years", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--end", type=date.fromisoformat, default=END,
+                        help="Date of NAVAll.txt (histories end one business day earlier)")
+    parser.add_argument("--lag", type=float, default=LAG,
+                        help="Share of live schemes whose history is a few days behind")
+    parser.add_argument("--jobs", type=int, help="Writer processes (default: CPUs)")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    params = generate(args.out, args.schemes, args.years, args.seed, args.end, args.lag, args.jobs)
+    print(f"✅ {params['schemes']:,} schemes ({params['listed']:,} live) × {args.years} years "
+          f"→ {args.out} in {time.perf_counter() - start:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
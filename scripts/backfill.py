@@ -0,0 +1,317 @@
+"""Sharded, resumable NAV history backfill.
+
+``fetch_nav_history.py --shard i/N`` fetches only the schemes whose
+``crc32(SchemeCode) % N == i - 1``, so N jobs or machines split
+``scheme_codes.csv`` the same way whatever order it is in, and a scheme
+stays in its shard when others are added.  Every finished scheme is
+appended to the shard's checkpoint, flushed as it happens::
+
+    .cache/backfill/shard-2-of-4.jsonl
+    {"shard": "2/4", "started": "2025-01-31T02:00:05+00:00"}
+    {"code": "119551", "outcome": "updated", "last_date": "2025-01-30"}
+    {"code": "120503", "outcome": "network_error"}
+    {"code": "100027", "outcome": "updated", "last_date": "...", "category": {...}}
+    {"done": "2025-01-31T02:41:10+00:00", "schemes": 3557}
+
+A restarted shard skips every scheme with a final outcome (errors are
+tried again); once all of them are final a ``done`` line closes the file
+and the next run starts a new one.  Category rows picked up on the way are
+kept in the checkpoint rather than written to ``scheme_categories.csv``,
+so shards never write the same file.
+
+``merge`` reconciles the shards into this working tree: CSVs from packed
+shards (a ``nav_history/`` directory next to the checkpoint) replace the
+local file when they extend it, category rows are added, failed schemes go
+to the fetch retry queue, and schemes no shard finished are reported.
+
+    python scripts/fetch_nav_history.py --shard 2/4
+    python scripts/backfill.py status
+    python scripts/backfill.py pack 2/4 out/shard-2     # checkpoint + updated CSVs
+    python scripts/backfill.py merge out/shard-*/shard-*.jsonl
+    python scripts/backfill.py merge                    # shards run in this tree
+"""
+
+import argparse
+import csv
+import glob
+import json
+import os
+import shutil
+import sys
+import threading
+import zlib
+from datetime import datetime, timezone
+
+import categories
+import nav_state
+
+CHECKPOINT_DIR = ".cache/backfill"
+CODES_FILE = "data/scheme_codes.csv"
+NAV_DIR = nav_state.NAV_DIR
+STATE_FILE = nav_state.STATE_FILE
+RETRY_CONSUMER = "nav_history"
+
+# Outcomes (fetch_nav_history.OUTCOMES names) a restarted shard does not retry.
+FINAL = {"updated", "up_to_date", "unchanged", "no_new_navs", "no_nav_data"}
+
+
+def _now():
+    return datetime.now(timezone.utc).isoformat(timespec="seconds")
+
+
+# ---------- PARTITION ----------
+def parse_shard(text):
+    """``"i/N"`` → ``(i, N)`` with ``1 <= i <= N``; ``ValueError`` otherwise."""
+    try:
+        i, n = (int(x) for x in text.split("/"))
+    except ValueError:
+        raise ValueError(f"shard must look like i/N, not {text!r}") from None
+    if not 1 <= i <= n:
+        raise ValueError(f"shard {text!r} out of range (1 <= i <= N)")
+    return i, n
+
+
+def shard_of(code, n):
+    """1-based shard of ``code`` among ``n``."""
+    return zlib.crc32(str(code).encode("ascii")) % n + 1
+
+
+def select(schemes, i, n):
+    return [s for s in schemes if shard_of(s["SchemeCode"], n) == i]
+
+
+def checkpoint_path(i, n, root=CHECKPOINT_DIR):
+    return os.path.join(root, f"shard-{i}-of-{n}.jsonl")
+
+
+# ---------- CHECKPOINT ----------
+def read_checkpoint(path):
+    """``(header, {code: record}, done)``; later records win and a torn
+    last line is ignored."""
+    header, records, done = None, {}, None
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                rec = json.loads(line)
+            except ValueError:
+                continue
+            if "shard" in rec:
+                header = rec
+            elif "done" in rec:
+                done = rec
+            elif "code" in rec:
+                records[rec["code"]] = rec
+    return header, records, done
+
+
+class Checkpoint:
+    """Append-only record of one shard's finished schemes (thread-safe)."""
+
+    def __init__(self, path, shard, restart=False):
+        self.path = path
+        self.shard = shard
+        self.records = {}
+        self._lock = threading.Lock()
+
+        resumed = torn = False
+        if os.path.exists(path) and not restart:
+            header, records, done = read_checkpoint(path)
+            if header and header.get("shard") == shard and not done:
+                self.records = records
+                resumed = True
+                with open(path, "rb") as f:
+                    f.seek(-1, os.SEEK_END)
+                    torn = f.read(1) != b"\n"
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._file = open(path, "a" if resumed else "w", encoding="utf-8")
+        if torn:
+            self._file.write("\n")
+        if not resumed:
+            self._write({"shard": shard, "started": _now()})
+        self.resumed = resumed
+
+    def _write(self, rec):
+        self._file.write(json.dumps(rec, separators=(",", ":")) + "\n")
+        self._file.flush()
+
+    def completed(self):
+        return {code for code, rec in self.records.items() if rec["outcome"] in FINAL}
+
+    def record(self, code, outcome, last_date=None, category=None):
+        rec = {"code": code, "outcome": outcome}
+        if last_date:
+            rec["last_date"] = last_date
+        if category:
+            rec["category"] = category
+        with self._lock:
+            self.records[code] = rec
+            self._write(rec)
+
+    def finish(self, codes):
+        """Close the checkpoint if every code in ``codes`` is final."""
+        done = self.completed()
+        left = [c for c in codes if c not in done]
+        if not left:
+            with self._lock:
+                self._write({"done": _now(), "schemes": len(codes)})
+        return left
+
+    def close(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+
+
+# ---------- PACK ----------
+def pack(i, n, out_dir, checkpoint_dir=CHECKPOINT_DIR, nav_dir=NAV_DIR):
+    """Copy a shard's checkpoint and the CSVs it updated into ``out_dir``."""
+    src = checkpoint_path(i, n, checkpoint_dir)
+    _, records, _ = read_checkpoint(src)
+    os.makedirs(os.path.join(out_dir, "nav_history"), exist_ok=True)
+    shutil.copy(src, out_dir)
+    copied = 0
+    for code, rec in records.items():
+        path = os.path.join(nav_dir, f"{code}.csv")
+        if rec["outcome"] == "updated" and os.path.exists(path):
+            shutil.copy(path, os.path.join(out_dir, "nav_history"))
+            copied += 1
+    return copied
+
+
+# ---------- MERGE ----------
+def _is_prefix(short_path, long_path):
+    """True if ``short_path`` is missing or a byte prefix of ``long_path``."""
+    if not os.path.exists(short_path):
+        return True
+    size = os.path.getsize(short_path)
+    if size > os.path.getsize(long_path):
+        return False
+    with open(short_path, "rb") as a, open(long_path, "rb") as b:
+        return a.read() == b.read(size)
+
+
+def merge(paths, state, nav_dir=NAV_DIR, codes_file=CODES_FILE,
+          category_file=categories.CATEGORY_FILE):
+    """Fold shard checkpoints into this tree; returns a summary dict."""
+    summary = {"shards": [], "copied": 0, "conflicts": [], "categories": 0,
+               "queued": 0, "missing_shards": [], "incomplete": []}
+    final = set()
+    category_rows = {}
+    n_total = None
+
+    for path in paths:
+        header, records, done = read_checkpoint(path)
+        if header is None:
+            print(f"⚠️ {path}: no shard header, skipped")
+            continue
+        i, n = parse_shard(header["shard"])
+        if n_total is None:
+            n_total = n
+        elif n != n_total:
+            raise ValueError(f"{path}: shard {header['shard']} does not split into {n_total}")
+        summary["shards"].append((i, len(records), bool(done)))
+
+        packed = os.path.join(os.path.dirname(path), "nav_history")
+        for code, rec in records.items():
+            outcome = rec["outcome"]
+            if outcome in FINAL:
+                final.add(code)
+                state.clear_retry(RETRY_CONSUMER, code)
+            else:
+                state.queue_retry(RETRY_CONSUMER, code, outcome)
+                summary["queued"] += 1
+            if rec.get("category"):
+                category_rows[code] = rec["category"]
+
+            src = os.path.join(packed, f"{code}.csv")
+            if outcome != "updated" or not os.path.exists(src):
+                continue
+            dst = os.path.join(nav_dir, f"{code}.csv")
+            if _is_prefix(dst, src):
+                if not os.path.exists(dst) or os.path.getsize(dst) != os.path.getsize(src):
+                    tmp = dst + ".tmp"
+                    shutil.copyfile(src, tmp)
+                    os.replace(tmp, dst)
+                    state.lookup(code, dst)
+                    summary["copied"] += 1
+            elif not _is_prefix(src, dst):
+                summary["conflicts"].append(code)
+
+    if category_rows:
+        store = categories.CategoryStore(category_file)
+        new = [row for code, row in category_rows.items() if code not in store.rows]
+        store.append(new)
+        store.compact()
+        summary["categories"] = len(new)
+
+    if n_total is not None:
+        seen = {i for i, _, _ in summary["shards"]}
+        summary["missing_shards"] = [i for i in range(1, n_total + 1) if i not in seen]
+        if os.path.exists(codes_file):
+            with open(codes_file, newline="", encoding="utf-8") as f:
+                codes = [r["SchemeCode"] for r in csv.DictReader(f)]
+            summary["incomplete"] = [c for c in codes
+                                     if c not in final and shard_of(c, n_total) in seen]
+    state.commit()
+    return summary
+
+
+# ---------- CLI ----------
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Sharded NAV history backfill: status, pack, merge")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("status", help="Progress of the checkpoints in --checkpoint-dir")
+    p_pack = sub.add_parser("pack", help="Copy a shard's checkpoint and updated CSVs to a directory")
+    p_pack.add_argument("shard", help="i/N")
+    p_pack.add_argument("out_dir")
+    p_merge = sub.add_parser("merge", help="Reconcile shard checkpoints into this tree")
+    p_merge.add_argument("checkpoints", nargs="*",
+                         help="Checkpoint files (default: all in --checkpoint-dir)")
+    parser.add_argument("--checkpoint-dir", default=CHECKPOINT_DIR, help="Where shards keep checkpoints")
+    parser.add_argument("--state", default=STATE_FILE, help="NAV history state index path")
+    args = parser.parse_args(argv)
+
+    if args.command == "pack":
+        try:
+            i, n = parse_shard(args.shard)
+        except ValueError as e:
+            parser.error(str(e))
+        copied = pack(i, n, args.out_dir, args.checkpoint_dir)
+        print(f"📦 Shard {i}/{n} packed → {args.out_dir} ({copied:,} CSVs)")
+        return
+
+    paths = getattr(args, "checkpoints", None) or sorted(
+        glob.glob(os.path.join(args.checkpoint_dir, "shard-*-of-*.jsonl")))
+    if not paths:
+        print(f"⚠️ No shard checkpoints found in {args.checkpoint_dir}")
+        return
+
+    if args.command == "status":
+        for path in paths:
+            header, records, done = read_checkpoint(path)
+            final = sum(r["outcome"] in FINAL for r in records.values())
+            state = "✅ done" if done else "⏳ in progress"
+            print(f"🧩 {header['shard'] if header else path}: {final:,} finished, "
+                  f"{len(records) - final:,} failed, {state}")
+        return
+
+    with nav_state.NavState(args.state) as state:
+        summary = merge(paths, state)
+    for i, n, done in sorted(summary["shards"]):
+        print(f"🧩 Shard {i}: {n:,} schemes recorded{'' if done else ' (not finished)'}")
+    print(f"📄 CSVs taken from packed shards: {summary['copied']:,}")
+    print(f"🏷️ Category rows added: {summary['categories']:,}")
+    print(f"🔁 Failed schemes queued for retry: {summary['queued']:,}")
+    for code in summary["conflicts"][:20]:
+        print(f"🔴 {code} → shard copy and local file diverge, kept local")
+    if summary["missing_shards"]:
+        print(f"⚠️ Shards without a checkpoint: {', '.join(map(str, summary['missing_shards']))}")
+    if summary["incomplete"]:
+        print(f"⚠️ Schemes not finished by their shard: {len(summary['incomplete']):,}")
+    if summary["missing_shards"] or summary["incomplete"] or summary["conflicts"]:
+        sys.exit(1)
+    print("✅ All shards merged")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,205 @@
+"""Scheme category rows built from the ``meta`` block of an mfapi response.
+
+Shared by ``fetch_scheme_categories.py`` and ``fetch_nav_history.py`` so a
+scheme downloaded by either script fills both ``scheme_categories.csv`` and
+its ``nav_history/<code>.csv`` from the same response.
+
+New rows go through :class:`CategoryStore`: an append-only journal next to
+the CSV, compacted into it with an atomic rename.
+"""
+
+import csv
+import os
+import threading
+
+CATEGORY_FILE = "data/scheme_categories.csv"
+COMPACT_EVERY = 2000   # journal rows before they are folded into the CSV
+
+FIELDNAMES = [
+    "SchemeCode",
+    "AMC",
+    "SchemeType",
+    "CategoryRaw",
+    "Category",
+    "SubCategory"
+]
+
+
+def category_row(scheme_code, meta):
+    """``FIELDNAMES`` dict for ``meta``; ``None`` if it has no category."""
+    if not meta:
+        return None
+
+    amc = (meta.get("fund_house") or "").strip()
+    scheme_type = (meta.get("scheme_type") or "").strip()
+    category_raw = (meta.get("scheme_category") or "").strip()
+
+    if not category_raw:
+        return None
+
+    # ---------- CATEGORY SPLIT ---------- #
+    cleaned_category = category_raw.replace(" Scheme", "").strip()
+
+    if " - " in category_raw:
+        category, sub_category = cleaned_category.split(" - ", 1)
+        category = category.strip()
+        sub_category = sub_category.strip()
+    else:
+        category = cleaned_category
+        sub_category = ""
+
+    return {
+        "SchemeCode": scheme_code,
+        "AMC": amc,
+        "SchemeType": scheme_type,
+        "CategoryRaw": category_raw,
+        "Category": category,
+        "SubCategory": sub_category
+    }
+
+
+def journal_path(path=CATEGORY_FILE):
+    return path + ".journal"
+
+
+def _read_csv(path):
+    rows = {}
+    if os.path.exists(path):
+        with open(path, newline="", encoding="utf-8") as f:
+            for row in csv.DictReader(f):
+                rows[row["SchemeCode"]] = row
+    return rows
+
+
+def _repair_journal(path):
+    """Cut a torn last line left by a crash mid-append; returns row count."""
+    if not os.path.exists(path):
+        return 0
+    with open(path, "rb+") as f:
+        data = f.read()
+        end = data.rfind(b"\n") + 1
+        if end < len(data):
+            f.truncate(end)
+            data = data[:end]
+    lines = data.count(b"\n")
+    return max(0, lines - 1)  # minus the header
+
+
+def load(path=CATEGORY_FILE):
+    """``{SchemeCode: row}``: the CSV in file order, then the journal
+    replayed on top (later rows win); empty if neither exists."""
+    _repair_journal(journal_path(path))
+    rows = _read_csv(path)
+    rows.update(_read_csv(journal_path(path)))
+    return rows
+
+
+def _fsync_dir(path):
+    try:
+        fd = os.open(os.path.dirname(path) or ".", os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def save(rows, path=CATEGORY_FILE):
+    """Rewrite ``path`` from ``rows`` (insertion order) atomically."""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp = path + ".tmp"
+    with open(tmp, "w", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=FIELDNAMES)
+        writer.writeheader()
+        for row in rows.values():
+            writer.writerow(row)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+    _fsync_dir(path)
+
+
+class CategoryStore:
+    """``scheme_categories.csv`` plus an append-only journal.
+
+    :meth:`append` writes only the new rows to ``<path>.journal`` and
+    fsyncs, so a chunk costs O(chunk) bytes and survives a crash.  The
+    journal is folded into the CSV (temp file + ``os.replace``) once it
+    holds ``compact_every`` rows and by :meth:`compact` at the end of a
+    run; :func:`load` replays a leftover journal, so resume is exact.
+    """
+
+    def __init__(self, path=CATEGORY_FILE, compact_every=COMPACT_EVERY):
+        self.path = path
+        self.journal = journal_path(path)
+        self.compact_every = compact_every
+        self.rows = load(path)
+        self.pending = _repair_journal(self.journal)
+
+    def append(self, new_rows):
+        if not new_rows:
+            return
+        header = not os.path.exists(self.journal) or os.path.getsize(self.journal) == 0
+        with open(self.journal, "a", newline="", encoding="utf-8") as f:
+            writer = csv.DictWriter(f, fieldnames=FIELDNAMES)
+            if header:
+                writer.writeheader()
+            writer.writerows(new_rows)
+            f.flush()
+            os.fsync(f.fileno())
+        for row in new_rows:
+            self.rows[row["SchemeCode"]] = row
+        self.pending += len(new_rows)
+        if self.pending >= self.compact_every:
+            self.compact()
+
+    def compact(self):
+        """Fold the journal into the CSV; no-op when it is empty."""
+        if not self.pending and not os.path.exists(self.journal):
+            return False
+        save(self.rows, self.path)
+        # The CSV now holds every journal row, so losing the journal is safe.
+        try:
+            os.remove(self.journal)
+        except OSError:
+            pass
+        self.pending = 0
+        return True
+
+
+class Collector:
+    """Thread-safe buffer of category rows picked up while fetching NAVs."""
+
+    def __init__(self, path=CATEGORY_FILE):
+        self.store = CategoryStore(path)
+        self.rows = self.store.rows
+        self.new = []
+        self._lock = threading.Lock()
+
+    @property
+    def added(self):
+        return len(self.new)
+
+    def wants(self, scheme_code):
+        return scheme_code not in self.rows
+
+    def add(self, scheme_code, meta):
+        row = category_row(scheme_code, meta)
+        if row is None:
+            return False
+        with self._lock:
+            if scheme_code not in self.rows:
+                self.rows[scheme_code] = row
+                self.new.append(row)
+        return True
+
+    def save(self):
+        with self._lock:
+            added = len(self.new)
+            self.store.append(self.new)
+            self.new = []
+            self.store.compact()
+            return added
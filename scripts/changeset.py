@@ -0,0 +1,97 @@
+"""Keyed row diffs between two versions of a master CSV.
+
+A stage that rewrites a master file (``scheme_codes.csv``,
+``scheme_categories.csv``) diffs the old and new rows by ``SchemeCode`` and
+records what moved in ``.cache/changes/<name>.json``, so downstream stages
+can touch only those schemes::
+
+    {"source": "scheme_codes", "created": "...",
+     "base_sha256": "...", "sha256": "...",
+     "added": ["151234"], "removed": ["100027"],
+     "changed": {"119551": ["NAV", "Date"]}}
+
+It is only written when something changed and describes the step from the
+file with ``base_sha256`` to the one with ``sha256``; a consumer whose last
+input was a different file must fall back to a full rebuild.
+"""
+
+import hashlib
+import json
+import os
+from datetime import datetime
+
+CHANGES_DIR = ".cache/changes"
+
+
+class Changeset:
+    __slots__ = ("added", "removed", "changed")
+
+    def __init__(self, added=None, removed=None, changed=None):
+        self.added = added or {}      # code → new row
+        self.removed = removed or {}  # code → old row
+        self.changed = changed or {}  # code → [field, ...]
+
+    def __bool__(self):
+        return bool(self.added or self.removed or self.changed)
+
+    def codes(self):
+        return set(self.added) | set(self.removed) | set(self.changed)
+
+
+def diff(old, new):
+    """Compare ``{code: row}`` dicts; ``changed`` lists differing fields."""
+    added = {c: r for c, r in new.items() if c not in old}
+    removed = {c: r for c, r in old.items() if c not in new}
+    changed = {}
+    for code, row in new.items():
+        before = old.get(code)
+        if before is None or before == row:
+            continue
+        fields = [k for k in row if before.get(k) != row.get(k)]
+        changed[code] = fields
+    return Changeset(added, removed, changed)
+
+
+def file_sha256(path):
+    """Hex SHA-256 of ``path``; ``None`` if it does not exist."""
+    if not os.path.exists(path):
+        return None
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def changes_path(name, changes_dir=CHANGES_DIR):
+    return os.path.join(changes_dir, f"{name}.json")
+
+
+def write(name, changes, base_sha256, sha256, changes_dir=CHANGES_DIR):
+    """Record ``changes`` taking ``name`` from ``base_sha256`` to ``sha256``."""
+    os.makedirs(changes_dir, exist_ok=True)
+    payload = {
+        "source": name,
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "base_sha256": base_sha256,
+        "sha256": sha256,
+        "added": sorted(changes.added, key=int),
+        "removed": sorted(changes.removed, key=int),
+        "changed": {c: changes.changed[c] for c in sorted(changes.changed, key=int)},
+    }
+    path = changes_path(name, changes_dir)
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(payload, f, indent=1)
+    os.replace(tmp, path)
+    return path
+
+
+def read(name, changes_dir=CHANGES_DIR):
+    """The last changeset written for ``name``, or ``None``."""
+    path = changes_path(name, changes_dir)
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
@@ -1,20 +1,75 @@
+"""Combine the per-scheme NAV files into ``data/nav_history_all.csv``.
+
+The output is a base sorted by (SchemeCode, Date) plus a delta segment
+(``nav_history_all.delta.csv``) that each incremental run appends one
+sorted run to, so the base alone holds the rows up to the last compaction
+and the full history is base + delta (``--compact`` folds it back into a
+single file).  The index (``nav_history_all_index.py``, kept in ``.cache``)
+records where every scheme's rows start in each, so readers seek instead
+of scanning.  When the delta grows past ``COMPACT_RATIO`` of the base or
+``MAX_RUNS`` runs, ``compact`` k-way merges base and runs into a new base.
+
+The meta file is the commit record: per-scheme last dates plus the base
+and delta sizes, written once per run after the delta is synced.  Delta
+bytes past the recorded size come from an interrupted run and are cut off
+on the next one.
+"""
+
 import argparse
+import array
 import csv
+import heapq
+import io
+import itertools
 import json
+import mmap
 import os
-from datetime import datetime
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+import instrument
+import nav_history_all_index
+import nav_reader
+import nav_segments
+import nav_state
+from nav_history_all_index import Segment
 
 NAV_DIR = "data/nav_history"
 OUTPUT_FILE = "data/nav_history_all.csv"
 META_FILE = "data/nav_history_all.meta.json"
+STATE_FILE = nav_state.STATE_FILE
 
 FIELDNAMES = ["SchemeCode", "Date", "NAV"]
+META_FORMAT = 2
+COMPACT_RATIO = 0.05   # compact once the delta is this share of the base ...
+MAX_RUNS = 30          # ... or holds this many runs
+
+
+def format_rows(rows):
+    buf = io.StringIO()
+    csv.writer(buf).writerows(rows)
+    return buf.getvalue().encode("utf-8")
+
+
+HEADER_LINE = format_rows([FIELDNAMES])
+
+
+def _size(path):
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
 
 
 def load_meta(path):
+    """``{"format", "base", "delta", "schemes": {code: last date}}``, or
+    ``{}`` if missing or written before the sorted layout."""
     if os.path.exists(path):
         with open(path, "r", encoding="utf-8") as f:
-            return json.load(f)
+            meta = json.load(f)
+        if meta.get("format") == META_FORMAT:
+            return meta
     return {}
 
 
@@ -25,20 +80,59 @@ def save_meta_atomic(path, data):
     os.replace(tmp, path)
 
 
-def parse_date(d):
-    # Expect ISO YYYY-MM-DD
-    try:
-        return datetime.strptime(d, "%Y-%m-%d").date()
-    except Exception:
-        return None
+def rebuild_reason(output_file, meta):
+    """Why the incremental layout can't be trusted, or ``None``."""
+    if not os.path.exists(output_file):
+        return "no combined file yet"
+    if not meta:
+        return "no meta in the sorted layout"
+    if meta["base"] != _size(output_file):
+        return "base file changed outside this script"
+    if meta["delta"] > _size(nav_history_all_index.delta_path(output_file)):
+        return "delta file is shorter than committed"
+    return None
 
 
-def full_rebuild(nav_dir, output_file, meta_file, dry_run=False):
-    print("🔁 Performing full rebuild of combined NAV history...")
+# ---------------- FULL REBUILD ----------------
+def rebuild_shard(nav_dir, scheme_files, out_path=None, write_header=True):
+    """Write combined rows for ``scheme_files`` to ``out_path`` (``None`` = dry run).
 
+    Returns ``(rows_written, {scheme_code: max_date}, [(scheme_code, bytes)])``.
+    Runs in worker processes for ``--jobs``; shards are contiguous so
+    concatenating their outputs in order gives exactly the serial file.
+    """
     meta = {}
+    sizes = []
     rows_written = 0
 
+    out_f = open(out_path, "wb") if out_path else None
+    if out_f and write_header:
+        out_f.write(HEADER_LINE)
+
+    for fname in scheme_files:
+        scheme_code = os.path.splitext(fname)[0]
+        path = os.path.join(nav_dir, fname)
+
+        rows = [(scheme_code, date_str, nav) for date_str, nav in nav_reader.iter_valid(path)]
+        if not rows:
+            continue
+        rows.sort(key=lambda x: x[1])
+        if out_f:
+            data = format_rows(rows)
+            out_f.write(data)
+            sizes.append((scheme_code, len(data)))
+        rows_written += len(rows)
+        meta[scheme_code] = rows[-1][1]
+
+    if out_f:
+        out_f.close()
+
+    return rows_written, meta, sizes
+
+
+def full_rebuild(nav_dir, output_file, meta_file, dry_run=False, state_file=STATE_FILE, jobs=1):
+    print("🔁 Performing full rebuild of combined NAV history...")
+
     if dry_run:
         print("--dry-run: no files will be written")
 
@@ -46,129 +140,305 @@ def full_rebuild(nav_dir, output_file, meta_file, dry_run=False):
         f for f in os.listdir(nav_dir) if f.endswith(".csv")
     )
 
-    if not dry_run:
-        os.makedirs(os.path.dirname(output_file) or ".", exist_ok=True)
-        out_f = open(output_file, "w", newline="", encoding="utf-8")
-        writer = csv.writer(out_f)
-        writer.writerow(FIELDNAMES)
-    else:
-        writer = None
+    consumer = os.path.basename(output_file)
+    state = nav_state.NavState(state_file)
 
+    sizes = {}
     for fname in scheme_files:
         scheme_code = os.path.splitext(fname)[0]
-        path = os.path.join(nav_dir, fname)
+        sizes[scheme_code] = state.lookup(scheme_code, os.path.join(nav_dir, fname)).size
 
-        max_date = None
-        with open(path, newline="", encoding="utf-8") as f:
-            for r in csv.DictReader(f):
-                date_str = r.get("Date")
-                nav = r.get("NAV")
-                if not date_str or not nav:
-                    continue
-                date_obj = parse_date(date_str)
-                if not date_obj:
-                    continue
-                if writer:
-                    writer.writerow([scheme_code, date_str, nav])
-                rows_written += 1
-                if not max_date or date_str > max_date:
-                    max_date = date_str
-
-        if max_date:
-            meta[scheme_code] = max_date
-
-    if writer:
-        out_f.close()
+    tmp = output_file + ".tmp"
+    if not dry_run:
+        os.makedirs(os.path.dirname(output_file) or ".", exist_ok=True)
+
+    if jobs <= 1:
+        rows_written, meta, chunk_sizes = rebuild_shard(nav_dir, scheme_files, None if dry_run else tmp)
+    else:
+        shards = nav_state.shard_by_size(nav_dir, scheme_files, jobs * 4)
+        print(f"⚙️ {len(shards)} shards across {jobs} processes")
+        work_dir = tempfile.mkdtemp(prefix=".rebuild-", dir=os.path.dirname(output_file) or ".")
+        parts = [
+            None if dry_run else os.path.join(work_dir, f"{i:05d}.csv")
+            for i in range(len(shards))
+        ]
+        try:
+            with ProcessPoolExecutor(max_workers=jobs) as executor:
+                results = list(executor.map(
+                    rebuild_shard, [nav_dir] * len(shards), shards, parts,
+                    [False] * len(shards),
+                ))
+
+            rows_written = sum(r for r, _, _ in results)
+            meta = {}
+            chunk_sizes = []
+            for _, shard_meta, shard_sizes in results:
+                meta.update(shard_meta)
+                chunk_sizes.extend(shard_sizes)
+
+            if not dry_run:
+                with open(tmp, "wb") as out_f:
+                    out_f.write(HEADER_LINE)
+                    for part in parts:
+                        with open(part, "rb") as f:
+                            shutil.copyfileobj(f, out_f)
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
 
     if not dry_run:
-        save_meta_atomic(meta_file, meta)
+        offsets = array.array(nav_history_all_index.TYPECODE, [len(HEADER_LINE)])
+        for _, n in chunk_sizes:
+            offsets.append(offsets[-1] + n)
+        base = Segment("base", [code for code, _ in chunk_sizes], offsets, rows_written)
+
+        os.replace(tmp, output_file)
+        delta_file = nav_history_all_index.delta_path(output_file)
+        if os.path.exists(delta_file):
+            os.remove(delta_file)
+        save_meta_atomic(meta_file, {"format": META_FORMAT, "base": offsets[-1], "delta": 0,
+                                     "schemes": meta})
+        nav_history_all_index.write(output_file, [base] if base.codes else [])
+        state.clear_watermarks(consumer)
+        for scheme_code, max_date in meta.items():
+            state.set_watermark(consumer, scheme_code, max_date, sizes[scheme_code])
+
+    state.close()
+    if not dry_run:
+        instrument.count("rows_written", rows_written)
 
     print(f"✅ Full rebuild complete. Rows written: {rows_written}")
     return rows_written
 
 
-def incremental_update(nav_dir, output_file, meta_file, dry_run=False):
+# ---------------- INCREMENTAL ----------------
+def rollback_delta(delta_file, committed):
+    """Cut off delta bytes an interrupted run wrote past the last commit."""
+    size = _size(delta_file)
+    if size > committed:
+        with open(delta_file, "r+b") as f:
+            f.truncate(committed)
+        print(f"↩️ Dropped {size - committed:,} uncommitted delta bytes")
+
+
+def incremental_update(nav_dir, output_file, meta_file, dry_run=False, state_file=STATE_FILE):
+    """Append rows newer than each scheme's last exported date to the delta
+    as one sorted run; returns ``(rows_appended, segments)``."""
     print("⚙️ Performing incremental update using meta index...")
 
     meta = load_meta(meta_file)
+    last_dates = meta["schemes"]
+    delta_file = nav_history_all_index.delta_path(output_file)
+    if not dry_run:
+        rollback_delta(delta_file, meta["delta"])
+    segments, _ = nav_history_all_index.load(output_file)
     rows_appended = 0
 
-    os.makedirs(os.path.dirname(output_file) or ".", exist_ok=True)
-    need_header = not os.path.exists(output_file)
+    # The state index answers "anything new?" with a stat per scheme, and the
+    # watermark says where the already-exported rows end in each file.
+    consumer = os.path.basename(output_file)
+    state = nav_state.NavState(state_file)
 
     scheme_files = sorted(
         f for f in os.listdir(nav_dir) if f.endswith(".csv")
     )
 
+    # Scheme files are visited in code order, so the run is sorted as written.
+    out_f = None
+    codes = []
+    offsets = array.array(nav_history_all_index.TYPECODE)
+    marks = []
+
     for fname in scheme_files:
         scheme_code = os.path.splitext(fname)[0]
         path = os.path.join(nav_dir, fname)
 
-        last_known = meta.get(scheme_code)  # ISO string
+        last_known = last_dates.get(scheme_code)  # ISO string
+
+        entry = state.lookup(scheme_code, path)
+        if last_known and entry.last_date and entry.last_date <= last_known:
+            instrument.detail(f"- {scheme_code} → up to date")
+            continue
+
+        wm_date, wm_offset = state.watermark(consumer, scheme_code)
+        offset = wm_offset if last_known and wm_date == last_known and wm_offset <= entry.size else 0
 
         to_write = []
-        max_date = last_known
-
-        with open(path, newline="", encoding="utf-8") as f:
-            for r in csv.DictReader(f):
-                date_str = r.get("Date")
-                nav = r.get("NAV")
-                if not date_str or not nav:
-                    continue
-                if last_known and date_str <= last_known:
-                    continue
-                date_obj = parse_date(date_str)
-                if not date_obj:
-                    continue
-                to_write.append((scheme_code, date_str, nav))
-                if not max_date or date_str > max_date:
-                    max_date = date_str
+        for date_str, nav in nav_reader.iter_valid(path, offset):
+            if last_known and date_str <= last_known:
+                continue
+            to_write.append((scheme_code, date_str, nav))
 
         if not to_write:
-            print(f"- {scheme_code} → up to date")
+            instrument.detail(f"- {scheme_code} → up to date")
             continue
 
         to_write.sort(key=lambda x: x[1])
 
-        print(f"- {scheme_code} → +{len(to_write)} rows")
+        instrument.detail(f"- {scheme_code} → +{len(to_write)} rows")
 
         if not dry_run:
-            mode = "a"
-            with open(output_file, mode, newline="", encoding="utf-8") as out_f:
-                writer = csv.writer(out_f)
-                if need_header:
-                    writer.writerow(FIELDNAMES)
-                    need_header = False
-                writer.writerows(to_write)
-
-            # update meta for this scheme and persist after each successful write
-            if max_date:
-                meta[scheme_code] = max_date
-                save_meta_atomic(meta_file, meta)
+            if out_f is None:
+                out_f = open(delta_file, "ab")
+                if out_f.tell() == 0:
+                    out_f.write(HEADER_LINE)
+            codes.append(scheme_code)
+            offsets.append(out_f.tell())
+            out_f.write(format_rows(to_write))
+            marks.append((scheme_code, to_write[-1][1], entry.size))
 
         rows_appended += len(to_write)
 
+    if out_f is not None:
+        offsets.append(out_f.tell())
+        out_f.flush()
+        os.fsync(out_f.fileno())
+        out_f.close()
+
+        # One commit for the whole run: meta first (it is what a restart
+        # trusts), then the index and the watermarks derived from it.
+        for scheme_code, max_date, _ in marks:
+            last_dates[scheme_code] = max_date
+        meta["delta"] = offsets[-1]
+        save_meta_atomic(meta_file, meta)
+        segments = segments + [Segment("delta", codes, offsets, rows_appended)]
+        nav_history_all_index.write(output_file, segments)
+        for scheme_code, max_date, size in marks:
+            state.set_watermark(consumer, scheme_code, max_date, size)
+
+    state.close()
+    if not dry_run:
+        instrument.count("rows_written", rows_appended)
+
     print(f"✅ Incremental update complete. Rows appended: {rows_appended}")
-    return rows_appended
+    return rows_appended, segments
+
+
+# ---------------- COMPACTION ----------------
+def should_compact(segments, output_file, force=False):
+    runs = sum(s.file == "delta" for s in segments)
+    delta = _size(nav_history_all_index.delta_path(output_file))
+    return runs > 0 and (force or runs > MAX_RUNS or delta > COMPACT_RATIO * _size(output_file))
+
+
+def _date(line):
+    return line.split(b",", 2)[1]
+
+
+def _in_order(parts):
+    """Every part's dates come after the previous part's last date."""
+    for a, b in zip(parts, parts[1:]):
+        if _date(a.rstrip(b"\r\n").rsplit(b"\n", 1)[-1]) >= _date(b):
+            return False
+    return True
+
+
+def _merge_rows(parts):
+    """One scheme's rows from several segments in date order; on equal
+    dates the earlier segment's row wins."""
+    lines = [line for part in parts for line in part.splitlines(keepends=True)]
+    lines.sort(key=_date)
+    out = [line for i, line in enumerate(lines) if i == 0 or _date(line) != _date(lines[i - 1])]
+    return b"".join(out)
+
+
+def compact(output_file, meta_file, segments):
+    """K-way merge the base and every delta run into a new sorted base.
+
+    Runs and base are each sorted by SchemeCode, so the merge walks their
+    index entries and copies each scheme's byte ranges in segment order;
+    only a scheme whose ranges overlap in date is parsed and re-sorted.
+    """
+    runs = sum(s.file == "delta" for s in segments)
+    print(f"🧹 Compacting {runs} delta run(s) into the base...")
+    delta_file = nav_history_all_index.delta_path(output_file)
+    files, maps = [], {}
+    for name, path in (("base", output_file), ("delta", delta_file)):
+        if _size(path):
+            f = open(path, "rb")
+            files.append(f)
+            maps[name] = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def entries(n, seg):
+        for i, code in enumerate(seg.codes):
+            yield code, n, seg.offsets[i], seg.offsets[i + 1]
+
+    codes = []
+    offsets = array.array(nav_history_all_index.TYPECODE)
+    rows = 0
+    tmp = output_file + ".tmp"
+    try:
+        with open(tmp, "wb") as out:
+            out.write(HEADER_LINE)
+            pos = len(HEADER_LINE)
+            merged = heapq.merge(*(entries(n, s) for n, s in enumerate(segments)))
+            for code, group in itertools.groupby(merged, key=lambda e: e[0]):
+                parts = [maps[segments[n].file][lo:hi] for _, n, lo, hi in group]
+                data = b"".join(parts) if _in_order(parts) else _merge_rows(parts)
+                codes.append(code)
+                offsets.append(pos)
+                out.write(data)
+                pos += len(data)
+                rows += data.count(b"\n")
+            offsets.append(pos)
+    finally:
+        for mm in maps.values():
+            mm.close()
+        for f in files:
+            f.close()
+
+    os.replace(tmp, output_file)
+    meta = load_meta(meta_file)
+    meta["base"], meta["delta"] = pos, 0
+    save_meta_atomic(meta_file, meta)
+    if os.path.exists(delta_file):
+        os.remove(delta_file)
+    nav_history_all_index.write(output_file, [Segment("base", codes, offsets, rows)])
+    print(f"✅ Compaction complete. Base rows: {rows:,}")
+    return rows
 
 
 def main():
     parser = argparse.ArgumentParser(description="Incremental merge of NAV history CSVs")
     parser.add_argument("--rebuild", action="store_true", help="Do a full rebuild instead of incremental append")
+    parser.add_argument("--compact", action="store_true",
+                        help="Merge the delta into the base even below the size threshold")
     parser.add_argument("--output", default=OUTPUT_FILE, help="Output merged CSV path")
     parser.add_argument("--meta", default=META_FILE, help="Meta JSON path to track per-scheme last dates")
     parser.add_argument("--dry-run", action="store_true", help="Show what would change but do not write files")
+    parser.add_argument("--state", default=STATE_FILE, help="NAV history state index path")
+    parser.add_argument("--jobs", type=int, default=1, help="Worker processes for --rebuild")
+    parser.add_argument("--segments", action="store_true",
+                        help=f"Restore missing or stale CSVs from {nav_segments.SEGMENT_DIR} first")
+    instrument.add_arguments(parser)
 
     args = parser.parse_args()
+    if args.segments and not nav_segments.available():
+        parser.error("--segments requires zstandard (pip install zstandard)")
+    instrument.start("export_nav_history_all", args)
+
+    if args.segments:
+        with instrument.stage("checkout"), nav_state.NavState(args.state) as state:
+            restored = nav_segments.checkout(state, NAV_DIR)
+        print(f"🧱 CSVs restored from segments: {restored:,}")
 
     if not os.path.exists(NAV_DIR):
         print("⚠️ NAV directory not found:", NAV_DIR)
         return
 
-    if args.rebuild or not os.path.exists(args.output) or not os.path.exists(args.meta):
-        full_rebuild(NAV_DIR, args.output, args.meta, dry_run=args.dry_run)
-    else:
-        incremental_update(NAV_DIR, args.output, args.meta, dry_run=args.dry_run)
+    reason = "--rebuild" if args.rebuild else rebuild_reason(args.output, load_meta(args.meta))
+    if reason:
+        if not args.rebuild:
+            print(f"ℹ️ Full rebuild: {reason}")
+        with instrument.stage("rebuild"):
+            full_rebuild(NAV_DIR, args.output, args.meta, dry_run=args.dry_run, state_file=args.state, jobs=args.jobs)
+        return
+
+    with instrument.stage("incremental"):
+        _, segments = incremental_update(NAV_DIR, args.output, args.meta, dry_run=args.dry_run,
+                                         state_file=args.state)
+    if not args.dry_run and should_compact(segments, args.output, force=args.compact):
+        with instrument.stage("compact"):
+            compact(args.output, args.meta, segments)
 
 
 if __name__ == "__main__":
@@ -1,105 +1,356 @@
+import argparse
 import csv
+import heapq
+import io
 import os
-from datetime import datetime
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
 from collections import defaultdict
 
+import instrument
+import nav_reader
+import nav_segments
+import nav_state
+import nav_year_index
+
 NAV_DIR = "data/nav_history"
 OUT_DIR = "data/nav_year"
+STATE_FILE = nav_state.STATE_FILE
+CONSUMER = "nav_year"
 
-print("📁 Preparing yearly NAV output directory...")
-os.makedirs(OUT_DIR, exist_ok=True)
+HEADER = ["SchemeCode", "Date", "NAV"]
 
-# ---------------- LOAD SCHEME FILES ----------------
-scheme_files = sorted(
-    f for f in os.listdir(NAV_DIR)
-    if f.endswith(".csv")
-)
 
-print(f"📊 Schemes detected: {len(scheme_files)}")
+def year_path(out_dir, year):
+    return os.path.join(out_dir, f"nav_year_{year}.csv")
 
-# ---------------- LOAD EXISTING DATA ----------------
-print("🗂 Loading existing yearly NAV indexes...")
-existing = defaultdict(set)
 
-year_files = sorted(
-    f for f in os.listdir(OUT_DIR)
-    if f.startswith("nav_year_") and f.endswith(".csv")
-)
+def scheme_rows(scheme_code, pairs):
+    """Valid ``(SchemeCode, Date, NAV)`` tuples from ``(Date, NAV)`` pairs."""
+    for raw_date, nav in pairs:
+        if not raw_date or not nav:
+            continue
 
-if not year_files:
-    print("ℹ️ No existing yearly NAV files found")
+        date_str = nav_reader.iso_date(raw_date)
+        if date_str is None:
+            continue
 
-for fname in year_files:
-    year = fname.replace("nav_year_", "").replace(".csv", "")
-    if not year.isdigit() or len(year) != 4:
-        continue
+        yield scheme_code, date_str, nav
 
-    path = os.path.join(OUT_DIR, fname)
-    count = 0
 
-    with open(path, newline="", encoding="utf-8") as f:
-        for r in csv.DictReader(f):
-            if r.get("SchemeCode") and r.get("Date"):
-                existing[year].add((r["SchemeCode"], r["Date"]))
-                count += 1
+def format_rows(rows):
+    buf = io.StringIO()
+    csv.writer(buf).writerows(rows)
+    return buf.getvalue()
 
-    print(f"📅 {year} → 📦 {count:,} rows cached")
 
-print("✅ Existing yearly NAV index ready\n")
+# ---------------- FULL REBUILD ----------------
+def rebuild_shard(nav_dir, scheme_files, work_dir, write_header=True):
+    """Write each year's rows for ``scheme_files`` to ``work_dir/<year>.csv``.
 
-# ---------------- COLLECT NEW DATA ----------------
-to_write = defaultdict(list)
+    Scheme files are visited in code order and each one is date-sorted, so
+    rows reach every year file already in (SchemeCode, Date) order; only one
+    scheme is held in memory at a time.  Returns ``({year: rows},
+    {scheme_code: last_date})``.  Shards are contiguous, so concatenating
+    their year files in order gives exactly the serial output.
+    """
+    outputs = {}
+    counts = defaultdict(int)
+    last_dates = {}
 
-print("\n🔍 Processing schemes...")
+    for file in scheme_files:
+        scheme_code = os.path.splitext(file)[0]
+        file_path = os.path.join(nav_dir, file)
 
-for i, file in enumerate(scheme_files, start=1):
-    scheme_code = os.path.splitext(file)[0]
-    file_path = os.path.join(NAV_DIR, file)
+        unique = {}
+        for row in scheme_rows(scheme_code, nav_reader.iter_rows(file_path)):
+            unique.setdefault(row[1], row)
+        rows = [unique[d] for d in sorted(unique)]
 
-    scanned = added = 0
+        by_year = defaultdict(list)
+        for row in rows:
+            by_year[row[1][:4]].append(row)
 
-    with open(file_path, newline="", encoding="utf-8") as f:
-        for row in csv.DictReader(f):
-            scanned += 1
-            raw_date = row.get("Date")
-            nav = row.get("NAV")
+        for year, year_rows in by_year.items():
+            if year not in outputs:
+                path = os.path.join(work_dir, f"{year}.csv")
+                outputs[year] = open(path, "w", newline="", encoding="utf-8")
+                if write_header:
+                    outputs[year].write(format_rows([HEADER]))
+            outputs[year].write(format_rows(year_rows))
+            counts[year] += len(year_rows)
 
-            if not raw_date or not nav:
-                continue
+        if rows:
+            last_dates[scheme_code] = rows[-1][1]
+
+    for f in outputs.values():
+        f.close()
+
+    return dict(counts), last_dates
+
+
+def full_rebuild(nav_dir, out_dir, state, jobs=1):
+    """Rewrite every year file; ``jobs > 1`` shards schemes across processes."""
+    print("🔁 Rebuilding yearly NAV files from scratch...")
+
+    scheme_files = sorted(
+        f for f in os.listdir(nav_dir)
+        if f.endswith(".csv")
+    )
+    print(f"📊 Schemes detected: {len(scheme_files)}")
+
+    sizes = {}
+    for file in scheme_files:
+        scheme_code = os.path.splitext(file)[0]
+        sizes[scheme_code] = state.lookup(scheme_code, os.path.join(nav_dir, file)).size
+
+    work_root = tempfile.mkdtemp(prefix=".rebuild-", dir=out_dir)
+    try:
+        if jobs <= 1:
+            counts, last_dates = rebuild_shard(nav_dir, scheme_files, work_root)
+            for year in counts:
+                os.replace(os.path.join(work_root, f"{year}.csv"), year_path(out_dir, year))
+                nav_year_index.write(year_path(out_dir, year))
+        else:
+            shards = nav_state.shard_by_size(nav_dir, scheme_files, jobs * 4)
+            print(f"⚙️ {len(shards)} shards across {jobs} processes")
+            work_dirs = [os.path.join(work_root, f"{i:05d}") for i in range(len(shards))]
+            for d in work_dirs:
+                os.makedirs(d)
+
+            with ProcessPoolExecutor(max_workers=jobs) as executor:
+                results = list(executor.map(
+                    rebuild_shard, [nav_dir] * len(shards), shards, work_dirs,
+                    [False] * len(shards),
+                ))
+
+            counts = defaultdict(int)
+            last_dates = {}
+            for shard_counts, shard_last in results:
+                for year, n in shard_counts.items():
+                    counts[year] += n
+                last_dates.update(shard_last)
 
-            try:
-                d = datetime.strptime(raw_date, "%Y-%m-%d").date()
-            except ValueError:
+            for year in counts:
+                tmp = year_path(out_dir, year) + ".tmp"
+                with open(tmp, "w", newline="", encoding="utf-8") as out:
+                    out.write(format_rows([HEADER]))
+                with open(tmp, "ab") as out:
+                    for d in work_dirs:
+                        part = os.path.join(d, f"{year}.csv")
+                        if os.path.exists(part):
+                            with open(part, "rb") as f:
+                                shutil.copyfileobj(f, out)
+                os.replace(tmp, year_path(out_dir, year))
+                nav_year_index.write(year_path(out_dir, year))
+    finally:
+        shutil.rmtree(work_root, ignore_errors=True)
+
+    for year in sorted(counts):
+        print(f"📅 {year} → ✍️ {counts[year]:,} rows")
+
+    state.clear_watermarks(CONSUMER)
+    for scheme_code, last_date in last_dates.items():
+        state.set_watermark(CONSUMER, scheme_code, last_date, sizes[scheme_code])
+
+    return sum(counts.values())
+
+
+# ---------------- INCREMENTAL ----------------
+class NotSorted(Exception):
+    pass
+
+
+def read_year_lines(path):
+    """Yield ``((SchemeCode, Date), raw_line)`` in file order, checking order."""
+    prev = None
+    with open(path, newline="", encoding="utf-8") as f:
+        next(f, None)  # header
+        for line in f:
+            parts = line.split(",", 2)
+            if len(parts) < 3:
                 continue
+            key = (parts[0], parts[1])
+            if prev is not None and key < prev:
+                raise NotSorted(path)
+            prev = key
+            yield key, line
+
+
+def sorted_year_lines(path):
+    """Whole file sorted in memory; only for year files written out of order."""
+    with open(path, newline="", encoding="utf-8") as f:
+        next(f, None)
+        lines = []
+        for line in f:
+            parts = line.split(",", 2)
+            if len(parts) == 3:
+                lines.append(((parts[0], parts[1]), line))
+    lines.sort(key=lambda x: x[0])
+    return lines
+
 
-            year = str(d.year)
-            date_str = d.isoformat()
-            key = (scheme_code, date_str)
+def merge_year(out_file, new_rows):
+    """Merge sorted ``new_rows`` into ``out_file``; existing rows win on ties.
 
-            if key in existing[year]:
+    Streams the current file line by line and replaces it atomically, so
+    memory is bounded by the new rows, not by the year.  Returns the number
+    of new rows actually written; with none, the file is left untouched.
+    """
+    new_lines = [((r[0], r[1]), format_rows([r])) for r in new_rows]
+    tmp = out_file + ".tmp"
+
+    def write(existing):
+        added = 0
+        last = None
+        tagged_new = ((key, line, True) for key, line in new_lines)
+        tagged_old = ((key, line, False) for key, line in existing)
+        with open(tmp, "w", newline="", encoding="utf-8") as out:
+            out.write(format_rows([HEADER]))
+            # heapq.merge is stable: on equal keys the existing line comes first.
+            for key, line, is_new in heapq.merge(tagged_old, tagged_new, key=lambda x: x[0]):
+                if key == last:
+                    continue
+                last = key
+                out.write(line)
+                added += is_new
+        return added
+
+    resorted = False
+    if not os.path.exists(out_file):
+        added = write(())
+    else:
+        try:
+            added = write(read_year_lines(out_file))
+        except NotSorted:
+            print(f"🔧 {os.path.basename(out_file)} is out of order, re-sorting")
+            added = write(sorted_year_lines(out_file))
+            resorted = True
+
+    # Rows re-read after a shrink or rewrite are usually all present already.
+    if not added and not resorted and os.path.exists(out_file):
+        os.remove(tmp)
+        return 0
+
+    os.replace(tmp, out_file)
+    nav_year_index.write(out_file)
+    return added
+
+
+def incremental_update(nav_dir, out_dir, state):
+    """Export only rows past each scheme's ``nav_year`` watermark."""
+    print("⚙️ Incremental export using NAV state watermarks...")
+
+    scheme_files = sorted(
+        f for f in os.listdir(nav_dir)
+        if f.endswith(".csv")
+    )
+    print(f"📊 Schemes detected: {len(scheme_files)}")
+
+    to_write = defaultdict(list)
+    marks = []
+    changed = 0
+
+    print("\n🔍 Processing schemes...")
+
+    rows_read = 0
+    with instrument.stage("scan"):
+        for file in scheme_files:
+            scheme_code = os.path.splitext(file)[0]
+            file_path = os.path.join(nav_dir, file)
+
+            entry = state.lookup(scheme_code, file_path)
+            wm_date, wm_offset = state.watermark(CONSUMER, scheme_code)
+
+            if wm_offset == entry.size and wm_date == entry.last_date:
                 continue
 
-            existing[year].add(key)
-            to_write[year].append((scheme_code, date_str, nav))
-            added += 1
+            # Shrunk or rewritten file: read it all, the merge drops duplicates.
+            offset = wm_offset if wm_offset <= entry.size else 0
+            added = 0
+            max_date = wm_date
+            for row in scheme_rows(scheme_code, nav_reader.iter_rows(file_path, offset)):
+                to_write[row[1][:4]].append(row)
+                added += 1
+                if not max_date or row[1] > max_date:
+                    max_date = row[1]
+
+            marks.append((scheme_code, max_date, entry.size))
+            rows_read += added
+            if added:
+                changed += 1
+                instrument.detail(f"📄 {scheme_code} → ➕ {added}")
+        instrument.count("rows_read", rows_read)
+
+    print(f"\n🧮 Schemes with new rows: {changed}")
+
+    # ---------------- WRITE OUTPUT ----------------
+    print("\n💾 Merging into yearly NAV files...")
+
+    total = 0
+    with instrument.stage("merge"):
+        for year, rows in sorted(to_write.items()):
+            rows.sort(key=lambda x: (x[0], x[1]))
+            added = merge_year(year_path(out_dir, year), rows)
+            total += added
+            print(f"📅 {year} → ✍️ {added} rows")
+        instrument.count("rows_written", total)
+
+    # Watermarks move only after every year file has been replaced.
+    for scheme_code, max_date, size in marks:
+        state.set_watermark(CONSUMER, scheme_code, max_date, size)
+
+    return total
+
+
+def export(state, nav_dir=NAV_DIR, out_dir=OUT_DIR, rebuild=False, jobs=1):
+    """Rebuild (on request or first run) or update the year files; returns rows."""
+    os.makedirs(out_dir, exist_ok=True)
+
+    # Without watermarks there is nothing to be incremental against.
+    first_run = state.watermark_count(CONSUMER) == 0
+    if rebuild or first_run:
+        with instrument.stage("rebuild"):
+            total = full_rebuild(nav_dir, out_dir, state, jobs=jobs)
+            instrument.count("rows_written", total)
+    else:
+        total = incremental_update(nav_dir, out_dir, state)
+
+    # Year files from before sidecars existed, or edited by hand.
+    indexed = nav_year_index.ensure(out_dir)
+    if indexed:
+        print(f"🗂️ Indexed {indexed} year files without a current sidecar")
+    return total
+
 
-    print(f"📄 [{i}/{len(scheme_files)}] {scheme_code} → ➕ {added}")
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export per-scheme NAV history into year-wise CSVs")
+    parser.add_argument("--rebuild", action="store_true", help="Rewrite every year file from data/nav_history")
+    parser.add_argument("--nav-dir", default=NAV_DIR, help="Per-scheme NAV history directory")
+    parser.add_argument("--out-dir", default=OUT_DIR, help="Year-wise output directory")
+    parser.add_argument("--state", default=STATE_FILE, help="NAV history state index path")
+    parser.add_argument("--jobs", type=int, default=1, help="Worker processes for a full rebuild")
+    parser.add_argument("--segments", action="store_true",
+                        help=f"Restore missing or stale CSVs from {nav_segments.SEGMENT_DIR} first")
+    instrument.add_arguments(parser)
 
-# ---------------- WRITE OUTPUT ----------------
-print("\n💾 Writing yearly NAV files...")
+    args = parser.parse_args(argv)
+    if args.segments and not nav_segments.available():
+        parser.error("--segments requires zstandard (pip install zstandard)")
+    instrument.start("export_nav_year", args)
 
-for year, rows in to_write.items():
-    out_file = os.path.join(OUT_DIR, f"nav_year_{year}.csv")
-    write_header = not os.path.exists(out_file)
+    print("📁 Preparing yearly NAV output directory...")
 
-    rows.sort(key=lambda x: (x[0], x[1]))
+    with nav_state.NavState(args.state) as state:
+        if args.segments:
+            with instrument.stage("checkout"):
+                restored = nav_segments.checkout(state, args.nav_dir)
+            print(f"🧱 CSVs restored from segments: {restored:,}")
+        total = export(state, args.nav_dir, args.out_dir, rebuild=args.rebuild, jobs=args.jobs)
 
-    with open(out_file, "a", newline="", encoding="utf-8") as f:
-        writer = csv.writer(f)
-        if write_header:
-            writer.writerow(["SchemeCode", "Date", "NAV"])
-        writer.writerows(rows)
+    print(f"\n🎉 Year-wise NAV files updated successfully ✅ ({total:,} rows)")
 
-    print(f"📅 {year} → ✍️ {len(rows)} rows")
 
-print("\n🎉 Year-wise NAV files updated successfully ✅")
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,325 @@
+"""Asyncio fetch engine shared by the NAV fetch scripts.
+
+One pooled keep-alive client (HTTP/2 when ``h2`` is installed) is reused for
+every request, pacing is done by a single global token bucket instead of
+per-worker sleeps, and the number of in-flight requests is capped.
+
+An :class:`AimdController` can move that cap and the bucket rate at run
+time: additive increase while responses are fast and clean, multiplicative
+decrease on 429/5xx, timeouts or slow responses.  Retryable failures are
+re-queued with jittered exponential backoff (honouring ``Retry-After``).
+``AimdController`` and :func:`backoff_delay` have no httpx dependency and
+are used by the synchronous fetchers too.  Every attempt, on either path,
+is recorded in ``instrument``'s HTTP latency histogram.
+
+Requires ``httpx`` (``pip install "httpx[http2]"``); callers should check
+``engine_available()`` and fall back to the threaded path otherwise.
+"""
+
+import asyncio
+import contextlib
+import random
+import threading
+import time
+
+import instrument
+
+try:
+    import httpx
+except ImportError:  # optional dependency
+    httpx = None
+
+try:
+    import h2  # noqa: F401  (only needed to enable HTTP/2 in httpx)
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+
+def engine_available():
+    return httpx is not None
+
+
+class TokenBucket:
+    """Global request pacing: ``rate`` tokens per second, up to ``burst``."""
+
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.burst = float(burst if burst is not None else max(1.0, rate))
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        if self.rate <= 0:
+            return
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(
+                    self.burst,
+                    self._tokens + (now - self._updated) * self.rate
+                )
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class AimdController:
+    """Additive-increase / multiplicative-decrease of concurrency and rate.
+
+    Every ``limit`` healthy responses (one window) add one slot and
+    ``rate_step`` req/s; a throttled or failed response, or one slower than
+    ``target_latency``, multiplies both by ``decrease``.  Decreases are
+    spaced by ``cooldown`` seconds so one burst of failures from the same
+    in-flight batch only backs off once.  ``min == max`` pins a value.
+    """
+
+    def __init__(self, concurrency=8, rate=10.0, min_concurrency=1,
+                 max_concurrency=None, min_rate=1.0, max_rate=None,
+                 target_latency=2.0, decrease=0.5, cooldown=1.0, rate_step=None):
+        self.limit = concurrency
+        self.rate = float(rate)
+        self.min_concurrency = min_concurrency
+        self.max_concurrency = max_concurrency or concurrency
+        self.min_rate = min(min_rate, self.rate)
+        self.max_rate = float(max_rate or rate)
+        self.rate_step = rate_step if rate_step is not None else self.rate / max(1, concurrency)
+        self.target_latency = target_latency
+        self.decrease = decrease
+        self.cooldown = cooldown
+
+        self.peak = concurrency
+        self.backoffs = 0
+        self._healthy = 0
+        self._last_decrease = 0.0
+        self._lock = threading.Lock()
+        self._slots = threading.Condition()
+        self._in_flight = 0
+
+    @classmethod
+    def fixed(cls, concurrency, rate):
+        return cls(concurrency, rate, min_concurrency=concurrency,
+                   max_concurrency=concurrency, min_rate=rate, max_rate=rate)
+
+    @contextlib.contextmanager
+    def slot(self):
+        """Hold one of ``limit`` request slots, for thread pools sized at
+        ``max_concurrency``: the threads beyond the current limit wait."""
+        with self._slots:
+            self._slots.wait_for(lambda: self._in_flight < self.limit)
+            self._in_flight += 1
+        try:
+            yield
+        finally:
+            with self._slots:
+                self._in_flight -= 1
+                self._slots.notify_all()
+
+    def record(self, ok, latency):
+        """Feed one response; ``ok`` is False for 429/5xx/network errors."""
+        with self._lock:
+            if ok and latency <= self.target_latency:
+                self._healthy += 1
+                if self._healthy >= self.limit:
+                    self._healthy = 0
+                    self.limit = min(self.max_concurrency, self.limit + 1)
+                    self.rate = min(self.max_rate, self.rate + self.rate_step)
+                    self.peak = max(self.peak, self.limit)
+                return
+
+            now = time.monotonic()
+            if now - self._last_decrease < self.cooldown:
+                return
+            self._last_decrease = now
+            self._healthy = 0
+            new_limit = max(self.min_concurrency, int(self.limit * self.decrease))
+            new_rate = max(self.min_rate, self.rate * self.decrease)
+            if (new_limit, new_rate) != (self.limit, self.rate):
+                self.backoffs += 1
+            self.limit, self.rate = new_limit, new_rate
+
+
+def is_retryable(status, error=None):
+    """Timeouts, connection errors, 429 and 5xx are worth another try."""
+    return error is not None or status == 429 or (status is not None and 500 <= status < 600)
+
+
+def retry_after(headers):
+    """Seconds from a ``Retry-After: <seconds>`` header, else ``None``."""
+    value = (headers or {}).get("Retry-After")
+    try:
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        return None
+
+
+def backoff_delay(attempt, base=0.5, cap=30.0, after=None):
+    """Full-jitter exponential backoff for retry ``attempt`` (0-based)."""
+    delay = random.uniform(0, min(cap, base * (2 ** attempt)))
+    if after is not None:
+        delay = max(delay, min(cap, after))
+    return delay
+
+
+def call_with_retry(send, retries=0, errors=(), controller=None, base=0.5, cap=30.0):
+    """Synchronous counterpart of the async engine's retry loop.
+
+    ``send()`` returns a ``requests``-style response; any of ``errors``
+    counts as a network failure.  Each attempt is fed to ``controller``.
+    Returns the last response, or re-raises the last error.
+    """
+    for attempt in range(retries + 1):
+        start = time.monotonic()
+        try:
+            r = send()
+        except errors as e:
+            instrument.http(None, time.monotonic() - start, error=e)
+            if controller is not None:
+                controller.record(False, time.monotonic() - start)
+            if attempt == retries:
+                raise
+            time.sleep(backoff_delay(attempt, base, cap))
+            continue
+
+        retry = is_retryable(r.status_code)
+        instrument.http(r.status_code, time.monotonic() - start, len(r.content))
+        if controller is not None:
+            controller.record(not retry, time.monotonic() - start)
+        if not retry or attempt == retries:
+            return r
+        time.sleep(backoff_delay(attempt, base, cap, retry_after(r.headers)))
+
+
+class FetchResult:
+    __slots__ = ("key", "url", "status", "content", "error", "elapsed", "headers",
+                 "attempts")
+
+    def __init__(self, key, url, status=None, content=None, error=None, elapsed=0.0,
+                 headers=None, attempts=1):
+        self.key = key
+        self.url = url
+        self.status = status
+        self.content = content
+        self.error = error
+        self.elapsed = elapsed
+        self.headers = headers or {}
+        self.attempts = attempts
+
+
+def make_client(concurrency, connect_timeout, read_timeout, headers=None, http2=True):
+    limits = httpx.Limits(
+        max_connections=concurrency,
+        max_keepalive_connections=concurrency,
+    )
+    timeout = httpx.Timeout(read_timeout, connect=connect_timeout)
+    return httpx.AsyncClient(
+        http2=http2 and HTTP2_AVAILABLE,
+        limits=limits,
+        timeout=timeout,
+        headers=headers or {},
+    )
+
+
+async def _fetch_one(client, bucket, key, url, headers=None):
+    await bucket.acquire()
+    start = time.monotonic()
+    try:
+        r = await client.get(url, headers=headers)
+        elapsed = time.monotonic() - start
+        instrument.http(r.status_code, elapsed, len(r.content))
+        return FetchResult(key, url, r.status_code, r.content,
+                           elapsed=elapsed, headers=r.headers)
+    except httpx.HTTPError as e:
+        elapsed = time.monotonic() - start
+        instrument.http(None, elapsed, error=e)
+        return FetchResult(key, url, error=e, elapsed=elapsed)
+
+
+async def fetch_all_async(jobs, handle, concurrency=8, rate=10.0, burst=None,
+                          connect_timeout=2, read_timeout=5, headers=None,
+                          http2=True, on_result=None, controller=None, retries=0,
+                          backoff_base=0.5, backoff_cap=30.0):
+    """Fetch ``jobs`` through one shared client.
+
+    Each job is ``(key, url)`` or ``(key, url, headers)``; per-request
+    headers carry conditional validators from ``http_cache``.
+
+    ``handle(FetchResult)`` runs in a worker thread so file I/O and JSON
+    parsing never stall the event loop; its return value is passed to
+    ``on_result`` as results complete.  Retryable failures are re-queued
+    up to ``retries`` times before ``handle`` sees them.  Without a
+    ``controller`` concurrency and rate stay fixed.  Returns the number of
+    jobs run.
+    """
+    if controller is None:
+        controller = AimdController.fixed(concurrency, rate)
+
+    queue = asyncio.Queue()
+    for job in jobs:
+        queue.put_nowait((1, job))
+    remaining = queue.qsize()
+    if not remaining:
+        return 0
+
+    bucket = TokenBucket(controller.rate,
+                         burst if burst is not None else controller.max_concurrency)
+    slots = asyncio.Condition()
+    in_flight = 0
+    done = 0
+    loop = asyncio.get_running_loop()
+    n_workers = max(1, controller.max_concurrency)
+
+    async with make_client(controller.max_concurrency, connect_timeout,
+                           read_timeout, headers, http2) as client:
+
+        async def worker():
+            nonlocal done, in_flight, remaining
+            while True:
+                item = await queue.get()
+                if item is None:
+                    return
+                attempt, (key, url, *extra) = item
+
+                async with slots:
+                    await slots.wait_for(lambda: in_flight < controller.limit)
+                    in_flight += 1
+                try:
+                    result = await _fetch_one(client, bucket, key, url, *extra)
+                finally:
+                    async with slots:
+                        in_flight -= 1
+                        slots.notify_all()
+
+                retry = is_retryable(result.status, result.error)
+                controller.record(not retry, result.elapsed)
+                bucket.rate = controller.rate
+
+                if retry and attempt <= retries:
+                    delay = backoff_delay(attempt - 1, backoff_base, backoff_cap,
+                                          retry_after(result.headers))
+                    loop.call_later(delay, queue.put_nowait, (attempt + 1, item[1]))
+                    continue
+
+                result.attempts = attempt
+                out = await asyncio.to_thread(handle, result)
+                done += 1
+                if on_result:
+                    on_result(out)
+
+                remaining -= 1
+                if not remaining:
+                    for _ in range(n_workers):
+                        queue.put_nowait(None)
+
+        workers = [asyncio.create_task(worker()) for _ in range(n_workers)]
+        await asyncio.gather(*workers)
+
+    return done
+
+
+def fetch_all(jobs, handle, **kwargs):
+    """Synchronous wrapper around :func:`fetch_all_async`."""
+    return asyncio.run(fetch_all_async(jobs, handle, **kwargs))
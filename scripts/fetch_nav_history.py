@@ -1,158 +1,664 @@
+import argparse
+import contextvars
 import csv
+import json
 import requests
 import os
 import time
-from datetime import datetime, date
+from datetime import date, timedelta
 from concurrent.futures import ThreadPoolExecutor, as_completed
 
+import backfill
+import categories
+import fetch_engine
+import http_cache
+import instrument
+import mfapi
+import navall
+import nav_parquet
+import nav_segments
+import nav_state
+import scheduler
+
 # ================= CONFIG =================
 CODES_FILE = "data/scheme_codes.csv"
-NAV_DIR = "data/nav_history"
+NAV_DIR = mfapi.NAV_DIR
+STATE_FILE = nav_state.STATE_FILE
+API_URL = mfapi.API_URL
+USER_AGENT = mfapi.USER_AGENT
 
-MAX_WORKERS = 8
+MAX_WORKERS = mfapi.MAX_WORKERS
 REQUEST_DELAY = 0.12
 CONNECT_TIMEOUT = 2
 READ_TIMEOUT = 5
 
+# Both engines pace requests against one global budget instead of a sleep
+# per worker; MAX_WORKERS / REQUEST_DELAY is the pace that sleep allowed.
+CONCURRENCY = MAX_WORKERS
+RATE_LIMIT = MAX_WORKERS / REQUEST_DELAY
+
+# Adaptive (AIMD) bounds: start at the values above, grow while mfapi stays
+# fast and clean, halve on 429/5xx/timeouts or responses slower than this.
+MAX_CONCURRENCY = 32
+MAX_RATE = RATE_LIMIT * 3
+TARGET_LATENCY = 2.0
+
+# Retryable failures are retried with jittered exponential backoff, then
+# parked in the state index's retry queue for the next run.
+RETRIES = 3
+RETRY_CONSUMER = "nav_history"
+
+# With --delta, schemes fetched first to tell a market holiday from a
+# missed NAV when many schemes appear to have the same gap.
+GAP_PROBES = 2 * scheduler.MIN_SPANNING
+
 TODAY = date.today().isoformat()
+UNCHANGED = "🟢 Unchanged since last fetch (HTTP cache)"
+API_ERROR = "🔴 API error"
+NETWORK_ERROR = "🌐 Network error"
+
+# (text in the result line, icon, outcome counted in the run metrics)
+OUTCOMES = [
+    ("Updated", "✅", "updated"),
+    ("Up to date", "🟢", "up_to_date"),
+    ("Unchanged", "🟢", "unchanged"),
+    ("No new NAVs", "🟡", "no_new_navs"),
+    ("API error", "🔴", "api_error"),
+    ("Network error", "🌐", "network_error"),
+    ("No NAV data", "⚠️", "no_nav_data"),
+    ("Error (", "❌", "failed"),
+]
 # ==========================================
 
-print("📁 Checking NAV history directory...")
-os.makedirs(NAV_DIR, exist_ok=True)
-print("✅ NAV history directory ready\n")
 
+# ---------- APPLY API PAYLOAD ----------
+def apply_payload(state, code, filepath, last_date, payload, collector=None):
+    """Apply one mfapi response: NAV rows, plus the category row when
+    ``collector`` is still missing this scheme (so it is fetched once)."""
+    if collector is not None and collector.wants(code):
+        collector.add(code, payload.get("meta"))
+    return mfapi.apply_nav_data(state, code, filepath, last_date, payload.get("data"))
+
+
+def settle(state, code, line, status=None, error=None):
+    """Queue a scheme for the next run if it failed transiently, else clear it."""
+    if line in (API_ERROR, NETWORK_ERROR) and fetch_engine.is_retryable(status, error):
+        state.queue_retry(RETRY_CONSUMER, code, f"{status or type(error).__name__}")
+    else:
+        state.clear_retry(RETRY_CONSUMER, code)
+    return line
 
-# ---------- ULTRA FAST LAST DATE ----------
-def read_last_date(filepath):
-    if not os.path.exists(filepath):
-        return None
+
+def fail(state, code, error):
+    """Park a scheme whose response could not be applied for the next run."""
     try:
-        with open(filepath, "rb") as f:
-            f.seek(-256, os.SEEK_END)
-            last_line = f.readlines()[-1].decode().strip()
-            if last_line and not last_line.startswith("Date"):
-                return last_line.split(",")[0]
-    except Exception:
-        pass
-    return None
+        state.queue_retry(RETRY_CONSUMER, code, type(error).__name__)
+    except Exception as e:
+        print(f"⚠️ Could not queue {code} for retry: {e}")
+    return f"❌ Error ({error})"
 
 
 # ---------- WORKER FUNCTION ----------
 def process_scheme(args):
-    i, total, scheme = args
+    i, total, scheme, state, nav_dir, api_url, cache, collector, retries, controller = args
     code = scheme["SchemeCode"]
-    filepath = os.path.join(NAV_DIR, f"{code}.csv")
+    filepath = os.path.join(nav_dir, f"{code}.csv")
 
     status_line = f"[{i}/{total}] 📌 Scheme {code}"
     result_line = ""
 
-    last_date = read_last_date(filepath)
+    last_date = state.last_date(code, filepath)
 
     if last_date == TODAY:
         result_line = "🟢 Up to date (API skipped)"
         return status_line, result_line
 
-    session = requests.Session()
-    session.headers.update({"User-Agent": "Mozilla/5.0 (NAV-Updater)"})
+    session = mfapi.worker_session()
 
     try:
-        r = session.get(
-            f"https://api.mfapi.in/mf/{code}",
-            timeout=(CONNECT_TIMEOUT, READ_TIMEOUT)
+        url = api_url.format(code=code)
+        timeout = (CONNECT_TIMEOUT, READ_TIMEOUT)
+
+        # No history on disk means nothing to be "unchanged" against.
+        conditional = cache is not None and last_date is not None
+        headers = cache.conditional_headers(url) if conditional else {}
+        with controller.slot():
+            r = fetch_engine.call_with_retry(
+                lambda: session.get(url, headers=headers, timeout=timeout),
+                retries, requests.exceptions.RequestException, controller,
+            )
+            # Each of the controller.limit slots waits its share of the budget
+            # (a rate of 0 is unpaced, as in the async token bucket).
+            if controller.rate > 0:
+                time.sleep(controller.limit / controller.rate)
+        status, content = r.status_code, r.content
+
+        if cache is not None:
+            result = cache.resolve(url, status, r.headers, content)
+            if not conditional and result.status == 200:
+                result.changed = True
+            status, content = result.status, result.content
+
+        if status != 200:
+            return status_line, settle(state, code, API_ERROR, status)
+
+        if cache is not None and not result.changed:
+            return status_line, settle(state, code, UNCHANGED)
+
+        result_line = apply_payload(
+            state, code, filepath, last_date, json.loads(content), collector
         )
+        if cache is not None:
+            cache.commit(result)
+        settle(state, code, result_line)
 
-        if r.status_code != 200:
-            return status_line, "🔴 API error"
-
-        data = r.json().get("data")
-        if not data:
-            return status_line, "⚠️ No NAV data"
-
-        last_date_obj = (
-            datetime.fromisoformat(last_date).date()
-            if last_date else None
-        )
-
-        new_rows = []
-        for row in reversed(data):
-            nav_date = datetime.strptime(row["date"], "%d-%m-%Y").date()
-            if last_date_obj and nav_date <= last_date_obj:
-                continue
-            new_rows.append({
-                "Date": nav_date.isoformat(),
-                "NAV": row["nav"]
-            })
-
-        if not new_rows:
-            return status_line, "🟡 No new NAVs"
-
-        existing_dates = set()
-        if os.path.exists(filepath):
-            with open(filepath, newline="", encoding="utf-8") as f:
-                for r in csv.DictReader(f):
-                    existing_dates.add(r["Date"])
-
-        new_rows_filtered = [
-            r for r in new_rows if r["Date"] not in existing_dates
-        ]
-
-        if new_rows_filtered:
-            write_header = not os.path.exists(filepath)
-            with open(filepath, "a", newline="", encoding="utf-8") as f:
-                writer = csv.DictWriter(f, fieldnames=["Date", "NAV"])
-                if write_header:
-                    writer.writeheader()
-                writer.writerows(new_rows_filtered)
-
-        time.sleep(REQUEST_DELAY)
-
-        result_line = f"✅ Updated | +{len(new_rows_filtered)} NAV rows"
         return status_line, result_line
 
-    except requests.exceptions.RequestException:
-        return status_line, "🌐 Network error"
+    except requests.exceptions.RequestException as e:
+        return status_line, settle(state, code, NETWORK_ERROR, error=e)
     except Exception as e:
-        return status_line, f"❌ Error ({e})"
-
-
-# ---------- LOAD SCHEME CODES ----------
-print("📄 Loading scheme codes...")
-with open(CODES_FILE, newline="", encoding="utf-8") as f:
-    schemes = list(csv.DictReader(f))
-
-total = len(schemes)
-print(f"📊 Total schemes found: {total}")
-print(f"⚙️ Parallel workers: {MAX_WORKERS}\n")
-
-tasks = [(i, total, scheme) for i, scheme in enumerate(schemes, start=1)]
-
-
-# ---------- PARALLEL EXECUTION ----------
-print("🚀 Starting NAV history update...\n")
-
-with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
-    futures = [executor.submit(process_scheme, t) for t in tasks]
-    for future in as_completed(futures):
-        line1, line2 = future.result()
-
-        scheme_code = line1.split()[-1]
-        index_part = line1.split("]")[0] + "]"
-
-        if "Updated" in line2:
-            icon = "✅"
-        elif "Up to date" in line2:
-            icon = "🟢"
-        elif "No new NAVs" in line2:
-            icon = "🟡"
-        elif "API error" in line2:
-            icon = "🔴"
-        elif "Network error" in line2:
-            icon = "🌐"
+        return status_line, fail(state, code, e)
+
+
+# ---------- OUTPUT ----------
+def outcome(line):
+    for text, icon, name in OUTCOMES:
+        if text in line:
+            return icon, name
+    return "⚠️", "other"
+
+
+def report(line1, line2):
+    icon, name = outcome(line2)
+    instrument.count(f"schemes_{name}")
+    if instrument.quiet():
+        return
+
+    scheme_code = line1.split()[-1]
+    index_part = line1.split("]")[0] + "]"
+    print(f"{index_part} {scheme_code} {icon} {line2}")
+
+
+def checkpointed(checkpoint, state, collector, nav_dir=NAV_DIR, on_result=report):
+    """``on_result`` that also records each finished scheme in ``checkpoint``.
+
+    Category rows found on the way go into the checkpoint with the scheme;
+    ``backfill.merge`` adds them to the categories file.
+    """
+    known = set(collector.rows) if collector is not None else set()
+
+    def handle(line1, line2):
+        on_result(line1, line2)
+        code = line1.split()[-1]
+        filepath = os.path.join(nav_dir, f"{code}.csv")
+        category = None
+        if collector is not None and code not in known:
+            category = collector.rows.get(code)
+        checkpoint.record(code, outcome(line2)[1], state.last_date(code, filepath), category)
+
+    return handle
+
+
+def print_outcomes():
+    totals = instrument.totals()
+    icons = {name: icon for _, icon, name in OUTCOMES}
+    parts = [
+        f"{icons.get(name, '⚠️')} {name.replace('_', ' ')} {totals[f'schemes_{name}']:,}"
+        for name in list(icons) + ["other"]
+        if totals.get(f"schemes_{name}")
+    ]
+    if parts:
+        print("\n📋 Schemes: " + " · ".join(parts))
+
+
+# ---------- THREADED ENGINE ----------
+def run_threaded(schemes, state, nav_dir=NAV_DIR, api_url=API_URL,
+                 workers=MAX_WORKERS, rate=RATE_LIMIT, on_result=report, cache=None,
+                 collector=None, controller=None, retries=RETRIES):
+    """Fetch on a thread pool; pass an ``AimdController`` to adapt the
+    workers in flight and the rate (otherwise ``workers`` and ``rate`` stay
+    fixed)."""
+    if controller is None:
+        controller = fetch_engine.AimdController.fixed(workers, rate)
+    total = len(schemes)
+    tasks = [
+        (i, total, scheme, state, nav_dir, api_url, cache, collector, retries, controller)
+        for i, scheme in enumerate(schemes, start=1)
+    ]
+
+    # max_concurrency threads, of which only controller.limit hold a request slot.
+    with ThreadPoolExecutor(max_workers=controller.max_concurrency) as executor:
+        # Each worker runs in a copy of this context, so its rows are
+        # counted under the caller's instrument stage.
+        futures = [executor.submit(contextvars.copy_context().run, process_scheme, t)
+                   for t in tasks]
+        for future in as_completed(futures):
+            on_result(*future.result())
+
+    return total
+
+
+# ---------- ASYNC ENGINE ----------
+def run_async(schemes, state, nav_dir=NAV_DIR, api_url=API_URL,
+              concurrency=CONCURRENCY, rate=RATE_LIMIT, on_result=report,
+              cache=None, collector=None, controller=None, retries=RETRIES):
+    """Fetch on the async engine; pass an ``AimdController`` to adapt
+    concurrency and rate (otherwise both stay fixed)."""
+    total = len(schemes)
+    pending = {}
+    jobs = []
+
+    for i, scheme in enumerate(schemes, start=1):
+        code = scheme["SchemeCode"]
+        filepath = os.path.join(nav_dir, f"{code}.csv")
+        status_line = f"[{i}/{total}] 📌 Scheme {code}"
+        last_date = state.last_date(code, filepath)
+
+        if last_date == TODAY:
+            on_result(status_line, "🟢 Up to date (API skipped)")
+            continue
+
+        pending[code] = (status_line, code, filepath, last_date)
+        url = api_url.format(code=code)
+        if cache is not None and last_date is not None:
+            jobs.append((code, url, cache.conditional_headers(url)))
         else:
-            icon = "⚠️"
-
-        print(f"{index_part} {scheme_code} {icon} {line2}")
-
+            jobs.append((code, url))
+
+    def apply(result, code, filepath, last_date):
+        if result.error is not None:
+            return settle(state, code, NETWORK_ERROR, error=result.error)
+
+        status, content = result.status, result.content
+        if cache is not None:
+            cached = cache.resolve(result.url, status, result.headers, content)
+            if last_date is None and cached.status == 200:
+                cached.changed = True
+            status, content = cached.status, cached.content
+
+        if status != 200:
+            return settle(state, code, API_ERROR, status)
+        if cache is not None and not cached.changed:
+            return settle(state, code, UNCHANGED)
+        line = apply_payload(state, code, filepath, last_date, json.loads(content), collector)
+        if cache is not None:
+            cache.commit(cached)
+        return settle(state, code, line)
+
+    def handle(result):
+        status_line, code, filepath, last_date = pending[result.key]
+        try:
+            return status_line, apply(result, code, filepath, last_date)
+        except Exception as e:
+            return status_line, fail(state, code, e)
+
+    fetch_engine.fetch_all(
+        jobs,
+        handle,
+        concurrency=concurrency,
+        rate=rate,
+        connect_timeout=CONNECT_TIMEOUT,
+        read_timeout=READ_TIMEOUT,
+        headers={"User-Agent": USER_AGENT},
+        on_result=lambda out: on_result(*out),
+        controller=controller,
+        retries=retries,
+    )
+
+    return total
+
+
+# ---------- DAILY DELTA (NAVAll.txt) ----------
+def load_latest_navs(navall_file=None, cache=None):
+    """Map scheme code → (ISO date, NAV) from one NAVAll.txt download.
+
+    With ``cache`` the body is kept on disk, so an unchanged file costs a
+    304 instead of a full download.
+    """
+    result = None
+    if navall_file:
+        with open(navall_file, encoding="utf-8", errors="replace") as f:
+            text = f.read()
+    elif cache is not None:
+        result = navall.fetch(cache, store_body=True)
+        text = navall.decode(result.content)
+    else:
+        text = navall.download()
+
+    latest = {}
+    for row in navall.parse(text.splitlines()):
+        latest[row["SchemeCode"]] = (
+            navall.iso_date(row["Date"]),
+            navall.history_nav(row["NAV"]),
+        )
 
-print("\n🎉 NAV history update completed successfully ✅")
-print("📦 All available NAV data is now up to date\n")
+    if result is not None:
+        cache.commit(result)
+    return latest
+
+
+def has_gap(last_date, nav_date, holidays=()):
+    """True if a trading day (a weekday not in ``holidays``) is missing
+    between the stored and the latest NAV."""
+    d = date.fromisoformat(last_date) + timedelta(days=1)
+    end = date.fromisoformat(nav_date)
+    while d < end:
+        if d.weekday() < 5 and d.isoformat() not in holidays:
+            return True
+        d += timedelta(days=1)
+    return False
+
+
+def gap_probes(schemes, latest, state, nav_dir=NAV_DIR, size=GAP_PROBES):
+    """Schemes to fetch in full before the rest of the delta's backfill.
+
+    After a weekday market holiday every current scheme looks like it has a
+    gap.  Their histories show whether that day was a holiday, so fetching
+    ``size`` of them (spread over the list) and learning holidays from the
+    result saves a full-history request for each of the others.  Returns
+    nothing when fetching every candidate is about as cheap.
+    """
+    as_of = scheduler.list_date(scheduler.amfi_dates((), latest))
+    candidates = [
+        s for s in schemes
+        if latest.get(s["SchemeCode"], (None,))[0] == as_of
+        and state.last_date(s["SchemeCode"], os.path.join(nav_dir, f"{s['SchemeCode']}.csv"))
+    ]
+    if len(candidates) <= 2 * size:
+        return []
+    step = len(candidates) // size
+    return candidates[::step][:size]
+
+
+def run_delta(schemes, latest, state, nav_dir=NAV_DIR, on_result=report, holidays=()):
+    """Append the NAVAll.txt row where it is the next NAV after the file's
+    last date (``holidays`` are not gaps); return the schemes that need a
+    full API fetch instead."""
+    total = len(schemes)
+    needs_api = []
+
+    for i, scheme in enumerate(schemes, start=1):
+        code = scheme["SchemeCode"]
+        filepath = os.path.join(nav_dir, f"{code}.csv")
+        status_line = f"[{i}/{total}] 📌 Scheme {code}"
+
+        last_date = state.last_date(code, filepath)
+        nav_date, nav = latest.get(code, (None, None))
+
+        if not last_date or not nav_date:
+            needs_api.append(scheme)
+            continue
+
+        if not nav:
+            on_result(status_line, "⚠️ No NAV data")
+            continue
+
+        if nav_date <= last_date:
+            on_result(status_line, "🟢 Up to date (NAVAll)")
+            continue
+
+        try:
+            gap = has_gap(last_date, nav_date, holidays)
+        except ValueError:
+            gap = True
+        if gap:
+            needs_api.append(scheme)
+            continue
+
+        if nav_date in mfapi.quarantined_dates(code):
+            on_result(status_line, "🟡 No new NAVs (quarantined)")
+            continue
+
+        state.append(code, filepath, [(nav_date, nav)])
+
+        on_result(status_line, "✅ Updated | +1 NAV rows (NAVAll)")
+
+    return needs_api
+
+
+def load_schemes(codes_file=CODES_FILE):
+    with open(codes_file, newline="", encoding="utf-8") as f:
+        return list(csv.DictReader(f))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Incremental NAV history fetch from mfapi.in")
+    parser.add_argument("--engine", choices=["auto", "async", "threads"], default="auto",
+                        help="HTTP engine (auto = async when httpx is installed)")
+    parser.add_argument("--concurrency", type=int, default=CONCURRENCY,
+                        help="Max in-flight requests (async) or worker threads")
+    parser.add_argument("--rate", type=float, default=RATE_LIMIT,
+                        help="Global request budget per second")
+    parser.add_argument("--max-concurrency", type=int, default=MAX_CONCURRENCY,
+                        help="Upper bound for adaptive concurrency")
+    parser.add_argument("--max-rate", type=float, default=MAX_RATE,
+                        help="Upper bound for the adaptive request rate")
+    parser.add_argument("--fixed", action="store_true",
+                        help="Keep --concurrency/--rate fixed instead of adapting them")
+    parser.add_argument("--retries", type=int, default=RETRIES,
+                        help="Retries per request on 429/5xx/network errors")
+    parser.add_argument("--delta", action="store_true",
+                        help="Append today's NAVs from AMFI NAVAll.txt; call the API only to backfill gaps and new schemes")
+    parser.add_argument("--navall", metavar="FILE",
+                        help="Use a local NAVAll.txt instead of downloading it (with --delta)")
+    parser.add_argument("--parquet", action="store_true",
+                        help="Also append new rows to the Parquet store (data/nav_parquet)")
+    parser.add_argument("--segments", action="store_true",
+                        help=f"Restore CSVs from {nav_segments.SEGMENT_DIR} first, sync new rows back after")
+    parser.add_argument("--no-categories", action="store_true",
+                        help=f"Do not fill {categories.CATEGORY_FILE} from the fetched responses")
+    parser.add_argument("--no-cache", action="store_true",
+                        help=f"Skip the conditional-request cache in {http_cache.CACHE_DIR}")
+    parser.add_argument("--api-url", default=API_URL,
+                        help="mfapi URL template with {code} (e.g. a local stub)")
+    parser.add_argument("--shard", metavar="i/N",
+                        help="Fetch only shard i of N (checkpointed; combine with scripts/backfill.py merge)")
+    parser.add_argument("--checkpoint", metavar="FILE",
+                        help=f"Shard checkpoint (default: {backfill.CHECKPOINT_DIR}/shard-i-of-N.jsonl)")
+    parser.add_argument("--restart", action="store_true",
+                        help="Discard the shard checkpoint instead of resuming it")
+    parser.add_argument("--schedule", action="store_true",
+                        help="Request only schemes likely to have a new NAV, most overdue first (scripts/scheduler.py)")
+    parser.add_argument("--budget", type=int, metavar="N",
+                        help="With --schedule: at most N API requests this run")
+    instrument.add_arguments(parser)
+
+    args = parser.parse_args(argv)
+    instrument.start("fetch_nav_history", args)
+
+    engine = args.engine
+    if engine == "auto":
+        engine = "async" if fetch_engine.engine_available() else "threads"
+    elif engine == "async" and not fetch_engine.engine_available():
+        parser.error("--engine async requires httpx (pip install \"httpx[http2]\")")
+    shard = None
+    if args.shard:
+        try:
+            shard = backfill.parse_shard(args.shard)
+        except ValueError as e:
+            parser.error(str(e))
+    if args.shard and args.schedule:
+        parser.error("--schedule skips schemes; a --shard run must fetch all of its schemes")
+    if args.budget is not None and not args.schedule:
+        parser.error("--budget requires --schedule")
+    if args.schedule and not scheduler.available():
+        parser.error("--schedule requires numpy (pip install numpy)")
+    if args.parquet and not nav_parquet.available():
+        parser.error("--parquet requires pyarrow (pip install pyarrow)")
+    if args.segments and not nav_segments.available():
+        parser.error("--segments requires zstandard (pip install zstandard)")
+
+    print("📁 Checking NAV history directory...")
+    os.makedirs(NAV_DIR, exist_ok=True)
+    print("✅ NAV history directory ready\n")
+
+    # ---------- LOAD SCHEME CODES ----------
+    print("📄 Loading scheme codes...")
+    schemes = load_schemes()
+
+    print(f"📊 Total schemes found: {len(schemes)}")
+    listed = schemes
+    if shard is not None:
+        schemes = backfill.select(schemes, *shard)
+        print(f"🧩 Shard {shard[0]}/{shard[1]}: {len(schemes)} schemes")
+    controller = None
+    if engine == "async":
+        http = "HTTP/2" if fetch_engine.HTTP2_AVAILABLE else "HTTP/1.1"
+        label = f"Async engine ({http})"
+    else:
+        label = "Parallel workers"
+    if args.fixed:
+        print(f"⚙️ {label}: concurrency {args.concurrency}, rate {args.rate:.1f} req/s\n")
+    else:
+        controller = fetch_engine.AimdController(
+            args.concurrency, args.rate,
+            max_concurrency=max(args.concurrency, args.max_concurrency),
+            max_rate=max(args.rate, args.max_rate),
+            target_latency=TARGET_LATENCY,
+        )
+        print(f"⚙️ {label}: adaptive concurrency "
+              f"{args.concurrency}→≤{controller.max_concurrency}, "
+              f"rate {args.rate:.1f}→≤{controller.max_rate:.1f} req/s\n")
+
+    cache = None if args.no_cache else http_cache.HttpCache(namespace="nav_history")
+    collector = None if args.no_categories else categories.Collector()
+
+    checkpoint = None
+    on_result = report
+    if shard is not None:
+        path = args.checkpoint or backfill.checkpoint_path(*shard)
+        checkpoint = backfill.Checkpoint(path, f"{shard[0]}/{shard[1]}", restart=args.restart)
+        shard_codes = [s["SchemeCode"] for s in schemes]
+        if checkpoint.resumed:
+            done = checkpoint.completed()
+            schemes = [s for s in schemes if s["SchemeCode"] not in done]
+            print(f"⏭️ Resuming {path}: {len(done)} schemes already finished, "
+                  f"{len(schemes)} to go")
+        else:
+            print(f"📝 Checkpoint → {path}")
+
+    with nav_state.NavState(STATE_FILE) as state:
+        if checkpoint is not None:
+            on_result = checkpointed(checkpoint, state, collector)
+
+        def fetch(batch):
+            if engine == "async":
+                run_async(batch, state, api_url=args.api_url, on_result=on_result,
+                          concurrency=args.concurrency, rate=args.rate,
+                          cache=cache, collector=collector, controller=controller,
+                          retries=args.retries)
+            else:
+                run_threaded(batch, state, api_url=args.api_url, on_result=on_result,
+                             workers=args.concurrency, rate=args.rate, cache=cache,
+                             collector=collector, controller=controller,
+                             retries=args.retries)
+
+        if args.segments:
+            with instrument.stage("checkout"):
+                restored = nav_segments.checkout(state, NAV_DIR)
+            print(f"🧱 CSVs restored from segments: {restored:,}\n")
+
+        queued = state.retry_queue(RETRY_CONSUMER)
+        if queued:
+            print(f"🔁 Retry queue from earlier runs: {len(queued)} schemes (tried first)\n")
+
+        latest = None
+        if args.delta:
+            with instrument.stage("delta"):
+                print("🌐 Loading latest NAVs from AMFI NAVAll.txt...")
+                latest = load_latest_navs(args.navall, cache)
+                print(f"✅ Latest NAVs loaded: {len(latest)}\n")
+
+                amfi = scheduler.amfi_dates(listed, latest)
+                holidays = set(scheduler.learn_holidays(scheduler.calendar_paths(listed, amfi, NAV_DIR)))
+
+                print("📥 Applying daily delta...\n")
+                schemes = run_delta(schemes, latest, state, on_result=on_result, holidays=holidays)
+
+                probes = gap_probes(schemes, latest, state)
+                if probes:
+                    print(f"\n🔎 {len(schemes)} schemes need backfill; fetching {len(probes)} "
+                          "first to check for a market holiday...\n")
+                    with instrument.stage("probe"):
+                        fetch(probes)
+                    holidays.update(scheduler.learn_holidays(
+                        os.path.join(NAV_DIR, f"{s['SchemeCode']}.csv") for s in probes))
+                    probed = {s["SchemeCode"] for s in probes}
+                    schemes = run_delta([s for s in schemes if s["SchemeCode"] not in probed],
+                                        latest, state, on_result=on_result, holidays=holidays)
+                print(f"\n🔁 Schemes needing API backfill: {len(schemes)}\n")
+
+            # Queued schemes the delta brought up to date need no retry.
+            needs_api = {s["SchemeCode"] for s in schemes + probes}
+            for code in queued:
+                if code not in needs_api:
+                    state.clear_retry(RETRY_CONSUMER, code)
+
+        plan = None
+        if args.schedule:
+            with instrument.stage("schedule"):
+                amfi = scheduler.amfi_dates(listed, latest)
+                plan = scheduler.plan(schemes, state, amfi, listed=listed, queued=queued,
+                                      nav_dir=NAV_DIR, budget=args.budget)
+            print(f"🗓️ Schedule: {scheduler.summary(plan)}")
+            print(f"🚀 Requests planned: {len(plan.schemes):,} of {len(schemes):,}\n")
+            instrument.count("schemes_not_scheduled", len(schemes) - len(plan.schemes))
+            schemes = plan.schemes
+
+        schemes.sort(key=lambda s: s["SchemeCode"] not in queued)
+
+        print("🚀 Starting NAV history update...\n")
+
+        with instrument.stage("fetch"):
+            fetch(schemes)
+        print_outcomes()
+
+        if plan is not None:
+            scheduler.record(state, plan, NAV_DIR)
+
+        if controller is not None:
+            print(f"\n⚙️ Adaptive: ended at concurrency {controller.limit} "
+                  f"(peak {controller.peak}), rate {controller.rate:.1f} req/s, "
+                  f"{controller.backoffs} backoffs")
+
+        left = len(state.retry_queue(RETRY_CONSUMER))
+        if left:
+            print(f"🔁 Schemes queued for retry next run: {left}")
+
+        if checkpoint is not None:
+            left = checkpoint.finish(shard_codes)
+            checkpoint.close()
+            if left:
+                print(f"\n🧩 Shard {checkpoint.shard}: {len(left)} schemes unfinished, "
+                      f"rerun to resume from {checkpoint.path}")
+            else:
+                print(f"\n🧩 Shard {checkpoint.shard} complete; merge with scripts/backfill.py merge")
+
+        if collector is not None and checkpoint is not None:
+            print(f"\n🏷️ Scheme categories kept in the checkpoint: {collector.added}")
+        elif collector is not None:
+            with instrument.stage("categories"):
+                added = collector.save()
+            print(f"\n🏷️ Scheme categories added from the same responses: {added}")
+
+        if args.parquet:
+            print("\n🧱 Syncing Parquet store...")
+            with instrument.stage("parquet"):
+                rows = nav_parquet.sync(state)
+            print(f"✅ Parquet rows appended: {rows:,}")
+
+        if args.segments:
+            print("\n🧱 Syncing NAV segments...")
+            with instrument.stage("segments"):
+                lines, rewritten = nav_segments.sync(state, NAV_DIR)
+            print(f"✅ Segment lines appended: {lines:,}, schemes re-encoded: {rewritten}")
+
+    if cache is not None:
+        cache.close()
+
+    print("\n🎉 NAV history update completed successfully ✅")
+    print("📦 All available NAV data is now up to date\n")
+
+
+if __name__ == "__main__":
+    main()
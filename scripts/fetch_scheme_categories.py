@@ -1,35 +1,51 @@
 import csv
+import json
 import requests
 import time
 import os
 import sys
+from concurrent.futures import ThreadPoolExecutor
 
-CATEGORY_FILE = "data/scheme_categories.csv"
+import categories
+import fetch_engine
+import http_cache
+import instrument
+import mfapi
+import nav_state
+
+CATEGORY_FILE = categories.CATEGORY_FILE
 CODE_FILE = "data/scheme_codes.csv"
+NAV_DIR = mfapi.NAV_DIR
 
 # ---------- ADAPTIVE SETTINGS ---------- #
-BASE_REQUEST_DELAY = 0.12
-BASE_CHUNK_DELAY = 6
-
-FIELDNAMES = [
-    "SchemeCode",
-    "AMC",
-    "SchemeType",
-    "CategoryRaw",
-    "Category",
-    "SubCategory"
-]
-
-existing = {}
+# Pace starts at REQUEST_DELAY on one connection and is steered by an AIMD
+# controller, like the NAV fetcher: every clean, fast window adds a request
+# slot (up to MAX_CONCURRENCY) and RATE_STEP req/s, 429/5xx/timeouts halve both.
+# MAX_RATE stays the global budget however many slots are open, so extra
+# slots only hide latency.  Failed requests are retried with
+# jittered backoff and left in the state index's retry queue for the next run.
+CHUNK_SIZE = 100          # schemes between saves
+REQUEST_DELAY = 0.12
+MAX_CONCURRENCY = mfapi.MAX_WORKERS
+MIN_RATE = 1.0
+MAX_RATE = 20.0
+RATE_STEP = 0.5
+TARGET_LATENCY = 2.0
+RETRIES = 3
+RETRY_CONSUMER = "scheme_categories"
+
 printed_schemes = set()   # 🔹 track printed scheme names
 
+instrument.start("fetch_scheme_categories")
+
 print("📂 Loading existing category data...")
 
 # ---------- LOAD EXISTING DATA ---------- #
-if os.path.exists(CATEGORY_FILE):
-    with open(CATEGORY_FILE, newline="", encoding="utf-8") as f:
-        for row in csv.DictReader(f):
-            existing[row["SchemeCode"]] = row
+# A journal left by an interrupted run is replayed here.
+store = categories.CategoryStore(CATEGORY_FILE)
+existing = store.rows
+if store.pending:
+    print(f"🧾 Recovered {store.pending} journaled rows from an interrupted run")
 
 print(f"✅ Existing schemes loaded: {len(existing)}")
 
@@ -45,29 +61,99 @@ total_pending = len(pending_codes)
 print(f"⏳ Pending schemes to process: {total_pending}")
 
 if total_pending == 0:
+    store.compact()
     print("Nothing to process. Exiting ✅")
     sys.exit(0)
 
-# ---------- ADAPTIVE CHUNK SIZE ---------- #
-if total_pending > 8000:
-    CHUNK_SIZE = 100
-    REQUEST_DELAY = 0.10
-elif total_pending > 2000:
-    CHUNK_SIZE = 75
-    REQUEST_DELAY = 0.12
-else:
-    CHUNK_SIZE = 50
-    REQUEST_DELAY = 0.15
+pacer = fetch_engine.AimdController(
+    1, 1 / REQUEST_DELAY,
+    max_concurrency=MAX_CONCURRENCY, min_rate=MIN_RATE, max_rate=MAX_RATE,
+    rate_step=RATE_STEP, target_latency=TARGET_LATENCY,
+)
 
 print(
     f"⚙️ Using CHUNK_SIZE={CHUNK_SIZE}, "
-    f"REQUEST_DELAY={REQUEST_DELAY}s"
+    f"adaptive pace {pacer.rate:.1f} req/s (≤{MAX_RATE:.0f}), "
+    f"workers {pacer.limit} (≤{MAX_CONCURRENCY})"
 )
 
-session = requests.Session()
-session.headers.update({"User-Agent": "Mozilla/5.0"})
+# Pending schemes are ones whose last response had no usable category;
+# if mfapi still serves the same bytes there is nothing new to parse.
+cache = http_cache.HttpCache(namespace="scheme_categories")
+unchanged = 0
+
+# The same response carries the NAV history: store it now so
+# fetch_nav_history.py does not download the scheme a second time.
+os.makedirs(NAV_DIR, exist_ok=True)
+state = nav_state.NavState(nav_state.STATE_FILE)
+
+queued = state.retry_queue(RETRY_CONSUMER)
+if queued:
+    print(f"🔁 Retry queue from earlier runs: {len(queued)} schemes (tried first)")
+    pending_codes.sort(key=lambda r: r["SchemeCode"] not in queued)
+
+# ---------- FETCH ONE SCHEME ---------- #
+def fetch_category(row):
+    """Fetch one scheme; returns ``(outcome, cache result)`` where outcome
+    is "added", "unchanged", "no_category" or None (failed/not usable)."""
+    scheme_code = row["SchemeCode"]
+    url = mfapi.API_URL.format(code=scheme_code)
+    session = mfapi.worker_session()
+
+    try:
+        with pacer.slot():
+            r = fetch_engine.call_with_retry(
+                lambda: session.get(url, headers=cache.conditional_headers(url),
+                                    timeout=(5, 10)),
+                RETRIES, requests.exceptions.RequestException, pacer,
+            )
+            # Each of the pacer.limit slots waits its share of the budget.
+            time.sleep(pacer.limit / pacer.rate)
+
+        result = cache.resolve(url, r.status_code, r.headers, r.content)
+
+        if result.status != 200:
+            if fetch_engine.is_retryable(result.status):
+                state.queue_retry(RETRY_CONSUMER, scheme_code, str(result.status))
+            return None, None
+
+        state.clear_retry(RETRY_CONSUMER, scheme_code)
+
+        if not result.changed:
+            return "unchanged", None
+
+        payload = json.loads(result.content)
+
+        # ---------- NAV HISTORY FROM THE SAME RESPONSE ---------- #
+        filepath = os.path.join(NAV_DIR, f"{scheme_code}.csv")
+        nav_line = mfapi.apply_nav_data(
+            state, scheme_code, filepath,
+            state.last_date(scheme_code, filepath), payload.get("data")
+        )
+        if nav_line.startswith("✅"):
+            instrument.count("nav_updates")
+
+        row_data = categories.category_row(scheme_code, payload.get("meta"))
+        if row_data is None:
+            cache.commit(result)
+            return "no_category", None
+
+        existing[scheme_code] = row_data
+        return "added", result
+
+    except requests.exceptions.RequestException as e:
+        state.queue_retry(RETRY_CONSUMER, scheme_code, type(e).__name__)
+        print("🌐 Network error:", scheme_code, e)
+    except Exception as e:
+        state.queue_retry(RETRY_CONSUMER, scheme_code, type(e).__name__)
+        print("❌ Error:", scheme_code, e)
+    return None, None
+
 
 # ---------- PROCESS IN CHUNKS ---------- #
+# MAX_CONCURRENCY threads, of which only pacer.limit hold a request slot.
+pool = ThreadPoolExecutor(max_workers=MAX_CONCURRENCY)
+
 for i in range(0, total_pending, CHUNK_SIZE):
     chunk = pending_codes[i:i + CHUNK_SIZE]
 
@@ -77,70 +163,48 @@ for i in range(0, total_pending, CHUNK_SIZE):
     )
 
     for row in chunk:
-        scheme_code = row["SchemeCode"]
         scheme_name = row.get("SchemeName", "").strip()
 
         # ✅ print scheme name only once
         if scheme_name and scheme_name not in printed_schemes:
-            print(f"📄 Scheme detected: {scheme_name}")
+            instrument.detail(f"📄 Scheme detected: {scheme_name}")
             printed_schemes.add(scheme_name)
 
-        try:
-            r = session.get(
-                f"https://api.mfapi.in/mf/{scheme_code}",
-                timeout=(5, 10)
-            )
+    outcomes = list(pool.map(fetch_category, chunk))
 
-            if r.status_code != 200:
-                continue
+    unchanged += sum(outcome == "unchanged" for outcome, _ in outcomes)
+    # cache results to commit once the chunk is on disk
+    added = [(row["SchemeCode"], result)
+             for row, (outcome, result) in zip(chunk, outcomes) if outcome == "added"]
 
-            meta = r.json().get("meta", {})
-            if not meta:
-                continue
-
-            amc = meta.get("fund_house", "").strip()
-            scheme_type = meta.get("scheme_type", "").strip()
-            category_raw = meta.get("scheme_category", "").strip()
-
-            if not category_raw:
-                continue
-
-            # ---------- CATEGORY SPLIT ---------- #
-            cleaned_category = category_raw.replace(" Scheme", "").strip()
+    # ---------- SAVE AFTER EACH CHUNK ---------- #
+    state.commit()
 
-            if " - " in category_raw:
-                category, sub_category = cleaned_category.split(" - ", 1)
-                category = category.strip()
-                sub_category = sub_category.strip()
-            else:
-                category = cleaned_category
-                sub_category = ""
+    if not added:
+        print("🟡 No new categories in chunk, file left as is")
+        continue
 
-            existing[scheme_code] = {
-                "SchemeCode": scheme_code,
-                "AMC": amc,
-                "SchemeType": scheme_type,
-                "CategoryRaw": category_raw,
-                "Category": category,
-                "SubCategory": sub_category
-            }
+    # Only this chunk's rows are written (and fsynced) to the journal.
+    store.append([existing[result_code] for result_code, _ in added])
+    instrument.count("categories_added", len(added))
 
-            time.sleep(REQUEST_DELAY)
+    for _, result in added:
+        cache.commit(result)
 
-        except Exception as e:
-            print("❌ Error:", scheme_code, e)
+    print(f"💾 Chunk journaled ✅ ({len(added)} rows, pace {pacer.rate:.1f} req/s)")
 
-    # ---------- SAVE AFTER EACH CHUNK ---------- #
-    os.makedirs("data", exist_ok=True)
+pool.shutdown()
 
-    with open(CATEGORY_FILE, "w", newline="", encoding="utf-8") as f:
-        writer = csv.DictWriter(f, fieldnames=FIELDNAMES)
-        writer.writeheader()
-        for v in existing.values():
-            writer.writerow(v)
+if store.compact():
+    print(f"🗜️ Journal compacted into {CATEGORY_FILE}")
 
-    print("💾 Chunk saved successfully ✅")
-    time.sleep(BASE_CHUNK_DELAY)
+cache.close()
+state.close()
 
 print("\n🎉 All chunks processed successfully")
+print(f"🟢 Unchanged responses skipped (HTTP cache): {unchanged}")
+print(f"📈 NAV histories updated from the same responses: "
+      f"{instrument.totals().get('nav_updates', 0)}")
+print(f"⚙️ Final pace {pacer.rate:.1f} req/s, {pacer.peak} peak workers, "
+      f"{pacer.backoffs} backoffs")
 print(f"📄 Total unique schemes displayed: {len(printed_schemes)}")
@@ -1,74 +1,102 @@
-import requests
 import csv
 import os
+import sys
+
+import changeset
+import http_cache
+import instrument
+import navall
 
-URL = "https://www.amfiindia.com/spages/NAVAll.txt"
 OUT_FILE = "data/scheme_codes.csv"
+CHANGES_NAME = "scheme_codes"
+SHOW_CHANGES = 20   # scheme lines printed per kind of change
+
+
+def load_master(path):
+    if not os.path.exists(path):
+        return {}
+    with open(path, newline="", encoding="utf-8") as f:
+        return {r["SchemeCode"]: r for r in csv.DictReader(f)}
+
+
+def show(icon, label, codes, rows):
+    print(f"{icon} {label}: {len(codes)}")
+    for code in sorted(codes, key=int)[:SHOW_CHANGES]:
+        print(f"   {code} {rows[code].get('SchemeName', '')}")
+    if len(codes) > SHOW_CHANGES:
+        print(f"   … and {len(codes) - SHOW_CHANGES} more")
+
+
+instrument.start("fetch_scheme_codes")
 
 print("📁 Preparing data directory...")
 os.makedirs("data", exist_ok=True)
 print("✅ Data directory ready\n")
 
 print("🌐 Fetching NAVAll.txt from AMFI...")
-response = requests.get(URL, timeout=20)
-response.raise_for_status()
-print("✅ Download completed\n")
+cache = http_cache.HttpCache(namespace="scheme_codes")
+# Without the output file an unchanged NAVAll.txt still has to be parsed.
+stream = navall.stream(cache, conditional=os.path.exists(OUT_FILE))
 
-text = response.text
+if stream.not_modified:
+    print(f"🟢 NAVAll.txt unchanged (304 Not Modified), {OUT_FILE} is up to date ✅")
+    stream.finish()
+    cache.close()
+    sys.exit(0)
 
-current_amc = ""
-rows = {}
-
-print("📖 Parsing NAV data...\n")
-
-for line_no, line in enumerate(text.splitlines(), start=1):
-    line = line.strip()
+# ---------- STREAMING PARSE ----------
+print("📖 Parsing NAV data (streaming)...\n")
 
-    if not line:
-        continue
+rows = {}
+amcs = set()
 
-    parts = line.split(";")
+for row in navall.parse(navall.decode_lines(stream.iter_lines())):
+    amcs.add(row["AMC"])
+    rows[row["SchemeCode"]] = row
 
-    # ---------- AMC NAME ----------
-    if len(parts) == 1 and not parts[0].isdigit():
-        current_amc = parts[0].strip()
-        print(f"🏢 AMC Detected: {current_amc}")
-        continue
+result = stream.finish()
+instrument.count("rows_read", len(rows))
+print(f"✅ Download completed ({stream.size:,} bytes)")
+print(f"🏢 AMCs detected: {len(amcs)}")
+print(f"🧮 Total schemes parsed: {len(rows)}\n")
 
-    # ---------- SCHEME DATA ----------
-    if len(parts) >= 6 and parts[0].isdigit():
-        scheme_code = parts[0].strip()
-        isin = parts[1].strip() or parts[2].strip()
-        scheme_name = parts[3].strip()
-        nav = parts[4].strip()
-        nav_date = parts[5].strip()
+# ---------- DIFF AGAINST PREVIOUS MASTER ----------
+old = load_master(OUT_FILE)
+changes = changeset.diff(old, rows)
 
-        rows[scheme_code] = {
-            "SchemeCode": scheme_code,
-            "AMC": current_amc,
-            "SchemeName": scheme_name,
-            "ISIN": isin,
-            "NAV": nav,
-            "Date": nav_date
-        }
+if not changes:
+    print(f"🟢 No scheme changes, {OUT_FILE} left as is ✅")
+    cache.commit(result)
+    cache.close()
+    sys.exit(0)
 
-        # ✅ Clean one-line output
-        print(f"📄 {scheme_name}")
+nav_only = {c for c, fields in changes.changed.items() if set(fields) <= {"NAV", "Date"}}
+meta_changed = set(changes.changed) - nav_only
 
-print(f"\n🧮 Total schemes parsed: {len(rows)}")
+show("➕", "Added schemes", changes.added, rows)
+show("➖", "Removed schemes", changes.removed, old)
+show("✏️", "Schemes with changed details", meta_changed, rows)
+print(f"📈 Schemes with a new NAV only: {len(nav_only)}")
 
 # ---------- WRITE CSV ----------
 print(f"\n💾 Saving scheme master file → {OUT_FILE}\n")
 
-with open(OUT_FILE, "w", newline="", encoding="utf-8") as f:
-    writer = csv.DictWriter(
-        f,
-        fieldnames=["SchemeCode", "AMC", "SchemeName", "ISIN", "NAV", "Date"]
-    )
+base_sha = changeset.file_sha256(OUT_FILE)
+tmp = OUT_FILE + ".tmp"
+with open(tmp, "w", newline="", encoding="utf-8") as f:
+    writer = csv.DictWriter(f, fieldnames=navall.FIELDNAMES)
     writer.writeheader()
 
     for code in sorted(rows.keys(), key=int):
         writer.writerow(rows[code])
+os.replace(tmp, OUT_FILE)
+instrument.count("rows_written", len(rows))
+
+path = changeset.write(CHANGES_NAME, changes, base_sha, changeset.file_sha256(OUT_FILE))
+print(f"🧾 Changeset written → {path}")
+
+cache.commit(result)
+cache.close()
 
 print(f"🎉 Successfully saved {len(rows)} schemes")
 print("📦 scheme_codes.csv is ready for use ✅")
@@ -0,0 +1,342 @@
+"""On-disk HTTP response cache shared by the fetch scripts.
+
+For every URL the cache remembers the validators the server sent (ETag,
+Last-Modified) and a SHA-256 of the body, and optionally the body itself.
+Requests go out with ``If-None-Match`` / ``If-Modified-Since``; a 304, or a
+200 whose body hashes the same as last time, comes back as
+``changed=False`` so callers can skip parsing and rewriting.
+
+Entries are namespaced per consumer: "unchanged" means unchanged since
+*this* script last committed the URL, not since anyone fetched it.  The
+two-step ``resolve`` → ``commit`` keeps a body that failed to process from
+being recorded as seen.
+
+Stored bodies are bounded by ``max_bytes`` with least-recently-used
+eviction; validator rows without a body are tiny and kept.  Large bodies
+can be consumed line by line with :meth:`HttpCache.stream`, hashing as
+they arrive.
+
+    cache = HttpCache(namespace="scheme_codes")
+    result = cache.get(session, url, timeout=20)
+    if result.changed:
+        process(result.content)
+        cache.commit(result)
+"""
+
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+import instrument
+
+CACHE_DIR = ".cache/http"
+MAX_BYTES = 256 * 1024 * 1024
+COMMIT_EVERY = 200
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entry (
+    key           TEXT PRIMARY KEY,
+    etag          TEXT,
+    last_modified TEXT,
+    sha256        TEXT NOT NULL,
+    body_size     INTEGER NOT NULL,
+    last_access   REAL NOT NULL
+);
+"""
+
+
+class CacheResult:
+    __slots__ = ("url", "status", "content", "changed", "not_modified",
+                 "etag", "last_modified", "sha256", "store_body", "transferred")
+
+    def __init__(self, url, status, content, changed, not_modified,
+                 etag, last_modified, sha256, store_body, transferred):
+        self.url = url
+        self.status = status
+        self.content = content
+        self.changed = changed
+        self.not_modified = not_modified
+        self.etag = etag
+        self.last_modified = last_modified
+        self.sha256 = sha256
+        self.store_body = store_body
+        self.transferred = transferred
+
+
+class CacheStream:
+    """A streamed response: iterate :meth:`iter_lines`, then :meth:`finish`.
+
+    Raw chunks are hashed as they arrive, so the body is never held in
+    memory; ``finish`` compares the hash with the cached one.  A ``session``
+    opened for this stream alone is closed with the response.
+    """
+
+    def __init__(self, cache, url, response, not_modified, conditional=True,
+                 chunk_size=64 * 1024, session=None):
+        self.cache = cache
+        self.session = session
+        self.conditional = conditional
+        self.url = url
+        self.response = response
+        self.status = response.status_code
+        self.not_modified = not_modified
+        self.chunk_size = chunk_size
+        self.size = 0
+        self.started = time.monotonic()
+        self._sha = hashlib.sha256()
+
+    def iter_lines(self):
+        """Raw lines (bytes, without ``\\n``/``\\r\\n``) of the body."""
+        if self.not_modified:
+            return
+        pending = b""
+        for chunk in self.response.iter_content(self.chunk_size):
+            self._sha.update(chunk)
+            self.size += len(chunk)
+            pending += chunk
+            *lines, pending = pending.split(b"\n")
+            for line in lines:
+                yield line.rstrip(b"\r")
+        if pending:
+            yield pending.rstrip(b"\r")
+
+    def close(self):
+        """Release the response, and the session if the stream owns it."""
+        self.response.close()
+        if self.session is not None:
+            self.session.close()
+
+    def finish(self):
+        """Cache result for the consumed stream (``content`` is ``None``).
+
+        The HTTP latency recorded for it runs until the body was consumed.
+        """
+        self.close()
+        instrument.http(self.status, time.monotonic() - self.started, self.size)
+        key = self.cache._key(self.url)
+        with self.cache._lock:
+            row = self.cache._row(key)
+        if self.not_modified and row:
+            etag, last_modified, sha, _ = row
+            return CacheResult(self.url, 200, None, False, True, etag, last_modified,
+                               sha, False, 0)
+        if self.status != 200:
+            return CacheResult(self.url, self.status, None, False, False, None, None,
+                               None, False, self.size)
+        sha = self._sha.hexdigest()
+        headers = self.response.headers
+        changed = not self.conditional or not row or row[2] != sha
+        return CacheResult(
+            self.url, 200, None, changed, False,
+            headers.get("ETag"), headers.get("Last-Modified"),
+            sha, False, self.size,
+        )
+
+
+class HttpCache:
+    """Thread-safe validator/body cache; one SQLite index plus body files."""
+
+    def __init__(self, root=CACHE_DIR, namespace="default", max_bytes=MAX_BYTES):
+        self.root = root
+        self.namespace = namespace
+        self.max_bytes = max_bytes
+        os.makedirs(os.path.join(root, "bodies"), exist_ok=True)
+        self._db = sqlite3.connect(os.path.join(root, "index.db"),
+                                   check_same_thread=False, timeout=30)
+        self._db.executescript(SCHEMA)
+        self._lock = threading.RLock()
+        self._dirty = 0
+
+    # ---------- KEYS & BODIES ----------
+    def _key(self, url):
+        return f"{self.namespace}:{url}"
+
+    def _body_path(self, key):
+        name = hashlib.sha1(key.encode("utf-8")).hexdigest()
+        return os.path.join(self.root, "bodies", name[:2], name)
+
+    def _row(self, key):
+        return self._db.execute(
+            "SELECT etag, last_modified, sha256, body_size FROM entry WHERE key = ?",
+            (key,),
+        ).fetchone()
+
+    def _read_body(self, key):
+        try:
+            with open(self._body_path(key), "rb") as f:
+                return f.read()
+        except OSError:
+            return None
+
+    # ---------- REQUEST SIDE ----------
+    def conditional_headers(self, url):
+        with self._lock:
+            row = self._row(self._key(url))
+        headers = {}
+        if row:
+            etag, last_modified = row[0], row[1]
+            if etag:
+                headers["If-None-Match"] = etag
+            if last_modified:
+                headers["If-Modified-Since"] = last_modified
+        return headers
+
+    # ---------- RESPONSE SIDE ----------
+    def resolve(self, url, status, headers, content, store_body=False):
+        """Classify a response; nothing is recorded until :meth:`commit`."""
+        key = self._key(url)
+        with self._lock:
+            row = self._row(key)
+
+        transferred = len(content or b"")
+
+        if status == 304 and row:
+            etag, last_modified, sha, size = row
+            body = self._read_body(key) if size else None
+            with self._lock:
+                self._db.execute(
+                    "UPDATE entry SET last_access = ? WHERE key = ?", (time.time(), key)
+                )
+            return CacheResult(url, 200, body, False, True, etag, last_modified,
+                               sha, store_body, transferred)
+
+        if status != 200:
+            return CacheResult(url, status, content, False, False, None, None,
+                               None, store_body, transferred)
+
+        sha = hashlib.sha256(content).hexdigest()
+        changed = not row or row[2] != sha
+        return CacheResult(
+            url, 200, content, changed, False,
+            headers.get("ETag"), headers.get("Last-Modified"),
+            sha, store_body, transferred,
+        )
+
+    def commit(self, result):
+        """Record ``result`` as processed (validators, hash and maybe body)."""
+        if result.status != 200 or result.sha256 is None:
+            return
+        key = self._key(result.url)
+        body_size = 0
+        if result.store_body and result.content is not None and not result.not_modified:
+            path = self._body_path(key)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp = path + ".tmp"
+            with open(tmp, "wb") as f:
+                f.write(result.content)
+            os.replace(tmp, path)
+            body_size = len(result.content)
+
+        with self._lock:
+            if not body_size and not result.not_modified:
+                try:
+                    os.remove(self._body_path(key))
+                except OSError:
+                    pass
+            if result.not_modified:
+                row = self._row(key)
+                body_size = row[3] if row else 0
+            self._db.execute(
+                "INSERT OR REPLACE INTO entry VALUES (?, ?, ?, ?, ?, ?)",
+                (key, result.etag, result.last_modified, result.sha256,
+                 body_size, time.time()),
+            )
+            # A lost entry only costs one full download, so commit in batches.
+            self._dirty += 1
+            if body_size:
+                self.evict()
+            elif self._dirty >= COMMIT_EVERY:
+                self._db.commit()
+                self._dirty = 0
+
+    def forget(self, url):
+        key = self._key(url)
+        with self._lock:
+            self._db.execute("DELETE FROM entry WHERE key = ?", (key,))
+            self._db.commit()
+        try:
+            os.remove(self._body_path(key))
+        except OSError:
+            pass
+
+    def get(self, session, url, store_body=False, conditional=True, **kwargs):
+        """``session.get`` resolved against the cache.
+
+        ``conditional=False`` always asks for the full body (e.g. when the
+        local copy it was applied to is gone).  With ``store_body`` a 304
+        whose body has vanished from disk is retried unconditionally.
+        """
+        base = kwargs.pop("headers", None)
+        headers = dict(base or {})
+        if conditional:
+            headers.update(self.conditional_headers(url))
+        start = time.monotonic()
+        r = session.get(url, headers=headers, **kwargs)
+        instrument.http(r.status_code, time.monotonic() - start, len(r.content))
+        result = self.resolve(url, r.status_code, r.headers, r.content, store_body)
+
+        if result.not_modified and store_body and result.content is None:
+            self.forget(url)
+            return self.get(session, url, store_body, conditional=False,
+                            headers=base, **kwargs)
+        if not conditional and result.status == 200:
+            result.changed = True
+        return result
+
+    def stream(self, session, url, conditional=True, own_session=False, **kwargs):
+        """Streaming ``session.get``; see :class:`CacheStream`.  With
+        ``own_session`` the stream closes ``session`` when it is done."""
+        headers = dict(kwargs.pop("headers", None) or {})
+        if conditional:
+            headers.update(self.conditional_headers(url))
+        start = time.monotonic()
+        r = session.get(url, headers=headers, stream=True, **kwargs)
+        with self._lock:
+            known = conditional and self._row(self._key(url)) is not None
+        stream = CacheStream(self, url, r, r.status_code == 304 and known, conditional,
+                             session=session if own_session else None)
+        stream.started = start
+        return stream
+
+    # ---------- EVICTION ----------
+    def stored_bytes(self):
+        with self._lock:
+            return self._db.execute("SELECT COALESCE(SUM(body_size), 0) FROM entry").fetchone()[0]
+
+    def evict(self):
+        """Drop least-recently-used bodies until under ``max_bytes``."""
+        with self._lock:
+            total = self.stored_bytes()
+            if total <= self.max_bytes:
+                return 0
+            dropped = 0
+            rows = self._db.execute(
+                "SELECT key, body_size FROM entry WHERE body_size > 0 ORDER BY last_access"
+            ).fetchall()
+            for key, size in rows:
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(self._body_path(key))
+                except OSError:
+                    pass
+                # Without the body a 304 is useless, so forget the validators too.
+                self._db.execute("DELETE FROM entry WHERE key = ?", (key,))
+                total -= size
+                dropped += 1
+            self._db.commit()
+            self._dirty = 0
+            return dropped
+
+    def close(self):
+        with self._lock:
+            self._db.commit()
+            self._db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
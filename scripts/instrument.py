@@ -0,0 +1,335 @@
+"""Run metrics for the pipeline scripts: stage timings, row/byte counters,
+HTTP latency percentiles, optional profiling and a JSON run report.
+
+Everything goes to one process-wide :class:`Recorder`, so a script run on
+its own and the same script run as a ``pipeline.py`` step report the same
+way::
+
+    with instrument.stage("merge"):
+        ...
+        instrument.count("rows_written", n)
+    instrument.http(status, seconds, nbytes)    # done by the HTTP helpers
+    instrument.detail(f"📄 {code} → ➕ {n}")     # per-scheme line, off in quiet mode
+
+Stages nest and are keyed by their path (``nav_year/merge``).  Counters go
+to the innermost stage open in the calling context (``asyncio.to_thread``
+and executors given ``contextvars.copy_context().run`` carry it into
+worker threads) and to the run totals.  A stage's ``cpu`` is the CPU time
+of the thread that opened it; the run's ``cpu`` is the whole process.
+HTTP latencies are kept per status (or exception name) and reported as
+p50/p95/p99.
+
+Scripts with a command line take :func:`add_arguments`; the environment
+configures the rest (and is the fallback for all of them)::
+
+    MF_QUIET=1            summaries only, no per-scheme lines
+    MF_METRICS=run.json   write the JSON report at exit
+    MF_PROFILE=run.prof   cProfile the main thread (pstats file)
+    MF_TRACEMALLOC=1      peak memory and top allocation sites in the report
+
+:func:`start` is a no-op once a run is active, so a script started as a
+pipeline step keeps the pipeline's settings and adds its stages to the
+pipeline's report.
+"""
+
+import atexit
+import contextlib
+import contextvars
+import cProfile
+import json
+import math
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from collections import defaultdict
+from datetime import datetime, timezone
+
+ENV_QUIET = "MF_QUIET"
+ENV_METRICS = "MF_METRICS"
+ENV_PROFILE = "MF_PROFILE"
+ENV_TRACEMALLOC = "MF_TRACEMALLOC"
+
+PERCENTILES = (50, 95, 99)
+TOP_ALLOCATIONS = 10
+
+_stage = contextvars.ContextVar("instrument_stage", default=None)
+
+
+def _env_flag(name):
+    return os.environ.get(name, "").strip().lower() not in ("", "0", "false", "no")
+
+
+def percentile(sorted_values, p):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    rank = max(1, math.ceil(p / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+class Recorder:
+    """Thread-safe collector for one run; see the module docstring."""
+
+    def __init__(self):
+        self.quiet = _env_flag(ENV_QUIET)
+        self.metrics_path = os.environ.get(ENV_METRICS) or None
+        self.profile_path = os.environ.get(ENV_PROFILE) or None
+        self.trace_memory = _env_flag(ENV_TRACEMALLOC)
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self.name = None
+        self.extra = {}
+        self._stages = {}
+        self._totals = defaultdict(int)
+        self._latency = defaultdict(list)
+        self._http_bytes = defaultdict(int)
+        self._profiler = None
+        self._started = None
+
+    @property
+    def active(self):
+        return self.name is not None
+
+    # ---------- LIFECYCLE ----------
+    def configure(self, quiet=None, metrics=None, profile=None, trace_memory=None):
+        if quiet is not None:
+            self.quiet = quiet
+        if metrics is not None:
+            self.metrics_path = metrics
+        if profile is not None:
+            self.profile_path = profile
+        if trace_memory is not None:
+            self.trace_memory = trace_memory
+
+    def begin(self, name):
+        """Start a run; ``False`` if one is already active."""
+        with self._lock:
+            if self.name is not None:
+                return False
+            self.name = name
+            self._started = (datetime.now(timezone.utc), time.perf_counter(),
+                             time.process_time())
+        if self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        if self.profile_path:
+            self._profiler = cProfile.Profile()
+            self._profiler.enable()
+        atexit.register(self.finish)
+        return True
+
+    def finish(self):
+        """End the run: stop hooks, write the report; returns it (or ``None``)."""
+        if self.name is None:
+            return None
+        atexit.unregister(self.finish)
+
+        if self._profiler is not None:
+            self._profiler.disable()
+            _makedirs_for(self.profile_path)
+            self._profiler.dump_stats(self.profile_path)
+            self.extra["profile"] = self.profile_path
+            self._profiler = None
+
+        if self.trace_memory and tracemalloc.is_tracing():
+            current, peak = tracemalloc.get_traced_memory()
+            top = tracemalloc.take_snapshot().statistics("lineno")[:TOP_ALLOCATIONS]
+            tracemalloc.stop()
+            self.extra["memory"] = {
+                "current_bytes": current,
+                "peak_bytes": peak,
+                "top": [{"where": str(s.traceback[0]), "bytes": s.size, "blocks": s.count}
+                        for s in top],
+            }
+
+        report = self.report()
+        if self.metrics_path:
+            _makedirs_for(self.metrics_path)
+            tmp = self.metrics_path + ".tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(report, f, indent=1)
+            os.replace(tmp, self.metrics_path)
+
+        self._print_summary(report)
+        self._reset()
+        return report
+
+    # ---------- RECORDING ----------
+    @contextlib.contextmanager
+    def stage(self, name):
+        parent = _stage.get()
+        path = f"{parent}/{name}" if parent else name
+        with self._lock:
+            entry = self._stages.setdefault(path, _new_stage())
+        token = _stage.set(path)
+        wall, cpu = time.perf_counter(), time.thread_time()
+        try:
+            yield
+        finally:
+            _stage.reset(token)
+            wall, cpu = time.perf_counter() - wall, time.thread_time() - cpu
+            with self._lock:
+                entry["calls"] += 1
+                entry["wall"] += wall
+                entry["cpu"] += cpu
+
+    def count(self, name, n=1):
+        if not n:
+            return
+        path = _stage.get()
+        with self._lock:
+            self._totals[name] += n
+            if path is not None:
+                self._stages.setdefault(path, _new_stage())["counters"][name] += n
+
+    def http(self, status, seconds, nbytes=0, error=None):
+        """One HTTP attempt: ``status``, or the exception for a failed one."""
+        key = str(status) if status is not None else type(error).__name__ if error else "error"
+        path = _stage.get()
+        with self._lock:
+            self._latency[key].append(seconds)
+            self._http_bytes[key] += nbytes
+            self._totals["http_requests"] += 1
+            self._totals["bytes_received"] += nbytes
+            if path is not None:
+                counters = self._stages.setdefault(path, _new_stage())["counters"]
+                counters["http_requests"] += 1
+                counters["bytes_received"] += nbytes
+
+    def detail(self, *args, **kwargs):
+        """``print`` for per-row progress; dropped in quiet mode."""
+        if not self.quiet:
+            print(*args, **kwargs)
+
+    # ---------- REPORT ----------
+    def totals(self):
+        with self._lock:
+            return dict(self._totals)
+
+    def http_summary(self):
+        with self._lock:
+            latency = {k: sorted(v) for k, v in self._latency.items()}
+            sizes = dict(self._http_bytes)
+        sizes["all"] = sum(sizes.values())
+        out = {}
+        every = sorted(x for v in latency.values() for x in v)
+        for key, values in sorted(latency.items()) + [("all", every)]:
+            if not values:
+                continue
+            row = {"count": len(values), "bytes": sizes.get(key, 0)}
+            for p in PERCENTILES:
+                row[f"p{p}_ms"] = round(percentile(values, p) * 1000, 1)
+            row["max_ms"] = round(values[-1] * 1000, 1)
+            out[key] = row
+        return out
+
+    def report(self):
+        started, wall0, cpu0 = self._started or (datetime.now(timezone.utc),
+                                                 time.perf_counter(), time.process_time())
+        with self._lock:
+            stages = [
+                {"stage": path, "calls": s["calls"], "wall": round(s["wall"], 4),
+                 "cpu": round(s["cpu"], 4), **dict(s["counters"])}
+                for path, s in self._stages.items()
+            ]
+            totals = dict(self._totals)
+        return {
+            "name": self.name,
+            "started": started.isoformat(timespec="seconds"),
+            "wall": round(time.perf_counter() - wall0, 4),
+            "cpu": round(time.process_time() - cpu0, 4),
+            "stages": stages,
+            "totals": totals,
+            "http": self.http_summary(),
+            **self.extra,
+        }
+
+    def _print_summary(self, report):
+        out = sys.stdout
+        http = report["http"].get("all")
+        if http:
+            by_status = ", ".join(f"{k}: {v['count']:,}" for k, v in report["http"].items()
+                                  if k != "all")
+            print(f"📡 HTTP: {http['count']:,} requests, {http['bytes']:,} bytes "
+                  f"(p50 {http['p50_ms']} ms, p95 {http['p95_ms']} ms, "
+                  f"p99 {http['p99_ms']} ms; {by_status})", file=out)
+        if "memory" in report:
+            print(f"🧠 Peak traced memory: {report['memory']['peak_bytes']:,} bytes", file=out)
+        if "profile" in report:
+            print(f"🔬 Profile → {report['profile']}", file=out)
+        if self.metrics_path:
+            print(f"📊 Run metrics → {self.metrics_path}", file=out)
+
+
+def _new_stage():
+    return {"calls": 0, "wall": 0.0, "cpu": 0.0, "counters": defaultdict(int)}
+
+
+def _makedirs_for(path):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+
+
+RECORDER = Recorder()
+
+
+# ---------- MODULE API ----------
+def add_arguments(parser, metrics_flag="--metrics"):
+    group = parser.add_argument_group("instrumentation")
+    group.add_argument("--quiet", action="store_true", default=None,
+                       help=f"No per-scheme lines, only summaries (or {ENV_QUIET}=1)")
+    group.add_argument(metrics_flag, dest="metrics", metavar="FILE",
+                       help=f"Write a JSON run report (or {ENV_METRICS}=FILE)")
+    group.add_argument("--profile", metavar="FILE",
+                       help=f"cProfile the run into a pstats file (or {ENV_PROFILE}=FILE)")
+    group.add_argument("--tracemalloc", action="store_true", default=None,
+                       help=f"Record peak memory and top allocation sites (or {ENV_TRACEMALLOC}=1)")
+
+
+def start(name, args=None):
+    """Begin a run named ``name`` unless one is active (then nothing changes).
+
+    ``args`` from a parser given :func:`add_arguments` override the
+    environment.  The run is finished at exit or by :func:`finish`.
+    """
+    if RECORDER.active:
+        return False
+    if args is not None:
+        RECORDER.configure(args.quiet, args.metrics, args.profile, args.tracemalloc)
+    return RECORDER.begin(name)
+
+
+def finish():
+    return RECORDER.finish()
+
+
+def stage(name):
+    return RECORDER.stage(name)
+
+
+def count(name, n=1):
+    RECORDER.count(name, n)
+
+
+def http(status, seconds, nbytes=0, error=None):
+    RECORDER.http(status, seconds, nbytes, error)
+
+
+def detail(*args, **kwargs):
+    RECORDER.detail(*args, **kwargs)
+
+
+def quiet():
+    return RECORDER.quiet
+
+
+def totals():
+    """Run-wide counters so far."""
+    return RECORDER.totals()
+
+
+def annotate(key, value):
+    """Add a top-level ``key`` to the run report."""
+    RECORDER.extra[key] = value
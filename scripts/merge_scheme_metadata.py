@@ -1,72 +1,201 @@
+import argparse
 import csv
+import json
 import os
+import time
+
+import categories
+import changeset
+import instrument
 
 DATA_DIR = "data"
+CODES_FILE = os.path.join(DATA_DIR, "scheme_codes.csv")
+CATEGORIES_FILE = categories.CATEGORY_FILE
 OUTPUT_FILE = os.path.join(DATA_DIR, "scheme_index.csv")
+# Input/output hashes of the last merge; losing it only costs one full compare.
+STATE_FILE = os.path.join(changeset.CHANGES_DIR, "scheme_index.state.json")
+
+HEADER = [
+    "SchemeCode",
+    "AMC",
+    "SchemeName",
+    "ISIN",
+    "NAV",
+    "Date",
+    "SchemeType",
+    "CategoryRaw",
+    "Category",
+    "SubCategory"
+]
+
+
+def index_row(s, c):
+    """One ``scheme_index.csv`` row from a scheme_codes and a category row."""
+    return [
+        s["SchemeCode"],
+        s.get("AMC", ""),
+        s.get("SchemeName", ""),
+        s.get("ISIN", ""),
+        s.get("NAV", ""),
+        s.get("Date", ""),
+        c.get("SchemeType", ""),
+        c.get("CategoryRaw", ""),
+        c.get("Category", ""),
+        c.get("SubCategory", "")
+    ]
+
+
+def load_codes(path):
+    """scheme_codes.csv rows keyed by code, in file order."""
+    with open(path, newline="", encoding="utf-8") as f:
+        return {r["SchemeCode"]: r for r in csv.DictReader(f)}
+
+
+def load_index(path):
+    """Existing ``{code: row}`` (file order), or ``None`` if unusable."""
+    if not os.path.exists(path):
+        return None
+    with open(path, newline="", encoding="utf-8") as f:
+        reader = csv.reader(f)
+        if next(reader, None) != HEADER:
+            return None
+        return {row[0]: row for row in reader if row}
+
+
+def load_state(path):
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_state(path, state):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(state, f, indent=1)
+    os.replace(tmp, path)
+
+
+def categories_sha(path):
+    """Hash of the categories CSV plus any journal not yet compacted."""
+    parts = [changeset.file_sha256(path), changeset.file_sha256(categories.journal_path(path))]
+    return ":".join(p or "-" for p in parts)
+
+
+def affected_codes(state, codes_sha, cats_sha, index_sha):
+    """Codes to recompute, or ``None`` to compare every scheme.
+
+    A narrow set is only trusted when the index is the one the last merge
+    wrote, categories are unchanged and the scheme_codes changeset covers
+    exactly the step from the last merged file to the current one.
+    """
+    if state.get("index_sha256") != index_sha or state.get("categories_sha256") != cats_sha:
+        return None
+    if state.get("codes_sha256") == codes_sha:
+        return set()
+    changes = changeset.read("scheme_codes")
+    if (changes and changes.get("base_sha256") == state.get("codes_sha256")
+            and changes.get("sha256") == codes_sha):
+        return set(changes["added"]) | set(changes["removed"]) | set(changes["changed"])
+    return None
+
+
+def merge(codes_file=CODES_FILE, categories_file=CATEGORIES_FILE,
+          output_file=OUTPUT_FILE, state_file=STATE_FILE, full=False):
+    """Patch ``output_file`` in place of a full rewrite; returns rows touched."""
+    codes_sha = changeset.file_sha256(codes_file)
+    cats_sha = categories_sha(categories_file)
+    index_sha = changeset.file_sha256(output_file)
+    state = {} if full else load_state(state_file)
+
+    if (state.get("codes_sha256") == codes_sha and state.get("categories_sha256") == cats_sha
+            and state.get("index_sha256") == index_sha and index_sha is not None):
+        print("🟢 Inputs unchanged since the last merge, nothing to do ✅")
+        return 0
+
+    # ---------------- LOAD INPUTS ----------------
+    print(f"📄 Loading scheme codes from {codes_file} ...")
+    codes = load_codes(codes_file)
+    print(f"✅ Loaded {len(codes)} scheme codes\n")
+
+    print(f"📄 Loading scheme categories from {categories_file} ...")
+    cats = categories.load(categories_file)
+    print(f"✅ Loaded {len(cats)} scheme categories\n")
+
+    index = load_index(output_file)
+    todo = None if index is None else affected_codes(state, codes_sha, cats_sha, index_sha)
+    if index is None:
+        print("🔁 No usable scheme_index.csv, building it from scratch")
+        index = {}
+    if todo is None:
+        todo = set(codes) | set(index)
+        print(f"🔍 Comparing all {len(todo)} schemes")
+    else:
+        print(f"🧾 Changeset: {len(todo)} schemes to patch")
+
+    # ---------------- PATCH KEYED INDEX ----------------
+    added = removed = changed = 0
+    for code in todo:
+        s = codes.get(code)
+        if s is None:
+            if index.pop(code, None) is not None:
+                removed += 1
+            continue
+        row = index_row(s, cats.get(code, {}))
+        old = index.get(code)
+        if old is None:
+            added += 1
+        elif old != row:
+            changed += 1
+        else:
+            continue
+        index[code] = row
+
+    # Output order follows scheme_codes.csv, as the full merge always did.
+    in_order = list(index) == list(codes)
+    touched = added + removed + changed
+    print(f"➕ {added} added  ➖ {removed} removed  ✏️ {changed} changed")
+
+    if touched or not in_order:
+        print(f"✍️ Writing master file to {output_file} ...")
+        tmp = output_file + ".tmp"
+        with open(tmp, "w", newline="", encoding="utf-8") as f:
+            writer = csv.writer(f)
+            writer.writerow(HEADER)
+            writer.writerows(index[code] for code in codes)
+        os.replace(tmp, output_file)
+        instrument.count("rows_written", len(codes))
+        index_sha = changeset.file_sha256(output_file)
+    else:
+        print(f"🟢 {output_file} already up to date, not rewritten")
+
+    save_state(state_file, {
+        "codes_sha256": codes_sha,
+        "categories_sha256": cats_sha,
+        "index_sha256": index_sha,
+    })
+    return touched
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Merge scheme codes and categories into scheme_index.csv")
+    parser.add_argument("--full", action="store_true",
+                        help="Ignore the saved hashes and changeset; compare every scheme")
+    instrument.add_arguments(parser)
+    args = parser.parse_args()
+    instrument.start("merge_scheme_metadata", args)
+
+    os.makedirs(DATA_DIR, exist_ok=True)
+    print(f"📁 Ensured data directory exists: {DATA_DIR}\n")
+
+    start = time.perf_counter()
+    touched = merge(full=args.full)
+    elapsed = (time.perf_counter() - start) * 1000
+
+    print(f"\n🎉 MF master file {OUTPUT_FILE} up to date ({touched} records changed, {elapsed:.0f} ms) ✅")
+
 
-os.makedirs(DATA_DIR, exist_ok=True)
-print(f"📁 Ensured data directory exists: {DATA_DIR}\n")
-
-# ---------------- LOAD scheme_codes.csv (ORDER PRESERVED) ----------------
-codes = []
-scheme_codes_file = os.path.join(DATA_DIR, "scheme_codes.csv")
-print(f"📄 Loading scheme codes from {scheme_codes_file} ...")
-with open(scheme_codes_file, newline="", encoding="utf-8") as f:
-    reader = csv.DictReader(f)
-    for r in reader:
-        codes.append(r)
-
-print(f"✅ Loaded {len(codes)} scheme codes\n")
-
-# ---------------- LOAD scheme_categories.csv (LOOKUP MAP) ----------------
-categories = {}
-categories_file = os.path.join(DATA_DIR, "scheme_categories.csv")
-print(f"📄 Loading scheme categories from {categories_file} ...")
-with open(categories_file, newline="", encoding="utf-8") as f:
-    for r in csv.DictReader(f):
-        categories[r["SchemeCode"]] = r
-
-print(f"✅ Loaded {len(categories)} scheme categories\n")
-
-# ---------------- WRITE MASTER FILE ----------------
-print(f"✍️ Writing master file to {OUTPUT_FILE} ...\n")
-with open(OUTPUT_FILE, "w", newline="", encoding="utf-8") as f:
-    writer = csv.writer(f)
-
-    # Write header
-    writer.writerow([
-        "SchemeCode",
-        "AMC",
-        "SchemeName",
-        "ISIN",
-        "NAV",
-        "Date",
-        "SchemeType",
-        "CategoryRaw",
-        "Category",
-        "SubCategory"
-    ])
-    print("📋 Header written")
-
-    # Write each scheme
-    for i, s in enumerate(codes, start=1):
-        code = s["SchemeCode"]
-        c = categories.get(code, {})
-
-        writer.writerow([
-            code,
-            s.get("AMC", ""),
-            s.get("SchemeName", ""),
-            s.get("ISIN", ""),
-            s.get("NAV", ""),
-            s.get("Date", ""),
-            c.get("SchemeType", ""),
-            c.get("CategoryRaw", ""),
-            c.get("Category", ""),
-            c.get("SubCategory", "")
-        ])
-
-        if i % 50 == 0 or i == len(codes):
-            print(f"   📝 Written {i}/{len(codes)} records...")
-
-print(f"\n🎉 MF master file created at {OUTPUT_FILE} with {len(codes)} records ✅")
+if __name__ == "__main__":
+    main()
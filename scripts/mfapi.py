@@ -0,0 +1,80 @@
+"""Applying ``https://api.mfapi.in/mf/<code>`` responses to the NAV history.
+
+Shared by ``fetch_nav_history.py`` and ``fetch_scheme_categories.py``: one
+response carries both the scheme ``meta`` and its NAV ``data``, so either
+script appends the history it downloads.  Only needs ``requests``.
+"""
+
+import csv
+import os
+import threading
+from datetime import datetime
+
+import requests
+
+import nav_state
+
+API_URL = "https://api.mfapi.in/mf/{code}"
+USER_AGENT = "Mozilla/5.0 (NAV-Updater)"
+NAV_DIR = nav_state.NAV_DIR
+QUARANTINE_DIR = nav_state.QUARANTINE_DIR
+MAX_WORKERS = 8   # parallel mfapi requests per script
+
+
+# ---------- SESSION ----------
+_local = threading.local()
+
+
+def worker_session():
+    """One keep-alive session per worker thread, reused across its schemes."""
+    session = getattr(_local, "session", None)
+    if session is None:
+        session = _local.session = requests.Session()
+        session.headers.update({"User-Agent": USER_AGENT})
+    return session
+
+
+# ---------- APPLY API PAYLOAD ----------
+def quarantined_dates(code, out_dir=QUARANTINE_DIR):
+    """Dates of ``code``'s quarantined rows (empty if it has none)."""
+    qpath = os.path.join(out_dir, f"{code}.csv")
+    if not os.path.exists(qpath):
+        return frozenset()
+    with open(qpath, newline="", encoding="utf-8") as q:
+        reader = csv.reader(q)
+        next(reader, None)
+        return frozenset(row[2].split(",", 1)[0].strip() for row in reader if len(row) > 2)
+
+
+def apply_nav_data(state, code, filepath, last_date, data):
+    """Append rows newer than ``last_date`` from an mfapi ``data`` list.
+
+    ``last_date`` comes from the state index, which tracks the file's true
+    last row, so anything newer can be appended without re-reading history.
+    Dates moved out by ``nav_validate.py --quarantine`` are not re-added.
+    """
+    if not data:
+        return "⚠️ No NAV data"
+
+    last_date_obj = (
+        datetime.fromisoformat(last_date).date()
+        if last_date else None
+    )
+
+    new_rows = []
+    for row in reversed(data):
+        nav_date = datetime.strptime(row["date"], "%d-%m-%Y").date()
+        if last_date_obj and nav_date <= last_date_obj:
+            continue
+        new_rows.append((nav_date.isoformat(), row["nav"]))
+
+    if new_rows:
+        skip = quarantined_dates(code)
+        new_rows = [r for r in new_rows if r[0] not in skip]
+
+    if not new_rows:
+        return "🟡 No new NAVs"
+
+    state.append(code, filepath, new_rows)
+
+    return f"✅ Updated | +{len(new_rows)} NAV rows"
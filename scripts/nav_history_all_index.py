@@ -0,0 +1,249 @@
+"""Offset index for ``data/nav_history_all.csv`` and a reader on top.
+
+The combined history is a sorted base plus a small delta, both with the
+``SchemeCode,Date,NAV`` header; the full history is the two together:
+
+    nav_history_all.csv          every row up to the last compaction, sorted
+                                 by (SchemeCode, Date)
+    nav_history_all.delta.csv    rows exported since, one run per
+                                 incremental export, each sorted the same way
+
+``export_nav_history_all.py`` writes both, and ``nav_history_all.idx``
+under ``INDEX_DIR`` (one folder per output directory), outside the
+committed tree: every compaction shifts the offsets, so the index would be
+a fresh blob in every data commit.  It records where each scheme's rows
+start in every sorted segment (the base, then each delta run)::
+
+    b"NAVHIDX1\\n"
+    {"base": size, "delta": size, "typecode": "Q",
+     "segments": [{"file": "base" | "delta", "rows": N, "codes": [...]}, ...]}\\n
+    uint64 offsets[len(codes) + 1]   per segment: start of each scheme's rows,
+                                     then the segment's end
+
+(little-endian.)  An index whose recorded sizes do not match the files is
+stale; :func:`load` then scans them instead (runs are found where the
+(SchemeCode, Date) order breaks).  :class:`HistoryAll` maps both files and
+returns one scheme's rows from every segment without reading the rest.
+
+    python scripts/nav_history_all_index.py                # (re)index if stale
+    python scripts/nav_history_all_index.py get 119551 --start 2025-01-01
+"""
+
+import argparse
+import array
+import json
+import mmap
+import os
+import sys
+import zlib
+from collections import namedtuple
+
+OUTPUT_FILE = "data/nav_history_all.csv"
+INDEX_DIR = ".cache/nav_history_all_index"
+MAGIC = b"NAVHIDX1\n"
+TYPECODE = "Q"
+
+# ``offsets`` has one entry per code plus the segment's end.
+Segment = namedtuple("Segment", "file codes offsets rows")
+
+
+def delta_path(output_file):
+    return os.path.splitext(output_file)[0] + ".delta.csv"
+
+
+def index_path(output_file):
+    folder = os.path.dirname(os.path.abspath(output_file))
+    name = os.path.splitext(os.path.basename(output_file))[0] + ".idx"
+    return os.path.join(INDEX_DIR, f"{zlib.crc32(folder.encode('utf-8')):08x}", name)
+
+
+def _legacy_path(output_file):
+    # Where the index used to be written, next to the combined CSV.
+    return os.path.splitext(output_file)[0] + ".idx"
+
+
+def _size(path):
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+
+def _key(line):
+    parts = line.split(b",", 2)
+    return parts[0], parts[1] if len(parts) > 1 else b""
+
+
+# ---------- BUILD ----------
+def scan(path, file):
+    """Sorted segments of the base or delta file at ``path``."""
+    segments = []
+    codes, offsets, rows = [], array.array(TYPECODE), 0
+    prev = None
+    try:
+        f = open(path, "rb")
+    except FileNotFoundError:
+        return segments
+    with f:
+        pos = len(f.readline())
+        for line in f:
+            if line.strip():
+                key = _key(line.rstrip(b"\r\n"))
+                if prev is not None and key < prev:
+                    offsets.append(pos)
+                    segments.append(Segment(file, codes, offsets, rows))
+                    codes, offsets, rows = [], array.array(TYPECODE), 0
+                    prev = None
+                if prev is None or key[0] != prev[0]:
+                    codes.append(key[0].decode("ascii", "replace"))
+                    offsets.append(pos)
+                prev = key
+                rows += 1
+            pos += len(line)
+    if codes:
+        offsets.append(pos)
+        segments.append(Segment(file, codes, offsets, rows))
+    return segments
+
+
+def write(output_file, segments):
+    """Write the index for ``segments`` against the files' current sizes."""
+    header = {
+        "base": _size(output_file),
+        "delta": _size(delta_path(output_file)),
+        "typecode": TYPECODE,
+        "segments": [{"file": s.file, "rows": s.rows, "codes": s.codes} for s in segments],
+    }
+    out = index_path(output_file)
+    os.makedirs(os.path.dirname(out), exist_ok=True)
+    if os.path.exists(_legacy_path(output_file)):
+        os.remove(_legacy_path(output_file))
+    tmp = out + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(MAGIC)
+        f.write(json.dumps(header, separators=(",", ":")).encode("ascii") + b"\n")
+        for s in segments:
+            arr = array.array(TYPECODE, s.offsets)
+            if sys.byteorder != "little":
+                arr.byteswap()
+            f.write(arr.tobytes())
+    os.replace(tmp, out)
+
+
+def _read_index(output_file):
+    try:
+        with open(index_path(output_file), "rb") as f:
+            if f.readline() != MAGIC:
+                return None
+            header = json.loads(f.readline())
+            if header.get("base") != _size(output_file) or \
+                    header.get("delta") != _size(delta_path(output_file)):
+                return None
+            segments = []
+            for s in header["segments"]:
+                arr = array.array(header["typecode"])
+                arr.fromfile(f, len(s["codes"]) + 1)
+                if sys.byteorder != "little":
+                    arr.byteswap()
+                segments.append(Segment(s["file"], s["codes"], arr, s["rows"]))
+            return segments
+    except (OSError, ValueError, KeyError, EOFError):
+        return None
+
+
+def load(output_file=OUTPUT_FILE):
+    """``(segments, fresh)``: the saved index if it matches the files,
+    otherwise the files scanned in memory."""
+    segments = _read_index(output_file)
+    if segments is not None:
+        return segments, True
+    return scan(output_file, "base") + scan(delta_path(output_file), "delta"), False
+
+
+def ensure(output_file=OUTPUT_FILE):
+    """Rewrite the index if it is missing or stale; ``True`` if written."""
+    segments, fresh = load(output_file)
+    if not fresh:
+        write(output_file, segments)
+    return not fresh
+
+
+# ---------- READ ----------
+class HistoryAll:
+    """Read-only, memory-mapped base + delta; use as a context manager.
+
+    Rows come back as ``(SchemeCode, Date, NAV)`` strings exactly as
+    written, base rows first, then each delta run's.
+    """
+
+    def __init__(self, output_file=OUTPUT_FILE):
+        self._files, self._maps = [], {}
+        for name, path in (("base", output_file), ("delta", delta_path(output_file))):
+            if _size(path):
+                f = open(path, "rb")
+                self._files.append(f)
+                self._maps[name] = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.segments, fresh = load(output_file)
+        self.stale = not fresh
+        self._code_pos = [{c: i for i, c in enumerate(s.codes)} for s in self.segments]
+
+    def close(self):
+        for mm in self._maps.values():
+            mm.close()
+        for f in self._files:
+            f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    @property
+    def codes(self):
+        return sorted({c for s in self.segments for c in s.codes})
+
+    def chunks(self, code):
+        """Raw bytes of ``code``'s rows, one per segment that has any."""
+        out = []
+        for seg, pos in zip(self.segments, self._code_pos):
+            i = pos.get(str(code))
+            if i is not None:
+                out.append(self._maps[seg.file][seg.offsets[i]:seg.offsets[i + 1]])
+        return out
+
+    def scheme(self, code, start=None, end=None):
+        """Rows of ``code`` with ``start <= Date <= end`` (ISO strings)."""
+        rows = []
+        for chunk in self.chunks(code):
+            for line in chunk.decode("utf-8").splitlines():
+                row = tuple(line.split(",", 2))
+                if (start is None or row[1] >= start) and (end is None or row[1] <= end):
+                    rows.append(row)
+        return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Index and query the combined NAV history")
+    parser.add_argument("--output", default=OUTPUT_FILE, help="Combined CSV path")
+    sub = parser.add_subparsers(dest="command")
+    p_get = sub.add_parser("get", help="Rows of one scheme")
+    p_get.add_argument("code")
+    p_get.add_argument("--start")
+    p_get.add_argument("--end")
+    args = parser.parse_args()
+
+    if args.command is None:
+        written = ensure(args.output)
+        print(f"✅ Combined history index {'rewritten' if written else 'up to date'}")
+        return
+
+    with HistoryAll(args.output) as h:
+        if h.stale:
+            print("⚠️ Index missing or stale, indexed in memory", file=sys.stderr)
+        for r in h.scheme(args.code, args.start, args.end):
+            print(",".join(r))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,290 @@
+"""Trailing returns, CAGR and drawdowns for every scheme.
+
+Runs after ``fetch_nav_history.py`` and keeps ``data/scheme_metrics.csv``
+(one row per scheme, next to ``scheme_index.csv``) in step with
+``data/nav_history`` through the memory-mapped store in ``nav_store.py``:
+
+* ``Return1M`` … ``Return1Y`` are simple returns and ``CAGR3Y`` /
+  ``CAGR5Y`` annualised ones, over calendar months ending at the scheme's
+  latest NAV (``AsOf``), starting from the last NAV on or before the window
+  start; blank when the scheme is younger than the window.
+* ``CAGRInception`` covers the whole history (blank under one year).
+* ``MaxDrawdown`` is the worst fall from a running peak, ``Drawdown`` the
+  current one, ``PeakNAV`` the highest NAV so far.
+
+Only NAVs that are prices count (``nav_validate.priced``): mfapi publishes
+a 0 NAV for days some schemes had none, which would otherwise read as a
+-100% drawdown and make every return from it infinite.  ``AsOf``, ``NAV``
+and ``Rows`` describe the priced rows; a scheme with none gets a blank row.
+
+Each scheme's ``nav_metrics`` watermark in the state index records the
+history file size its row was computed from; schemes whose file has not
+changed are left as they are.  When the file only grew and the row at
+``Rows`` still carries ``AsOf`` / ``NAV``, the drawdown columns are extended
+from ``PeakNAV`` and ``MaxDrawdown`` over the new rows alone; anything
+else is recomputed for that scheme.  Work is done in vectorised batches of
+changed schemes and the file is rewritten only if a row changed.
+``--full`` recomputes all.
+
+    python scripts/nav_metrics.py
+    python scripts/nav_metrics.py --full
+"""
+
+import argparse
+import csv
+import math
+import os
+import time
+
+try:
+    import numpy as np
+except ImportError:  # optional dependency
+    np = None
+
+import instrument
+import nav_state
+import nav_store
+
+METRICS_FILE = "data/scheme_metrics.csv"
+CONSUMER = "nav_metrics"
+BATCH_SIZE = 2000
+
+# (column, calendar months, annualised)
+WINDOWS = [
+    ("Return1M", 1, False),
+    ("Return3M", 3, False),
+    ("Return6M", 6, False),
+    ("Return1Y", 12, False),
+    ("CAGR3Y", 36, True),
+    ("CAGR5Y", 60, True),
+]
+
+FIELDNAMES = (
+    ["SchemeCode", "AsOf", "NAV"]
+    + [name for name, _, _ in WINDOWS]
+    + ["CAGRInception", "PeakNAV", "MaxDrawdown", "Drawdown", "Rows"]
+)
+
+
+def months_back(days, months):
+    """``days`` moved back ``months`` calendar months, clamped to month end
+    (31 March - 1 month is 28/29 February)."""
+    d = np.asarray(days, dtype=np.int64).astype("datetime64[D]")
+    month = d.astype("datetime64[M]")
+    day_of_month = (d - month.astype("datetime64[D]")).astype(np.int64)
+    target = month - months
+    first = target.astype("datetime64[D]")
+    length = ((target + 1).astype("datetime64[D]") - first).astype(np.int64)
+    return (first + np.minimum(day_of_month, length - 1)).astype(np.int64)
+
+
+def _ratio(x, digits=6):
+    if x is None or not math.isfinite(x):
+        return ""
+    s = f"{x:.{digits}f}"
+    return "0.000000" if s == "-0.000000" else s
+
+
+def _nav(x):
+    return repr(float(x))
+
+
+def load(path=METRICS_FILE):
+    """Existing ``{SchemeCode: row}``; empty if the file is missing."""
+    if not os.path.exists(path):
+        return {}
+    with open(path, newline="", encoding="utf-8") as f:
+        reader = csv.DictReader(f)
+        if reader.fieldnames != FIELDNAMES:
+            return {}
+        return {row["SchemeCode"]: row for row in reader}
+
+
+def save(rows, path=METRICS_FILE):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp = path + ".tmp"
+    with open(tmp, "w", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=FIELDNAMES)
+        writer.writeheader()
+        writer.writerows(rows)
+    os.replace(tmp, path)
+
+
+# ---------- COMPUTE ----------
+def _drawdown(navs, peak=-math.inf, worst=0.0):
+    """``(peak, max_drawdown)`` after ``navs``, continuing from a prior run."""
+    if len(navs) == 0:
+        return peak, worst
+    running = np.maximum(np.maximum.accumulate(navs), peak)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        dd = navs / running - 1
+    dd = dd[np.isfinite(dd)]
+    return float(running[-1]), min(worst, float(dd.min())) if len(dd) else worst
+
+
+def _extends(store, lo, n, prev):
+    """Rows before ``lo + done`` are what ``prev`` was computed from."""
+    if not prev or not prev["PeakNAV"] or not prev["Rows"].isdigit():
+        return 0
+    done = int(prev["Rows"])
+    if not 0 < done < n:
+        return 0
+    row = lo + done - 1
+    if int(store.days_at(row)) != nav_store.to_day(prev["AsOf"]):
+        return 0
+    if float(store.navs[row]) != float(prev["NAV"]):
+        return 0   # the last date was re-written with another NAV
+    return done
+
+
+def _priced(store, pos):
+    """The priced rows of the schemes at ``pos``, as a store of their own."""
+    import nav_validate   # needs numpy, like everything below
+
+    lo = store.offsets[pos].astype(np.int64)
+    counts = store.offsets[pos + 1] - lo
+    seg = np.repeat(np.arange(len(pos)), counts)
+    rows = np.arange(len(seg)) - np.repeat(np.cumsum(counts) - counts, counts) + lo[seg]
+    navs = np.asarray(store.navs[rows], dtype=np.float64)
+    keep = nav_validate.priced(navs)
+    offsets = np.concatenate(([0], np.cumsum(np.bincount(seg[keep], minlength=len(pos)))))
+    return nav_store.NavStore.from_days(store.codes[pos], offsets,
+                                        store.days_at(rows[keep]), navs[keep])
+
+
+def _blank(code):
+    row = dict.fromkeys(FIELDNAMES, "")
+    row.update(SchemeCode=str(code), Rows="0")
+    return row
+
+
+def compute(store, pos, previous):
+    """Metric rows for the store positions ``pos`` (schemes with rows)."""
+    store = _priced(store, pos)
+    empty = np.diff(store.offsets) == 0
+    out = [_blank(code) for code in store.codes[empty].tolist()]
+    pos = np.flatnonzero(~empty)
+    if not len(pos):
+        return out
+
+    codes = store.codes[pos]
+    lo = store.offsets[pos]
+    hi = store.offsets[pos + 1]
+    last = hi - 1
+    asof = store.days_at(last).astype(np.int64)
+    nav_last = np.asarray(store.navs[last], dtype=np.float64)
+
+    columns = {}
+    with np.errstate(divide="ignore", invalid="ignore"):
+        for name, months, annualised in WINDOWS:
+            start = store.nav_on(months_back(asof, months), codes)
+            ratio = np.where(start > 0, nav_last / start, np.nan)
+            columns[name] = ratio ** (12 / months) - 1 if annualised else ratio - 1
+
+        first_nav = np.asarray(store.navs[lo], dtype=np.float64)
+        years = (asof - store.days_at(lo)) / 365.25
+        columns["CAGRInception"] = np.where(
+            (years >= 1) & (first_nav > 0),
+            (nav_last / first_nav) ** (1 / np.maximum(years, 1)) - 1, np.nan)
+
+    for k, code in enumerate(codes.tolist()):
+        key = str(code)
+        n = int(hi[k] - lo[k])
+        prev = previous.get(key)
+        seg_lo = int(lo[k])
+        peak, worst = -math.inf, 0.0
+        done = _extends(store, seg_lo, n, prev)
+        if done:
+            seg_lo += done
+            peak, worst = float(prev["PeakNAV"]), float(prev["MaxDrawdown"] or 0)
+        peak, worst = _drawdown(np.asarray(store.navs[seg_lo:int(hi[k])], dtype=np.float64), peak, worst)
+
+        row = {
+            "SchemeCode": key,
+            "AsOf": str(np.datetime64(int(asof[k]), "D")),
+            "NAV": _nav(nav_last[k]),
+        }
+        for name in [w[0] for w in WINDOWS] + ["CAGRInception"]:
+            row[name] = _ratio(float(columns[name][k]))
+        row["PeakNAV"] = _nav(peak) if math.isfinite(peak) else ""
+        row["MaxDrawdown"] = _ratio(worst)
+        row["Drawdown"] = _ratio(nav_last[k] / peak - 1 if peak > 0 else math.nan)
+        row["Rows"] = str(n)
+        out.append(row)
+    return out
+
+
+def update(store, state, path=METRICS_FILE, full=False, batch_size=BATCH_SIZE):
+    """Refresh ``path`` from ``store``; returns ``(changed, removed, total)``."""
+    previous = {} if full else load(path)
+
+    has_rows = np.flatnonzero(np.diff(store.offsets) > 0)
+    codes = [str(c) for c in store.codes[has_rows].tolist()]
+    stale = np.array([
+        c not in previous
+        or state.watermark(CONSUMER, c)[1] != store.files.get(c, [None])[0]
+        for c in codes
+    ], dtype=bool)
+    todo = has_rows[stale]
+
+    fresh = {}
+    for i in range(0, len(todo), batch_size):
+        for row in compute(store, todo[i:i + batch_size], previous):
+            fresh[row["SchemeCode"]] = row
+
+    current = set(codes)
+    removed = sum(1 for c in previous if c not in current)
+    changed = sum(1 for c, row in fresh.items() if previous.get(c) != row)
+    if changed or removed or not os.path.exists(path):
+        save([fresh.get(c) or previous[c] for c in codes], path)
+
+    # Watermarks move only once the file holding the rows is in place.
+    for c, row in fresh.items():
+        state.set_watermark(CONSUMER, c, row["AsOf"], store.files[c][0])
+    state.commit()
+    return changed, removed, len(codes)
+
+
+def run(state, output=METRICS_FILE, store_dir=nav_store.STORE_DIR, full=False):
+    """Refresh the NAV store, then the metrics file; returns the store."""
+    start = time.perf_counter()
+    with instrument.stage("nav_store"):
+        store, stats = nav_store.refresh(state, store_dir=store_dir)
+        instrument.count("schemes_parsed", stats["parsed"])
+        instrument.count("schemes_extended", stats["extended"])
+    print(f"📦 NAV store: {len(store):,} schemes, {store.rows:,} rows "
+          f"(extended {stats['extended']:,}, parsed {stats['parsed']:,}) "
+          f"in {time.perf_counter() - start:.1f}s")
+
+    start = time.perf_counter()
+    with instrument.stage("metrics"):
+        changed, removed, total = update(store, state, output, full=full)
+        instrument.count("rows_changed", changed)
+    elapsed = time.perf_counter() - start
+    if changed or removed:
+        print(f"📈 {changed:,} schemes updated, {removed:,} removed → {output}")
+    else:
+        print(f"🟢 {output} already up to date, not rewritten")
+    print(f"\n🎉 Metrics for {total:,} schemes ready in {elapsed:.2f}s ✅")
+    return store
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Maintain data/scheme_metrics.csv")
+    parser.add_argument("--full", action="store_true", help="Recompute every scheme")
+    parser.add_argument("--output", default=METRICS_FILE, help="Metrics CSV path")
+    parser.add_argument("--store", default=nav_store.STORE_DIR, help="NAV store directory")
+    parser.add_argument("--state", default=nav_state.STATE_FILE, help="NAV history state index path")
+    instrument.add_arguments(parser)
+    args = parser.parse_args(argv)
+    instrument.start("nav_metrics", args)
+
+    if np is None:
+        parser.error("numpy is required (pip install numpy)")
+
+    with nav_state.NavState(args.state) as state:
+        run(state, args.output, args.store, full=args.full)
+
+
+if __name__ == "__main__":
+    main()
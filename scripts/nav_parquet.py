@@ -0,0 +1,359 @@
+"""Columnar NAV history store: year-partitioned Parquet.
+
+Layout::
+
+    data/nav_parquet/year=YYYY/part-NNNNN.parquet
+
+Each part holds ``scheme_code`` (int32), ``date`` (date32, i.e. int32 days
+since 1970-01-01) and ``nav`` (decimal(18, 5) stored as a 64-bit integer),
+sorted by (scheme_code, date).  Dates and NAVs are delta-encoded and the
+pages zstd-compressed.  ``sync`` appends one new part per touched year with the
+rows added to ``data/nav_history`` since the last sync (tracked as the
+``nav_parquet`` watermark in the state index); ``compact`` merges a year's
+parts back into one file.  If the same (scheme_code, date) appears in more
+than one part the newest part wins, both when reading and when compacting.
+A CSV that shrank or was rewritten (e.g. by ``nav_validate.py
+--quarantine``) is re-added whole, and the parts written for it list its
+code under ``nav_parquet.replaces`` in their metadata: that hides every
+older row of the scheme, in every year, so ``sync`` matches ``rebuild``.
+
+The per-scheme CSVs stay the source of truth; ``export-csv`` writes a year
+back out in the ``nav_year_YYYY.csv`` layout.  History NAVs carry 5
+decimals, so the decimal column round-trips them byte for byte.
+
+Requires ``pyarrow`` (16 or newer).
+
+    python scripts/nav_parquet.py rebuild
+    python scripts/nav_parquet.py sync
+    python scripts/nav_parquet.py compact
+    python scripts/nav_parquet.py export-csv 2025 nav_year_2025.csv
+"""
+
+import argparse
+import csv
+import io
+import json
+import os
+import shutil
+from datetime import date
+from decimal import Decimal, InvalidOperation
+
+try:
+    import numpy as np
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.csv as pa_csv
+    import pyarrow.parquet as pq
+except ImportError:  # optional dependency
+    pa = None
+
+import nav_state
+
+NAV_DIR = nav_state.NAV_DIR
+PARQUET_DIR = "data/nav_parquet"
+STATE_FILE = nav_state.STATE_FILE
+CONSUMER = "nav_parquet"
+
+REPLACES_KEY = b"nav_parquet.replaces"
+ROW_GROUP_SIZE = 128 * 1024
+NAV_SCALE = 5
+WRITE_OPTIONS = {
+    "compression": "zstd",
+    "row_group_size": ROW_GROUP_SIZE,
+    "use_dictionary": ["scheme_code"],
+    "column_encoding": {"date": "DELTA_BINARY_PACKED", "nav": "DELTA_BINARY_PACKED"},
+    "store_decimal_as_integer": True,
+}
+
+
+def available():
+    return pa is not None
+
+
+def schema():
+    return pa.schema([
+        ("scheme_code", pa.int32()),
+        ("date", pa.date32()),
+        ("nav", nav_type()),
+    ])
+
+
+def nav_type():
+    return pa.decimal128(18, NAV_SCALE)
+
+
+# ---------- PARSING ----------
+def _parse_slow(code, text):
+    """Row-by-row fallback with the same skip rules as the CSV exporters."""
+    dates, navs = [], []
+    for r in csv.DictReader(io.StringIO(text, newline="")):
+        date_str = r.get("Date")
+        nav = r.get("NAV")
+        if not date_str or not nav:
+            continue
+        try:
+            d = date.fromisoformat(date_str)
+            value = Decimal(nav).quantize(Decimal(1).scaleb(-NAV_SCALE))
+        except (ValueError, InvalidOperation):
+            continue
+        if not value.is_finite():
+            continue
+        dates.append(d)
+        navs.append(value)
+    return pa.table({
+        "scheme_code": pa.array([int(code)] * len(dates), pa.int32()),
+        "date": pa.array(dates, pa.date32()),
+        "nav": pa.array(navs, nav_type()),
+    })
+
+
+def parse_csv_bytes(code, header, data):
+    """Arrow table for one scheme's ``Date,NAV`` bytes (``data`` after ``header``)."""
+    if not data.strip():
+        return schema().empty_table()
+    buf = header + data
+    try:
+        t = pa_csv.read_csv(
+            pa.BufferReader(buf),
+            convert_options=pa_csv.ConvertOptions(
+                column_types={"Date": pa.date32(), "NAV": nav_type()},
+                include_columns=["Date", "NAV"],
+            ),
+        )
+        if t.num_rows and (t["Date"].null_count or t["NAV"].null_count):
+            raise ValueError("missing values")
+    except (pa.ArrowInvalid, ValueError, KeyError):
+        return _parse_slow(code, buf.decode("utf-8", "replace"))
+    return pa.table({
+        "scheme_code": pa.array([int(code)] * t.num_rows, pa.int32()),
+        "date": t["Date"],
+        "nav": t["NAV"],
+    })
+
+
+# ---------- WRITING ----------
+def _year_dir(root, year):
+    return os.path.join(root, f"year={year}")
+
+
+def _parts(root, year):
+    d = _year_dir(root, year)
+    if not os.path.isdir(d):
+        return []
+    return sorted(
+        os.path.join(d, f) for f in os.listdir(d)
+        if f.startswith("part-") and f.endswith(".parquet")
+    )
+
+
+def years(root=PARQUET_DIR):
+    if not os.path.isdir(root):
+        return []
+    return sorted(
+        int(d.split("=", 1)[1]) for d in os.listdir(root)
+        if d.startswith("year=") and d.split("=", 1)[1].isdigit()
+    )
+
+
+def _sort(table):
+    return table.sort_by([("scheme_code", "ascending"), ("date", "ascending")])
+
+
+def _write(table, path):
+    tmp = path + ".tmp"
+    pq.write_table(table, tmp, **WRITE_OPTIONS)
+    os.replace(tmp, path)
+
+
+def append(table, root=PARQUET_DIR, replaces=()):
+    """Write ``table`` as one new part per year it touches.
+
+    ``replaces``: scheme codes whose every row is in ``table``; each year
+    already in the store then gets a part (empty if need be) that hides
+    their older rows.
+    """
+    year_col = pc.year(table["date"])
+    targets = set(pc.unique(year_col).to_pylist()) if table.num_rows else set()
+    if replaces:
+        targets.update(years(root))
+    written = {}
+    for year in sorted(targets):
+        chunk = _sort(table.filter(pc.equal(year_col, year)))
+        if replaces:
+            chunk = chunk.replace_schema_metadata(
+                {REPLACES_KEY: json.dumps(sorted(int(c) for c in replaces)).encode("ascii")})
+        parts = _parts(root, year)
+        seq = int(os.path.basename(parts[-1])[5:10]) + 1 if parts else 0
+        os.makedirs(_year_dir(root, year), exist_ok=True)
+        _write(chunk, os.path.join(_year_dir(root, year), f"part-{seq:05d}.parquet"))
+        written[year] = chunk.num_rows
+    return written
+
+
+def _replaces(table):
+    meta = table.schema.metadata or {}
+    return json.loads(meta[REPLACES_KEY]) if REPLACES_KEY in meta else []
+
+
+def _dedupe(tables):
+    """Concatenate parts oldest→newest, keep the newest row per key, sort."""
+    if not tables:
+        return schema().empty_table()
+    tables = list(tables)
+    for i, t in enumerate(tables):
+        codes = _replaces(t)
+        if codes:
+            gone = pa.array(codes, pa.int32())
+            for j in range(i):
+                tables[j] = tables[j].filter(
+                    pc.invert(pc.is_in(tables[j]["scheme_code"], value_set=gone)))
+    tables = [t.replace_schema_metadata(None) for t in tables]
+    tagged = [
+        t.append_column("_part", pa.array([i] * t.num_rows, pa.int32()))
+        for i, t in enumerate(tables)
+    ]
+    t = pa.concat_tables(tagged).sort_by([
+        ("scheme_code", "ascending"), ("date", "ascending"), ("_part", "descending"),
+    ])
+    if len(tables) > 1 and t.num_rows > 1:
+        code = t["scheme_code"].to_numpy()
+        day = t["date"].cast(pa.int32()).to_numpy()
+        keep = np.ones(len(code), dtype=bool)
+        keep[1:] = (code[1:] != code[:-1]) | (day[1:] != day[:-1])
+        t = t.filter(pa.array(keep))
+    return t.drop_columns(["_part"])
+
+
+def read_year(year, root=PARQUET_DIR):
+    return _dedupe([pq.read_table(p) for p in _parts(root, year)])
+
+
+def read_scheme(code, root=PARQUET_DIR):
+    """One scheme's full history as an Arrow table sorted by date."""
+    flt = pc.equal(pc.field("scheme_code"), int(code))
+    # Part order (and so replacement) only means something within a year.
+    tables = [
+        _dedupe([pq.read_table(p, filters=flt) for p in _parts(root, year)])
+        for year in years(root)
+    ]
+    return pa.concat_tables(tables) if tables else schema().empty_table()
+
+
+def compact(root=PARQUET_DIR, only_years=None):
+    compacted = 0
+    for year in years(root):
+        if only_years and year not in only_years:
+            continue
+        parts = _parts(root, year)
+        if len(parts) <= 1:
+            continue
+        table = read_year(year, root)
+        target = os.path.join(_year_dir(root, year), "part-00000.parquet")
+        tmp = target + ".compact"
+        pq.write_table(table, tmp, **WRITE_OPTIONS)
+        for p in parts:
+            os.remove(p)
+        os.replace(tmp, target)
+        compacted += 1
+        print(f"🧱 {year} → {len(parts)} parts compacted ({table.num_rows:,} rows)")
+    return compacted
+
+
+# ---------- SYNC FROM CSV ----------
+def sync(state, nav_dir=NAV_DIR, root=PARQUET_DIR, rebuild=False):
+    """Append rows added to ``nav_dir`` since the last sync; returns row count."""
+    if rebuild:
+        shutil.rmtree(root, ignore_errors=True)
+        state.clear_watermarks(CONSUMER)
+
+    scheme_files = sorted(
+        f for f in os.listdir(nav_dir) if f.endswith(".csv")
+    )
+
+    tables = []
+    marks = []
+    rewritten = []
+    for fname in scheme_files:
+        code = os.path.splitext(fname)[0]
+        if not code.isdigit():
+            continue
+        path = os.path.join(nav_dir, fname)
+
+        entry = state.lookup(code, path)
+        wm_date, wm_offset = state.watermark(CONSUMER, code)
+        if wm_date == entry.last_date and wm_offset == entry.size:
+            continue
+
+        # A shrunk file was rewritten: re-add everything and replace the old rows.
+        offset = wm_offset if wm_offset <= entry.size else 0
+        if wm_offset > entry.size:
+            rewritten.append(code)
+        header, data = nav_state.read_tail(path, offset)
+        table = parse_csv_bytes(code, header, data)
+        if table.num_rows:
+            tables.append(table)
+        marks.append((code, entry.last_date, entry.size))
+
+    rows = 0
+    if tables or rewritten:
+        combined = pa.concat_tables(tables) if tables else schema().empty_table()
+        rows = combined.num_rows
+        for year, n in sorted(append(combined, root, rewritten).items()):
+            print(f"📅 {year} → ✍️ {n:,} rows")
+        if rewritten:
+            print(f"♻️ Rewritten schemes replaced: {len(rewritten):,}")
+
+    for code, last_date, size in marks:
+        state.set_watermark(CONSUMER, code, last_date, size)
+    state.commit()
+
+    return rows
+
+
+# ---------- CSV EXPORT ----------
+def export_csv(year, out_file, root=PARQUET_DIR):
+    """Write one year in the ``nav_year_YYYY.csv`` layout."""
+    table = read_year(year, root)
+    codes = table["scheme_code"].to_pylist()
+    dates = table["date"].to_pylist()
+    navs = table["nav"].to_pylist()
+    with open(out_file, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(["SchemeCode", "Date", "NAV"])
+        for code, d, nav in zip(codes, dates, navs):
+            writer.writerow([code, d.isoformat(), nav])
+    return table.num_rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Partitioned Parquet store for NAV history")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("sync", help="Append rows added to the CSV history since the last sync")
+    sub.add_parser("rebuild", help="Rebuild the store from data/nav_history")
+    p_compact = sub.add_parser("compact", help="Merge each year's parts into one file")
+    p_compact.add_argument("years", nargs="*", type=int)
+    p_export = sub.add_parser("export-csv", help="Write one year as SchemeCode,Date,NAV CSV")
+    p_export.add_argument("year", type=int)
+    p_export.add_argument("output")
+    parser.add_argument("--root", default=PARQUET_DIR, help="Parquet store directory")
+    parser.add_argument("--state", default=STATE_FILE, help="NAV history state index path")
+
+    args = parser.parse_args()
+
+    if not available():
+        parser.error("pyarrow is required (pip install pyarrow)")
+
+    if args.command in ("sync", "rebuild"):
+        with nav_state.NavState(args.state) as state:
+            rows = sync(state, root=args.root, rebuild=args.command == "rebuild")
+        print(f"✅ Parquet store updated. Rows appended: {rows:,}")
+    elif args.command == "compact":
+        n = compact(args.root, set(args.years) or None)
+        print(f"✅ Compaction complete. Years compacted: {n}")
+    else:
+        n = export_csv(args.year, args.output, args.root)
+        print(f"✅ Exported {n:,} rows → {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,683 @@
+"""Compressed NAV history segments: a git-friendly copy of ``data/nav_history``.
+
+Layout::
+
+    data/nav_segments/seg-NNN.nvs    compacted schemes with codes NNN000–NNN999
+    data/nav_segments/seg-NNN.hot    lines appended since the last compaction
+
+A ``.nvs`` segment starts with ``MAGIC``, a 4-byte header length and a
+zstd-compressed JSON header (one record per scheme: size, CRC32, rows,
+last date, encoding and frame position), followed by one zstd frame per
+scheme, so reading a scheme decompresses only its own frame.  A scheme in
+the canonical layout (``Date,NAV`` header, ISO dates, one fixed number of
+decimals, one line ending throughout) is stored as day numbers and NAVs in
+fixed-point integers, both delta-encoded in the narrowest integer type
+that holds them and byte-transposed before compression.  Anything else is
+stored as the raw bytes.  Every encoding is decoded and compared before it
+is written, so :meth:`SegmentStore.read` returns the CSV byte for byte.
+
+The ``.hot`` file is plain text, one ``<SchemeCode>,<CSV line>`` per line,
+and is only ever appended to: a daily run adds one short line per scheme
+instead of touching 14k files.  Once it passes ``HOT_LIMIT`` bytes the
+bucket is compacted into a new ``.nvs`` and the ``.hot`` file removed.
+
+``sync`` brings the store up to ``data/nav_history`` (only tails are
+appended; a scheme whose file was rewritten is re-encoded), ``checkout``
+writes the CSVs back out (only missing or differing files) and ``verify``
+checks the round trip for every scheme.  With ``--segments`` the fetch
+and export scripts run ``checkout`` first, and the fetch script runs
+``sync`` at the end, so a repository can commit ``data/nav_segments``
+alone.
+
+Requires ``numpy`` and ``zstandard``.
+
+    python scripts/nav_segments.py rebuild
+    python scripts/nav_segments.py sync
+    python scripts/nav_segments.py checkout
+    python scripts/nav_segments.py verify
+    python scripts/nav_segments.py compact
+    python scripts/nav_segments.py stats
+    python scripts/nav_segments.py cat 119551
+"""
+
+import argparse
+import json
+import os
+import shutil
+import sys
+import zlib
+from collections import defaultdict, namedtuple
+
+try:
+    import numpy as np
+    import zstandard
+except ImportError:  # optional dependency
+    zstandard = None
+
+import instrument
+import nav_state
+
+NAV_DIR = nav_state.NAV_DIR
+SEGMENT_DIR = "data/nav_segments"
+STATE_FILE = nav_state.STATE_FILE
+CONSUMER = "nav_segments"
+
+MAGIC = b"NAVSEG1\n"
+SPAN = 1000                  # scheme codes per segment
+HOT_LIMIT = 256 * 1024       # compact a bucket once its hot file is this big
+LEVEL = 12                   # zstd level for segments
+HEADER_LINE = b"Date,NAV"
+EOLS = {"crlf": b"\r\n", "lf": b"\n"}
+
+Span = namedtuple("Span", "size crc")
+
+
+def available():
+    return zstandard is not None
+
+
+def bucket_of(code):
+    return int(code) // SPAN
+
+
+def _seg_path(root, bucket):
+    return os.path.join(root, f"seg-{bucket:03d}.nvs")
+
+
+def _hot_path(root, bucket):
+    return os.path.join(root, f"seg-{bucket:03d}.hot")
+
+
+def _buckets(root):
+    if not os.path.isdir(root):
+        return []
+    return sorted({
+        int(f[4:-4]) for f in os.listdir(root)
+        if f.startswith("seg-") and f[-4:] in (".nvs", ".hot") and f[4:-4].isdigit()
+    })
+
+
+# ---------- ENCODING ----------
+def _int_type(values):
+    if not len(values):
+        return np.dtype("i1")
+    lo, hi = int(values.min()), int(values.max())
+    for name in ("i1", "i2", "i4"):
+        info = np.iinfo(name)
+        if info.min <= lo and hi <= info.max:
+            return np.dtype(name)
+    return np.dtype("i8")
+
+
+def _transpose(values):
+    """Byte planes of ``values`` (all low bytes, then the next ...)."""
+    return values.view(np.uint8).reshape(-1, values.itemsize).T.tobytes()
+
+
+def _untranspose(buf, dtype, n):
+    planes = np.frombuffer(buf, np.uint8, count=n * dtype.itemsize).reshape(dtype.itemsize, n)
+    return planes.T.copy().view(dtype.newbyteorder("<")).ravel().astype(np.int64)
+
+
+def _parse(lines):
+    """Day numbers and NAV digits (the decimal point dropped) of
+    ``YYYY-MM-DD,<nav>`` lines, read as one byte matrix.
+
+    Nothing is validated here: :func:`encode` renders the result again
+    and keeps it only if that reproduces the input.
+    """
+    chars = np.array(lines, dtype=bytes)
+    chars = chars.view(np.uint8).reshape(len(lines), chars.dtype.itemsize).astype(np.int64)
+    if chars.shape[1] < 12:
+        chars = np.pad(chars, ((0, 0), (0, 12 - chars.shape[1])))
+    d = chars[:, :10] - 48
+    year = d[:, 0] * 1000 + d[:, 1] * 100 + d[:, 2] * 10 + d[:, 3]
+    days = _days(year, d[:, 5] * 10 + d[:, 6], d[:, 8] * 10 + d[:, 9])
+
+    nav = chars[:, 11:]
+    digit = (nav >= 48) & (nav <= 57)
+    place = np.cumsum(digit[:, ::-1], axis=1)[:, ::-1] - digit
+    navs = np.where(digit, (nav - 48) * 10 ** np.minimum(place, 18), 0).sum(axis=1)
+    return days, navs
+
+
+def _encode_delta(data):
+    """``(meta, payload)`` for a canonical ``Date,NAV`` file, else ``None``."""
+    for eol_name, eol in EOLS.items():
+        if data.startswith(HEADER_LINE + eol):
+            break
+    else:
+        return None
+    if not data.endswith(eol):
+        return None
+
+    body = data[len(HEADER_LINE) + len(eol):-len(eol)]
+    lines = body.split(eol) if body else []
+    meta = {"kind": "delta", "eol": eol_name, "lines": len(lines), "decimals": 0}
+    if not lines:
+        return meta, b""
+
+    first_nav = lines[0][11:]
+    dot = first_nav.find(b".")
+    decimals = len(first_nav) - dot - 1 if dot >= 0 else 0
+    days, navs = _parse(lines)
+    if navs.min() < 0:
+        return None
+
+    day_steps = np.diff(days)
+    nav_steps = np.diff(navs)
+    day_type, nav_type = _int_type(day_steps), _int_type(nav_steps)
+    meta.update(decimals=decimals, first=[int(days[0]), int(navs[0])],
+                types=[day_type.str[1:], nav_type.str[1:]])
+    payload = (_transpose(day_steps.astype(day_type.newbyteorder("<")))
+               + _transpose(nav_steps.astype(nav_type.newbyteorder("<"))))
+    return meta, payload
+
+
+def _decode_delta(meta, payload):
+    eol = EOLS[meta["eol"]]
+    n = meta["lines"]
+    if not n:
+        return HEADER_LINE + eol
+
+    day_type, nav_type = (np.dtype(t) for t in meta["types"])
+    split = (n - 1) * day_type.itemsize
+    days = np.empty(n, np.int64)
+    navs = np.empty(n, np.int64)
+    days[0], navs[0] = meta["first"]
+    days[1:] = _untranspose(payload[:split], day_type, n - 1)
+    navs[1:] = _untranspose(payload[split:], nav_type, n - 1)
+    np.cumsum(days, out=days)
+    np.cumsum(navs, out=navs)
+
+    return HEADER_LINE + eol + _render(days, navs, meta["decimals"], eol)
+
+
+def _digits(values, width):
+    """``(n, width)`` ASCII digits of non-negative ``values``, zero-padded."""
+    powers = 10 ** np.arange(width - 1, -1, -1, dtype=np.int64)
+    return ((values[:, None] // powers) % 10 + 48).astype(np.uint8)
+
+
+def _civil(days):
+    """Year, month, day arrays for days since 1970-01-01 (proleptic Gregorian)."""
+    z = days + 719468
+    era = z // 146097
+    doe = z - era * 146097
+    yoe = (doe - doe // 1460 + doe // 36524 - doe // 146096) // 365
+    doy = doe - (365 * yoe + yoe // 4 - yoe // 100)
+    mp = (5 * doy + 2) // 153
+    month = mp + np.where(mp < 10, 3, -9)
+    return yoe + era * 400 + (month <= 2), month, doy - (153 * mp + 2) // 5 + 1
+
+
+def _days(year, month, day):
+    """Inverse of :func:`_civil`."""
+    year = year - (month <= 2)
+    era = year // 400
+    yoe = year - era * 400
+    doy = (153 * ((month + 9) % 12) + 2) // 5 + day - 1
+    return era * 146097 + yoe * 365 + yoe // 4 - yoe // 100 + doy - 719468
+
+
+def _render(days, navs, decimals, eol):
+    """``YYYY-MM-DD,<nav>`` lines built as one byte matrix.
+
+    Each row is laid out at a fixed width with the NAV's leading zeros
+    set to NUL, which is then dropped; ``navs`` must not be negative.
+    """
+    n = len(days)
+    year, month, day = _civil(days)
+    width = max(len(str(int(navs.max()))), decimals + 1)
+    digits = _digits(navs, width)
+    lead = np.cumsum(digits != 48, axis=1) == 0
+    lead[:, width - decimals - 1:] = False
+    digits[lead] = 0
+
+    def column(text):
+        return np.broadcast_to(np.frombuffer(text, np.uint8), (n, len(text)))
+
+    parts = [_digits(year, 4), column(b"-"), _digits(month, 2), column(b"-"), _digits(day, 2),
+             column(b","), digits[:, :width - decimals]]
+    if decimals:
+        parts += [column(b"."), digits[:, width - decimals:]]
+    parts.append(column(eol))
+    rows = np.hstack(parts)
+    return rows[rows != 0].tobytes()
+
+
+def encode(data):
+    """``(meta, payload)`` for one scheme's CSV bytes, checked to round-trip."""
+    entry = nav_state.scan_bytes(data)
+    meta = {"size": entry.size, "crc": entry.crc, "rows": entry.rows,
+            "last_date": entry.last_date}
+    delta = _encode_delta(data)
+    if delta is not None and _decode_delta(*delta) == data:
+        meta.update(delta[0])
+        return meta, delta[1]
+    meta["kind"] = "raw"
+    return meta, data
+
+
+def decode(meta, payload):
+    if meta["kind"] == "raw":
+        return payload
+    return _decode_delta(meta, payload)
+
+
+# ---------- SEGMENT FILES ----------
+def write_segment(path, schemes, absorbed=None, level=LEVEL):
+    """Write ``{code: csv bytes}`` as one segment; ``absorbed`` is the
+    ``Span`` of the hot file folded in (see :class:`SegmentStore`)."""
+    cctx = zstandard.ZstdCompressor(level=level)
+    index = {}
+    frames = []
+    offset = 0
+    for code in sorted(schemes, key=int):
+        meta, payload = encode(schemes[code])
+        frame = cctx.compress(payload)
+        meta.update(offset=offset, length=len(frame))
+        index[code] = meta
+        frames.append(frame)
+        offset += len(frame)
+
+    header = cctx.compress(json.dumps(
+        {"schemes": index, "hot": list(absorbed) if absorbed else None},
+        separators=(",", ":")).encode("utf-8"))
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(MAGIC)
+        f.write(len(header).to_bytes(4, "little"))
+        f.write(header)
+        for frame in frames:
+            f.write(frame)
+    os.replace(tmp, path)
+    return index
+
+
+class Segment:
+    """A compacted ``.nvs`` file: the header index and the frames."""
+
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            self._blob = f.read()
+        if not self._blob.startswith(MAGIC):
+            raise ValueError(f"{path}: not a NAV segment")
+        n = int.from_bytes(self._blob[len(MAGIC):len(MAGIC) + 4], "little")
+        self._base = len(MAGIC) + 4 + n
+        self._dctx = zstandard.ZstdDecompressor()
+        header = json.loads(self._dctx.decompress(self._blob[len(MAGIC) + 4:self._base]))
+        self.schemes = header["schemes"]
+        self.absorbed = Span(*header["hot"]) if header.get("hot") else None
+        self.size = len(self._blob)
+
+    def read(self, code):
+        meta = self.schemes[code]
+        start = self._base + meta["offset"]
+        payload = self._dctx.decompress(self._blob[start:start + meta["length"]])
+        return decode(meta, payload)
+
+
+def read_hot(path, absorbed=None):
+    """``{code: [chunk, ...]}`` from a hot file, in append order.
+
+    A prefix matching ``absorbed`` was already folded into the segment (a
+    compaction stopped before removing the file) and is skipped; a torn
+    last line is ignored.
+    """
+    try:
+        with open(path, "rb") as f:
+            blob = f.read()
+    except FileNotFoundError:
+        return {}
+    if absorbed and len(blob) >= absorbed.size and zlib.crc32(blob[:absorbed.size]) == absorbed.crc:
+        blob = blob[absorbed.size:]
+    chunks = defaultdict(list)
+    for line in blob.split(b"\n")[:-1]:
+        code, _, content = line.partition(b",")
+        chunks[code.decode("ascii")].append(content + b"\n")
+    return chunks
+
+
+# ---------- STORE ----------
+class SegmentStore:
+    """Read and append per-scheme CSV bytes; use as a context manager.
+
+    Appends are buffered per bucket and written by :meth:`flush` (and on
+    exit) with one ``write`` per hot file.
+    """
+
+    def __init__(self, root=SEGMENT_DIR, level=LEVEL):
+        self.root = root
+        self.level = level
+        self._segments = {}
+        self._hot = {}
+        self._pending = defaultdict(list)
+
+    # ---------- READ ----------
+    def _segment(self, bucket):
+        if bucket not in self._segments:
+            path = _seg_path(self.root, bucket)
+            self._segments[bucket] = Segment(path) if os.path.exists(path) else None
+        return self._segments[bucket]
+
+    def _hot_chunks(self, bucket):
+        if bucket not in self._hot:
+            segment = self._segment(bucket)
+            self._hot[bucket] = read_hot(_hot_path(self.root, bucket),
+                                         segment.absorbed if segment else None)
+        return self._hot[bucket]
+
+    def buckets(self):
+        return sorted(set(_buckets(self.root)) | set(self._pending))
+
+    def codes(self, bucket=None):
+        buckets = self.buckets() if bucket is None else [bucket]
+        out = set()
+        for b in buckets:
+            segment = self._segment(b)
+            if segment:
+                out.update(segment.schemes)
+            out.update(self._hot_chunks(b))
+        return sorted(out, key=int)
+
+    def entry(self, code):
+        """``Span`` of the scheme's CSV bytes (as ``nav_state`` records them),
+        or ``None`` for a scheme the store has never seen."""
+        bucket = bucket_of(code)
+        segment = self._segment(bucket)
+        meta = segment.schemes.get(code) if segment else None
+        chunks = self._hot_chunks(bucket).get(code, ())
+        if meta is None and not chunks:
+            return None
+        size, crc = (meta["size"], meta["crc"]) if meta else (0, 0)
+        for chunk in chunks:
+            size += len(chunk)
+            crc = zlib.crc32(chunk, crc)
+        return Span(size, crc)
+
+    def read(self, code):
+        """The scheme's ``<code>.csv`` bytes (``b""`` if unknown)."""
+        bucket = bucket_of(code)
+        segment = self._segment(bucket)
+        data = segment.read(code) if segment and code in segment.schemes else b""
+        return data + b"".join(self._hot_chunks(bucket).get(code, ()))
+
+    # ---------- WRITE ----------
+    def append(self, code, data):
+        """Append CSV bytes (whole lines) to a scheme's history."""
+        if not data:
+            return
+        if not data.endswith(b"\n"):
+            raise ValueError(f"{code}: appended data must end with a newline")
+        bucket = bucket_of(code)
+        prefix = code.encode("ascii") + b","
+        chunks = [line + b"\n" for line in data.split(b"\n")[:-1]]
+        self._pending[bucket].append(b"".join(prefix + chunk for chunk in chunks))
+        self._hot_chunks(bucket).setdefault(code, []).extend(chunks)
+
+    def flush(self):
+        for bucket, parts in self._pending.items():
+            path = _hot_path(self.root, bucket)
+            os.makedirs(self.root, exist_ok=True)
+            with open(path, "ab") as f:
+                # Drop a torn last line left by an interrupted write.
+                end = f.seek(0, os.SEEK_END)
+                if end:
+                    with open(path, "rb") as r:
+                        r.seek(end - 1)
+                        if r.read(1) != b"\n":
+                            r.seek(0)
+                            f.truncate(r.read().rfind(b"\n") + 1)
+                f.write(b"".join(parts))
+        self._pending.clear()
+
+    def hot_size(self, bucket):
+        path = _hot_path(self.root, bucket)
+        pending = sum(len(p) for p in self._pending.get(bucket, ()))
+        return (os.path.getsize(path) if os.path.exists(path) else 0) + pending
+
+    def compact(self, buckets=None, replace=None):
+        """Fold hot files into new segments; ``replace`` maps codes to new
+        full CSV bytes (their bucket is compacted too).  Returns the
+        buckets written."""
+        self.flush()
+        replace = replace or {}
+        targets = set(buckets if buckets is not None else self.buckets())
+        targets |= {bucket_of(c) for c in replace}
+        done = []
+        for bucket in sorted(targets):
+            hot = _hot_path(self.root, bucket)
+            absorbed = None
+            if os.path.exists(hot):
+                with open(hot, "rb") as f:
+                    blob = f.read()
+                absorbed = Span(len(blob), zlib.crc32(blob))
+            elif bucket not in {bucket_of(c) for c in replace}:
+                continue
+            schemes = {code: self.read(code) for code in self.codes(bucket)}
+            schemes.update({c: d for c, d in replace.items() if bucket_of(c) == bucket})
+            os.makedirs(self.root, exist_ok=True)
+            write_segment(_seg_path(self.root, bucket), schemes, absorbed, self.level)
+            if absorbed:
+                os.remove(hot)
+            self._segments.pop(bucket, None)
+            self._hot.pop(bucket, None)
+            done.append(bucket)
+        return done
+
+    def close(self):
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+# ---------- CSV ROUND TRIP ----------
+def _scheme_files(nav_dir):
+    return sorted(f for f in os.listdir(nav_dir) if f.endswith(".csv") and f[:-4].isdigit())
+
+
+def _read(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def rebuild(nav_dir=NAV_DIR, root=SEGMENT_DIR, level=LEVEL):
+    """Write every bucket straight from the CSVs; returns the scheme count."""
+    shutil.rmtree(root, ignore_errors=True)
+    os.makedirs(root)
+    groups = defaultdict(list)
+    for fname in _scheme_files(nav_dir):
+        groups[bucket_of(fname[:-4])].append(fname)
+    for bucket, files in sorted(groups.items()):
+        schemes = {f[:-4]: _read(os.path.join(nav_dir, f)) for f in files}
+        write_segment(_seg_path(root, bucket), schemes, level=level)
+        print(f"🧱 seg-{bucket:03d} → {len(files)} schemes")
+    return sum(len(f) for f in groups.values())
+
+
+def sync(state, nav_dir=NAV_DIR, root=SEGMENT_DIR, hot_limit=HOT_LIMIT):
+    """Bring the store up to ``nav_dir``; returns ``(lines appended, schemes
+    re-encoded)``.
+
+    A scheme whose file grew past the stored bytes gets the tail appended
+    to its hot file.  The stored bytes are trusted to be the file's prefix
+    when the ``nav_segments`` watermark says they were synced from it;
+    otherwise the prefix is compared first.  Any other difference is
+    re-encoded into a new segment.  Buckets whose hot file passes
+    ``hot_limit`` are compacted.
+    """
+    lines = 0
+    replace = {}
+    marks = []
+    with SegmentStore(root) as store:
+        for fname in _scheme_files(nav_dir):
+            code = fname[:-4]
+            path = os.path.join(nav_dir, fname)
+            entry = state.lookup(code, path)
+            have = store.entry(code) or Span(0, 0)
+            if have == (entry.size, entry.crc):
+                marks.append((code, entry.last_date, entry.size))
+                continue
+
+            tail = None
+            if entry.size > have.size:
+                _, wm_offset = state.watermark(CONSUMER, code)
+                with open(path, "rb") as f:
+                    if wm_offset == have.size:
+                        f.seek(have.size)
+                        tail = f.read()
+                    else:
+                        data = f.read()
+                        if zlib.crc32(data[:have.size]) == have.crc:
+                            tail = data[have.size:]
+                if tail is not None and not tail.endswith(b"\n"):
+                    tail = None
+
+            if tail is None:
+                replace[code] = _read(path)
+            else:
+                store.append(code, tail)
+                added = tail.count(b"\n")
+                lines += added
+                instrument.detail(f"📄 {code} → ➕ {added} lines")
+            marks.append((code, entry.last_date, entry.size))
+
+        full = [b for b in store.buckets() if store.hot_size(b) > hot_limit]
+        for bucket in store.compact(full, replace):
+            print(f"🧱 seg-{bucket:03d} compacted")
+
+    for code, last_date, size in marks:
+        state.set_watermark(CONSUMER, code, last_date, size)
+    state.commit()
+    instrument.count("rows_written", lines)
+    return lines, len(replace)
+
+
+def checkout(state, nav_dir=NAV_DIR, root=SEGMENT_DIR):
+    """Write out every CSV that is missing or differs from the store.
+
+    A file that already starts with the stored bytes (rows fetched since
+    the last sync) is left alone.  Returns the number of files written.
+    """
+    os.makedirs(nav_dir, exist_ok=True)
+    written = 0
+    with SegmentStore(root) as store:
+        for code in store.codes():
+            path = os.path.join(nav_dir, f"{code}.csv")
+            have = store.entry(code)
+            entry = state.lookup(code, path)
+            if (entry.size, entry.crc) == have:
+                continue
+            if entry.size > have.size:
+                with open(path, "rb") as f:
+                    if zlib.crc32(f.read(have.size)) == have.crc:
+                        continue
+
+            data = store.read(code)
+            tmp = path + ".tmp"
+            with open(tmp, "wb") as f:
+                f.write(data)
+            os.replace(tmp, path)
+            entry = state.lookup(code, path)
+            state.set_watermark(CONSUMER, code, entry.last_date, entry.size)
+            written += 1
+            instrument.detail(f"📄 {code} → restored ({len(data):,} bytes)")
+    state.commit()
+    instrument.count("schemes_restored", written)
+    return written
+
+
+def verify(nav_dir=NAV_DIR, root=SEGMENT_DIR):
+    """Codes whose CSV and stored bytes differ (either side missing counts)."""
+    bad = []
+    with SegmentStore(root) as store:
+        codes = set(store.codes()) | {f[:-4] for f in _scheme_files(nav_dir)}
+        for code in sorted(codes, key=int):
+            path = os.path.join(nav_dir, f"{code}.csv")
+            data = _read(path) if os.path.exists(path) else None
+            if data != store.read(code):
+                bad.append(code)
+    return bad
+
+
+def stats(root=SEGMENT_DIR):
+    """``(bucket, schemes, segment bytes, hot bytes, csv bytes)`` per bucket."""
+    rows = []
+    with SegmentStore(root) as store:
+        for bucket in store.buckets():
+            segment = store._segment(bucket)
+            codes = store.codes(bucket)
+            csv_bytes = sum(store.entry(c).size for c in codes)
+            rows.append((bucket, len(codes), segment.size if segment else 0,
+                         store.hot_size(bucket), csv_bytes))
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compressed NAV history segments")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("rebuild", help="Rewrite every segment from data/nav_history")
+    p_sync = sub.add_parser("sync", help="Append rows added to data/nav_history since the last sync")
+    p_sync.add_argument("--hot-limit", type=int, default=HOT_LIMIT,
+                        help="Hot file size (bytes) that triggers a compaction")
+    sub.add_parser("checkout", help="Write missing or differing CSVs from the store")
+    sub.add_parser("verify", help="Check every CSV round-trips byte for byte")
+    p_compact = sub.add_parser("compact", help="Fold hot files into their segments")
+    p_compact.add_argument("buckets", nargs="*", type=int)
+    sub.add_parser("stats", help="Per-segment sizes")
+    p_cat = sub.add_parser("cat", help="Print one scheme's CSV")
+    p_cat.add_argument("code")
+    parser.add_argument("--root", default=SEGMENT_DIR, help="Segment directory")
+    parser.add_argument("--nav-dir", default=NAV_DIR, help="Per-scheme NAV history directory")
+    parser.add_argument("--state", default=STATE_FILE, help="NAV history state index path")
+    instrument.add_arguments(parser)
+
+    args = parser.parse_args(argv)
+    if not available():
+        parser.error("numpy and zstandard are required (pip install zstandard)")
+    instrument.start("nav_segments", args)
+
+    if args.command == "rebuild":
+        n = rebuild(args.nav_dir, args.root)
+        print(f"✅ Segments rebuilt: {n:,} schemes → {args.root}")
+    elif args.command == "sync":
+        with nav_state.NavState(args.state) as state:
+            lines, rewritten = sync(state, args.nav_dir, args.root, args.hot_limit)
+        print(f"✅ Segments synced. Lines appended: {lines:,}, schemes re-encoded: {rewritten}")
+    elif args.command == "checkout":
+        with nav_state.NavState(args.state) as state:
+            n = checkout(state, args.nav_dir, args.root)
+        print(f"✅ CSVs written from segments: {n:,}")
+    elif args.command == "verify":
+        bad = verify(args.nav_dir, args.root)
+        for code in bad[:20]:
+            print(f"🔴 {code} → differs")
+        print(f"{'❌' if bad else '✅'} Round trip checked, {len(bad)} mismatches")
+        if bad:
+            sys.exit(1)
+    elif args.command == "compact":
+        with SegmentStore(args.root) as store:
+            done = store.compact(args.buckets or None)
+        print(f"✅ Compaction complete. Segments written: {len(done)}")
+    elif args.command == "stats":
+        rows = stats(args.root)
+        seg = sum(r[2] for r in rows)
+        hot = sum(r[3] for r in rows)
+        csv_bytes = sum(r[4] for r in rows)
+        for bucket, n, seg_b, hot_b, csv_b in rows:
+            print(f"📦 seg-{bucket:03d} → {n} schemes, {seg_b:,} + {hot_b:,} hot bytes "
+                  f"(CSV {csv_b:,})")
+        print(f"📊 {sum(r[1] for r in rows):,} schemes in {len(rows)} segments: "
+              f"{seg + hot:,} bytes for {csv_bytes:,} bytes of CSV "
+              f"({csv_bytes / max(1, seg + hot):.1f}×)")
+    else:
+        sys.stdout.buffer.write(SegmentStore(args.root).read(args.code))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,514 @@
+"""Read-only HTTP API over the NAV data, for apps that now download whole CSVs.
+
+    python scripts/nav_server.py                        # http://127.0.0.1:8080
+    python scripts/nav_server.py --host 0.0.0.0 --port 9000 --poll 30
+
+Endpoints (GET or HEAD; JSON with ``fields`` and ``data`` rows, named like
+the CSV columns):
+
+* ``/scheme/{code}/nav?from=YYYY-MM-DD&to=YYYY-MM-DD``  one scheme's NAVs,
+  oldest first (both bounds optional, inclusive)
+* ``/nav/latest``  every scheme's latest NAV and its date
+* ``/category/{name}/snapshot?date=&start=&max_age=``  NAV on ``date``
+  (default today, forward-filled, ignoring NAVs older than ``max_age``
+  days) of every scheme whose ``Category`` or ``SubCategory`` in
+  ``scheme_index.csv`` is ``name`` (any case), plus the return since
+  ``start`` when given
+* ``/stats``  load, cache and request counters (never cached)
+
+At startup the history is loaded into an in-memory
+:class:`nav_store.NavStore` and ``scheme_index.csv`` into per-scheme and
+per-category lookups.  The server writes nothing the pipeline uses: the
+state index is opened read-only (records that lag the files are repaired
+in memory), and ``nav_store.refresh`` keeps its copy in ``STORE_DIR``,
+which only the server uses, and parses only the files that changed.  Every
+``--poll`` seconds the server compares the state index, the index CSV and
+the history directory with what it loaded; when they moved (the fetch
+scripts append through the state index) it refreshes in a worker thread
+and swaps the new lookups in.  SIGHUP forces a reload.
+
+Responses are kept in an LRU of ``--cache-mb``, gzipped as well when they
+are larger than ``GZIP_MIN``.  ETags come from the data a response is
+built from (the scheme file's size and CRC32 in the state index, or a
+digest of all of them), so ``If-None-Match`` is answered 304 without
+building anything, and a reload evicts only the responses of schemes whose
+file changed plus the cross-scheme ones.
+"""
+
+import argparse
+import asyncio
+import csv
+import gzip
+import hashlib
+import io
+import json
+import os
+import signal
+import time
+import zlib
+from collections import Counter, OrderedDict
+from datetime import date
+from urllib.parse import parse_qsl, unquote, urlsplit
+
+try:
+    import numpy as np
+except ImportError:  # optional dependency
+    np = None
+
+import instrument
+import nav_state
+import nav_store
+
+NAV_DIR = nav_state.NAV_DIR
+STATE_FILE = nav_state.STATE_FILE
+STORE_DIR = ".cache/nav_server/store"
+INDEX_FILE = nav_store.INDEX_FILE
+
+HOST = "127.0.0.1"
+PORT = 8080
+POLL_SECONDS = 10          # how often to look for updated data files
+CACHE_MB = 64              # LRU budget for response bodies (plain + gzip)
+GZIP_MIN = 1024            # smaller bodies are always sent as they are
+MAX_HEAD = 16 * 1024       # request line + headers
+KEEPALIVE_SECONDS = 30     # idle time before a connection is closed
+MAX_CODE_DIGITS = 9        # longer scheme codes are unknown, not parsed
+
+INDEX_FIELDS = ("SchemeName", "AMC", "Category", "SubCategory")
+REASONS = {200: "OK", 304: "Not Modified", 400: "Bad Request", 404: "Not Found",
+           405: "Method Not Allowed", 431: "Request Header Fields Too Large",
+           500: "Internal Server Error"}
+
+
+class HTTPError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+# ---------- DATA ----------
+def read_index(path=INDEX_FILE):
+    """``(schemes, categories, crc)`` from ``scheme_index.csv``: the
+    ``INDEX_FIELDS`` per scheme code and the sorted codes per lower-cased
+    ``Category`` and ``SubCategory``."""
+    try:
+        with open(path, "rb") as f:
+            raw = f.read()
+    except FileNotFoundError:
+        return {}, {}, 0
+    schemes, members = {}, {}
+    for row in csv.DictReader(io.StringIO(raw.decode("utf-8"), newline="")):
+        code = (row.get("SchemeCode") or "").strip()
+        if not code.isdigit():
+            continue
+        schemes[int(code)] = tuple(row.get(f) or "" for f in INDEX_FIELDS)
+        for name in {category_key(row.get("Category")), category_key(row.get("SubCategory"))}:
+            if name:
+                members.setdefault(name, []).append(int(code))
+    categories = {name: np.array(sorted(set(codes)), dtype=np.int64) for name, codes in members.items()}
+    return schemes, categories, zlib.crc32(raw)
+
+
+def category_key(name):
+    return " ".join((name or "").split()).lower()
+
+
+class Data:
+    """One loaded generation: the NAV store and ``scheme_index.csv``."""
+
+    def __init__(self, store, schemes, categories, index_crc):
+        self.store = store
+        self.schemes = schemes
+        self.categories = categories
+        self.index_crc = index_crc
+        self.loaded = time.time()
+        # Date strings for every day the history spans, so a response looks
+        # its dates up instead of formatting each one.
+        has = np.flatnonzero(np.diff(store.offsets) > 0)
+        self.last_rows = store.offsets[has + 1] - 1
+        self.last_codes = store.codes[has]
+        first = store.days_at(store.offsets[has])
+        self.first_day = int(first.min()) if len(has) else 0
+        last_day = int(store.days_at(self.last_rows).max()) if len(has) else -1
+        self.day_names = np.datetime_as_string(
+            np.arange(self.first_day, last_day + 1).astype("datetime64[D]"))
+        files = json.dumps(sorted(store.files.items()), separators=(",", ":"))
+        self.version = hashlib.blake2b(f"{files}|{index_crc}".encode(), digest_size=12).hexdigest()
+
+    def dates(self, days):
+        """ISO strings for an array of days since 1970-01-01."""
+        return self.day_names[days - self.first_day].tolist()
+
+    def scheme_version(self, code):
+        size, crc = self.store.files.get(str(code), (0, 0))
+        return f"{size}:{crc}:{self.index_crc}"
+
+
+def load(nav_dir=NAV_DIR, index_file=INDEX_FILE, state_file=STATE_FILE, store_dir=STORE_DIR):
+    """A fresh :class:`Data` and the ``nav_store.refresh`` stats."""
+    with nav_state.NavState(state_file, readonly=True) as state:
+        store, stats = nav_store.refresh(state, nav_dir, store_dir, consumer=None)
+    return Data(store, *read_index(index_file)), stats
+
+
+def changed_codes(old, new):
+    """Scheme codes whose history differs between two loads."""
+    keys = set(old.store.files) | set(new.store.files)
+    return {int(k) for k in keys if old.store.files.get(k) != new.store.files.get(k)}
+
+
+def _day(value, name):
+    try:
+        return date.fromisoformat(value).isoformat() if value else ""
+    except ValueError:
+        raise HTTPError(400, f"{name} must be YYYY-MM-DD") from None
+
+
+def _number(x):
+    return None if x != x else float(x)   # NaN → null
+
+
+def _dates(days):
+    return [None if d == "NaT" else d for d in np.datetime_as_string(days, unit="D").tolist()]
+
+
+# ---------- RESPONSE CACHE ----------
+class Entry:
+    __slots__ = ("body", "gz", "etag", "codes")
+
+    def __init__(self, body, etag, codes):
+        self.body = body
+        self.gz = gzip.compress(body, compresslevel=1, mtime=0) if len(body) >= GZIP_MIN else None
+        self.etag = etag
+        self.codes = codes   # schemes the response depends on; None = all of them
+
+    @property
+    def size(self):
+        return len(self.body) + len(self.gz or b"")
+
+
+class ResponseCache:
+    """LRU of built responses, bounded by body bytes."""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, etag):
+        entry = self._entries.get(key)
+        if entry is None or entry.etag != etag:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry
+
+    def put(self, key, entry):
+        if entry.size > self.max_bytes:
+            return
+        self._drop(key)
+        self._entries[key] = entry
+        self.bytes += entry.size
+        while self.bytes > self.max_bytes:
+            self._drop(next(iter(self._entries)))
+
+    def evict(self, codes=None):
+        """Drop responses that depend on any of ``codes`` (``None``: all)."""
+        for key in [k for k, e in self._entries.items()
+                    if codes is None or e.codes is None or not codes.isdisjoint(e.codes)]:
+            self._drop(key)
+
+    def _drop(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.bytes -= entry.size
+
+
+# ---------- SERVER ----------
+class NavServer:
+    def __init__(self, nav_dir=NAV_DIR, index_file=INDEX_FILE, state_file=STATE_FILE,
+                 store_dir=STORE_DIR, cache_mb=CACHE_MB, poll=POLL_SECONDS):
+        self.nav_dir = nav_dir
+        self.index_file = index_file
+        self.state_file = state_file
+        self.store_dir = store_dir
+        self.poll = poll
+        self.cache = ResponseCache(cache_mb * 2 ** 20)
+        self.counts = Counter()
+        self.data = None
+        self.signature = None
+        self._reload_lock = asyncio.Lock()
+
+    # ---------- LOADING ----------
+    def _signature(self):
+        out = []
+        for path in (self.state_file, self.index_file, self.nav_dir):
+            try:
+                st = os.stat(path)
+                out.append((st.st_mtime_ns, st.st_size))
+            except OSError:
+                out.append(None)
+        return tuple(out)
+
+    def _load(self):
+        return load(self.nav_dir, self.index_file, self.state_file, self.store_dir)
+
+    async def reload(self):
+        async with self._reload_lock:
+            # Taken before the load: a change made meanwhile just means one
+            # more, cheap, reload.
+            signature = self._signature()
+            start = time.perf_counter()
+            with instrument.stage("reload"):
+                data, stats = await asyncio.to_thread(self._load)
+            old, self.data, self.signature = self.data, data, signature
+            self.counts["reloads"] += 1
+            if old is None:
+                return
+            if old.index_crc != data.index_crc:
+                self.cache.evict()
+                changed = "scheme index changed"
+            else:
+                codes = changed_codes(old, data)
+                if not codes:
+                    return
+                self.cache.evict(codes)
+                changed = f"{len(codes):,} schemes changed"
+            print(f"🔄 Reloaded in {time.perf_counter() - start:.1f}s: {changed} "
+                  f"(parsed {stats['parsed']:,}, extended {stats['extended']:,}), "
+                  f"{len(self.cache):,} cached responses kept")
+
+    async def _try_reload(self):
+        try:
+            await self.reload()
+        except Exception as e:  # keep serving the previous data
+            print(f"⚠️ Reload failed: {e!r}")
+
+    async def _watch(self):
+        while True:
+            await asyncio.sleep(self.poll)
+            if self._signature() != self.signature:
+                await self._try_reload()
+
+    # ---------- ENDPOINTS ----------
+    def route(self, path, query):
+        """``(cache key, version, codes, build)`` for a request; ``build()``
+        returns the JSON-ready body."""
+        parts = [unquote(p) for p in path.strip("/").split("/")]
+        if len(parts) == 3 and parts[0] == "scheme" and parts[2] == "nav":
+            return self.scheme_nav(parts[1], query)
+        if parts == ["nav", "latest"]:
+            return "/nav/latest", self.data.version, None, self.latest
+        if len(parts) == 3 and parts[0] == "category" and parts[2] == "snapshot":
+            return self.category_snapshot(parts[1], query)
+        raise HTTPError(404, "unknown path")
+
+    def scheme_nav(self, code, query):
+        data = self.data
+        valid = code.isascii() and code.isdigit() and len(code) <= MAX_CODE_DIGITS
+        pos = int(data.store.index_of([int(code)])[0]) if valid else -1
+        if pos < 0:
+            raise HTTPError(404, f"unknown scheme {code}")
+        start, end = _day(query.get("from"), "from"), _day(query.get("to"), "to")
+        code = int(code)
+
+        def build():
+            store = data.store
+            lo, hi = int(store.offsets[pos]), int(store.offsets[pos + 1])
+            days = store.days_at(slice(lo, hi))
+            a = int(np.searchsorted(days, nav_store.to_day(start))) if start else 0
+            b = int(np.searchsorted(days, nav_store.to_day(end), side="right")) if end else len(days)
+            dates = data.dates(days[a:b])
+            navs = np.asarray(store.navs[lo + a:lo + b]).tolist()
+            return {"SchemeCode": code, "SchemeName": data.schemes.get(code, ("",))[0],
+                    "from": start or None, "to": end or None, "count": len(dates),
+                    "fields": ["Date", "NAV"], "data": list(zip(dates, navs))}
+
+        return f"/scheme/{code}/nav?{start}:{end}", data.scheme_version(code), {code}, build
+
+    def latest(self):
+        data = self.data
+        rows = data.last_rows
+        dates = data.dates(data.store.days_at(rows))
+        return {"count": len(rows), "fields": ["SchemeCode", "Date", "NAV"],
+                "data": list(zip(data.last_codes.tolist(), dates, data.store.navs[rows].tolist()))}
+
+    def category_snapshot(self, name, query):
+        data = self.data
+        codes = data.categories.get(category_key(name))
+        if codes is None:
+            raise HTTPError(404, f"unknown category {name!r}")
+        on = _day(query.get("date"), "date") or date.today().isoformat()
+        start = _day(query.get("start"), "start")
+        try:
+            max_age = int(query["max_age"]) if query.get("max_age") else None
+        except ValueError:
+            raise HTTPError(400, "max_age must be a number of days") from None
+
+        def build():
+            store = data.store
+            navs = store.nav_on(on, codes, max_age).tolist()
+            dates = _dates(store.nav_date(on, codes, max_age))
+            fields = ["SchemeCode", *INDEX_FIELDS, "NAVDate", "NAV"]
+            columns = [codes.tolist(), *zip(*(data.schemes[c] for c in codes.tolist())), dates,
+                       [_number(x) for x in navs]]
+            if start:
+                fields.append("Return")
+                columns.append([_number(x) for x in store.returns(start, on, codes, max_age).tolist()])
+            return {"category": name, "date": on, "start": start or None, "count": len(codes),
+                    "fields": fields, "data": list(zip(*columns))}
+
+        key = f"/category/{category_key(name)}/snapshot?{on}:{start}:{max_age}"
+        return key, data.version, None, build
+
+    def stats(self):
+        return {"schemes": len(self.data.store), "rows": self.data.store.rows,
+                "version": self.data.version,
+                "loaded": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(self.data.loaded)),
+                "cache": {"entries": len(self.cache), "bytes": self.cache.bytes,
+                          "hits": self.cache.hits, "misses": self.cache.misses},
+                **self.counts}
+
+    # ---------- HTTP ----------
+    def respond(self, method, target, headers):
+        """``(status, headers, body)`` for one request."""
+        if method not in ("GET", "HEAD"):
+            raise HTTPError(405, "read-only: GET or HEAD")
+        url = urlsplit(target)
+        query = dict(parse_qsl(url.query))
+        if url.path.rstrip("/") == "/stats":
+            return 200, {}, _json(self.stats())
+
+        key, version, codes, build = self.route(url.path, query)
+        etag = '"%s"' % hashlib.blake2b(f"{key}|{version}".encode(), digest_size=12).hexdigest()
+        if etag in headers.get("if-none-match", ""):
+            return 304, {"ETag": etag}, b""
+        entry = self.cache.get(key, etag)
+        if entry is None:
+            with instrument.stage("build"):
+                entry = Entry(_json(build()), etag, codes)
+            self.cache.put(key, entry)
+        out = {"ETag": etag, "Cache-Control": "no-cache", "Vary": "Accept-Encoding"}
+        if entry.gz is not None and "gzip" in headers.get("accept-encoding", ""):
+            out["Content-Encoding"] = "gzip"
+            return 200, out, entry.gz
+        return 200, out, entry.body
+
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                try:
+                    head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), KEEPALIVE_SECONDS)
+                except asyncio.LimitOverrunError:
+                    await _send(writer, 431, {}, _json({"error": "request head too large"}), False)
+                    break
+                except (asyncio.IncompleteReadError, asyncio.TimeoutError, ConnectionError):
+                    break
+                method, target, keep_alive, headers = "GET", "/", False, {}
+                try:
+                    method, target, keep_alive, headers = _parse_head(head)
+                    status, out, body = self.respond(method, target, headers)
+                except HTTPError as e:
+                    status, out, body = e.status, {}, _json({"error": str(e)})
+                except Exception as e:  # answer, rather than drop the connection
+                    print(f"⚠️ {method} {target}: {e!r}")
+                    status, out, body = 500, {}, _json({"error": "internal error"})
+                    keep_alive = False
+                self.counts["requests"] += 1
+                self.counts[f"status_{status}"] += 1
+                await _send(writer, status, out, b"" if method == "HEAD" else body, keep_alive,
+                            len(body))
+                if not keep_alive:
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host=HOST, port=PORT, ready=None):
+        start = time.perf_counter()
+        await self.reload()
+        print(f"📊 Loaded {len(self.data.store):,} schemes, {self.data.store.rows:,} rows, "
+              f"{len(self.data.categories):,} categories in {time.perf_counter() - start:.1f}s")
+        server = await asyncio.start_server(self.handle, host, port, limit=MAX_HEAD, backlog=512)
+        host, port = server.sockets[0].getsockname()[:2]
+        print(f"🌐 Serving on http://{host}:{port}", flush=True)
+        if ready is not None:
+            ready(host, port)
+        loop = asyncio.get_running_loop()
+        if hasattr(signal, "SIGHUP"):
+            loop.add_signal_handler(signal.SIGHUP, lambda: asyncio.ensure_future(self._try_reload()))
+        watcher = asyncio.ensure_future(self._watch())
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            watcher.cancel()
+
+
+def _json(obj):
+    return json.dumps(obj, separators=(",", ":"), allow_nan=False).encode()
+
+
+def _parse_head(head):
+    """``(method, target, keep_alive, headers)``; header names lower-cased."""
+    lines = head.decode("latin-1").split("\r\n")
+    try:
+        method, target, version = lines[0].split(" ")
+    except ValueError:
+        raise HTTPError(400, "malformed request line") from None
+    headers = {}
+    for line in lines[1:]:
+        name, sep, value = line.partition(":")
+        if sep:
+            headers[name.strip().lower()] = value.strip()
+    if headers.get("content-length", "0") != "0" or "transfer-encoding" in headers:
+        raise HTTPError(400, "request bodies are not accepted")
+    connection = headers.get("connection", "").lower()
+    keep_alive = connection != "close" if version == "HTTP/1.1" else connection == "keep-alive"
+    return method, target, keep_alive, headers
+
+
+async def _send(writer, status, headers, body, keep_alive, length=None):
+    lines = [f"HTTP/1.1 {status} {REASONS.get(status, '')}"]
+    if status != 304:
+        lines.append("Content-Type: application/json; charset=utf-8")
+        lines.append(f"Content-Length: {len(body) if length is None else length}")
+    lines.extend(f"{name}: {value}" for name, value in headers.items())
+    lines.append("Connection: " + ("keep-alive" if keep_alive else "close"))
+    writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1") + body)
+    await writer.drain()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Read-only HTTP API over the NAV data")
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT, help="0 picks a free port")
+    parser.add_argument("--poll", type=float, default=POLL_SECONDS,
+                        help="Seconds between checks for updated data files")
+    parser.add_argument("--cache-mb", type=int, default=CACHE_MB, help="Response cache size")
+    parser.add_argument("--nav-dir", default=NAV_DIR, help="Per-scheme NAV history directory")
+    parser.add_argument("--index", default=INDEX_FILE, help="scheme_index.csv path")
+    parser.add_argument("--state", default=STATE_FILE, help="NAV history state index path")
+    parser.add_argument("--store", default=STORE_DIR,
+                        help="The server's own nav_store copy (not .cache/nav_store)")
+    instrument.add_arguments(parser)
+    args = parser.parse_args()
+    if not nav_store.available():
+        parser.error("numpy is required (pip install numpy)")
+    instrument.start("nav_server", args)
+
+    server = NavServer(args.nav_dir, args.index, args.state, args.store, args.cache_mb, args.poll)
+    try:
+        asyncio.run(server.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        print("👋 Stopped")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,396 @@
+"""Per-scheme state index for ``data/nav_history``.
+
+One SQLite file (``.cache/nav_state.db``, kept out of the committed tree:
+it changes on every run, and two workflows committing their own copy of
+a binary file cannot be rebased onto each other) holds, for every
+``<SchemeCode>.csv``, the last date, the number of data rows, the byte
+length covered and a CRC32 of those bytes.
+Appends go through :meth:`NavState.append`, which writes the file and moves
+the record forward together, so an incremental run only needs an
+``os.stat`` per scheme instead of re-reading history.
+
+A record whose size no longer matches the file is repaired on lookup,
+which reads the whole file.  For a grown file the recorded prefix is
+re-checksummed, then only the tail is scanned and the CRC extended over
+it; a shrunk or rewritten file is rescanned in full and every consumer's
+watermark for it is moved past the end of the file, since its byte offset
+may no longer fall on a row boundary.  A missing or older copy of the
+database (a cold CI cache) is therefore only slower, never wrong.
+
+Downstream consumers keep their own per-scheme watermark (last exported
+date and byte offset) in the same database so they can seek straight to
+the unread tail.  Fetchers park schemes whose requests kept failing in a
+retry queue so the next run tries them first, and keep each scheme's
+publishing cadence and probe back-off (``scripts/scheduler.py``).
+
+    python scripts/nav_state.py            # refresh stale records
+    python scripts/nav_state.py --verify   # recompute every checksum
+"""
+
+import argparse
+import csv
+import io
+import os
+import sqlite3
+import threading
+import zlib
+from collections import namedtuple
+from datetime import datetime
+from urllib.parse import quote
+
+import instrument
+
+NAV_DIR = "data/nav_history"
+QUARANTINE_DIR = "data/nav_quarantine"   # rows moved out by nav_validate.py --quarantine
+STATE_FILE = ".cache/nav_state.db"
+LEGACY_STATE_FILE = "data/nav_state.db"
+
+HEADER = ["Date", "NAV"]
+COMMIT_EVERY = 500
+
+Entry = namedtuple("Entry", "last_date rows size crc")
+EMPTY = Entry(None, 0, 0, 0)
+
+# Watermark offset for a rewritten file: past any file's end, which every
+# consumer already reads as "shrunk or rewritten, start over".
+REWRITTEN = 1 << 62
+
+# cadence: median trading days between NAVs, measured at file size ``size``;
+# misses: probes in a row that found nothing; next_probe: ISO date or None
+Schedule = namedtuple("Schedule", "cadence size misses next_probe")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS scheme_state (
+    scheme_code TEXT PRIMARY KEY,
+    last_date   TEXT,
+    row_count   INTEGER NOT NULL,
+    byte_size   INTEGER NOT NULL,
+    crc32       INTEGER NOT NULL,
+    updated_at  TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS watermark (
+    consumer    TEXT NOT NULL,
+    scheme_code TEXT NOT NULL,
+    last_date   TEXT,
+    byte_offset INTEGER NOT NULL,
+    PRIMARY KEY (consumer, scheme_code)
+);
+CREATE TABLE IF NOT EXISTS retry_queue (
+    consumer    TEXT NOT NULL,
+    scheme_code TEXT NOT NULL,
+    attempts    INTEGER NOT NULL,
+    last_error  TEXT,
+    updated_at  TEXT NOT NULL,
+    PRIMARY KEY (consumer, scheme_code)
+);
+CREATE TABLE IF NOT EXISTS fetch_schedule (
+    scheme_code TEXT PRIMARY KEY,
+    cadence     REAL NOT NULL,
+    byte_size   INTEGER NOT NULL,
+    misses      INTEGER NOT NULL,
+    next_probe  TEXT
+);
+"""
+
+
+def scan_bytes(data, base=EMPTY):
+    """Extend ``base`` with ``data`` appended at offset ``base.size``."""
+    rows = base.rows
+    last_date = base.last_date
+    lines = data.splitlines()
+
+    if base.size == 0 and lines and lines[0].startswith(b"Date"):
+        lines = lines[1:]
+
+    for line in lines:
+        if line.strip():
+            rows += 1
+            last_date = line.split(b",", 1)[0].decode("utf-8", "replace").strip()
+
+    return Entry(last_date, rows, base.size + len(data), zlib.crc32(data, base.crc))
+
+
+def scan_file(filepath, base=EMPTY):
+    with open(filepath, "rb") as f:
+        f.seek(base.size)
+        return scan_bytes(f.read(), base)
+
+
+def read_tail(path, offset=0):
+    """Header line and the bytes from ``offset`` (a row boundary) to EOF."""
+    with open(path, "rb") as f:
+        header = f.readline()
+        if offset > len(header):
+            f.seek(offset)
+        return header, f.read()
+
+
+def shard_by_size(nav_dir, files, shards):
+    """Split ordered ``files`` into at most ``shards`` contiguous runs of
+    roughly equal total bytes, so concatenating shard outputs in order
+    reproduces the serial output."""
+    sizes = [os.path.getsize(os.path.join(nav_dir, f)) for f in files]
+    target = (sum(sizes) or 1) / max(1, shards)
+    out, current, acc = [], [], 0
+    for fname, size in zip(files, sizes):
+        current.append(fname)
+        acc += size
+        if len(out) < shards - 1 and acc >= target * (len(out) + 1):
+            out.append(current)
+            current = []
+    if current:
+        out.append(current)
+    return out
+
+
+class NavState:
+    """Thread-safe handle on the state database; use as a context manager.
+
+    ``readonly=True`` opens the database with ``mode=ro`` for processes that
+    must never write it while the fetch scripts do: stale records are
+    repaired in memory only and nothing is committed.  A missing database
+    reads as empty.
+    """
+
+    def __init__(self, path=STATE_FILE, readonly=False):
+        self.path = path
+        self.readonly = readonly
+        self._repaired = {}   # readonly: records fixed up in memory
+        self._rewritten = set()   # readonly: watermarks reset in memory
+        if readonly:
+            if path != ":memory:" and os.path.exists(path):
+                uri = f"file:{quote(os.path.abspath(path))}?mode=ro"
+                self._db = sqlite3.connect(uri, uri=True, check_same_thread=False)
+            else:
+                self._db = sqlite3.connect(":memory:", check_same_thread=False)
+                self._db.executescript(SCHEMA)
+        else:
+            if path != ":memory:":
+                os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+                if path == STATE_FILE and not os.path.exists(path) and os.path.exists(LEGACY_STATE_FILE):
+                    os.replace(LEGACY_STATE_FILE, path)
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.executescript(SCHEMA)
+        self._lock = threading.RLock()
+        self._pending = 0
+
+    # ---------- SCHEME STATE ----------
+    def get(self, code):
+        with self._lock:
+            if code in self._repaired:
+                return self._repaired[code]
+            row = self._db.execute(
+                "SELECT last_date, row_count, byte_size, crc32 "
+                "FROM scheme_state WHERE scheme_code = ?", (code,)
+            ).fetchone()
+        return Entry(*row) if row else None
+
+    def _put(self, code, entry):
+        with self._lock:
+            if self.readonly:
+                self._repaired[code] = entry
+                return
+            self._db.execute(
+                "INSERT OR REPLACE INTO scheme_state VALUES (?, ?, ?, ?, ?, ?)",
+                (code, entry.last_date, entry.rows, entry.size, entry.crc,
+                 datetime.now().isoformat(timespec="seconds")),
+            )
+            self._pending += 1
+            if self._pending >= COMMIT_EVERY:
+                self.commit()
+
+    def lookup(self, code, filepath):
+        """Current state of ``filepath``, repairing the record if stale."""
+        with self._lock:
+            entry = self.get(code)
+            try:
+                size = os.path.getsize(filepath)
+            except OSError:
+                if entry is not None and entry != EMPTY:
+                    self._put(code, EMPTY)
+                return EMPTY
+
+            if entry is not None and entry.size == size:
+                return entry
+
+            with open(filepath, "rb") as f:
+                data = f.read()
+            if (entry is not None and 0 < entry.size < size
+                    and zlib.crc32(data[:entry.size]) == entry.crc):
+                fresh = scan_bytes(data[entry.size:], entry)
+            else:
+                fresh = scan_bytes(data)
+                if entry is not None and entry.size:
+                    self.reset_watermarks(code)
+            self._put(code, fresh)
+            return fresh
+
+    def last_date(self, code, filepath):
+        return self.lookup(code, filepath).last_date
+
+    def append(self, code, filepath, rows):
+        """Append ``(Date, NAV)`` rows and advance the record atomically."""
+        with self._lock:
+            entry = self.lookup(code, filepath)
+
+            buf = io.StringIO()
+            writer = csv.writer(buf)
+            if entry.size == 0:
+                writer.writerow(HEADER)
+            writer.writerows(rows)
+            data = buf.getvalue().encode("utf-8")
+
+            with open(filepath, "ab") as f:
+                f.write(data)
+            instrument.count("rows_written", len(rows))
+            instrument.count("bytes_written", len(data))
+
+            entry = scan_bytes(data, entry)
+            self._put(code, entry)
+            return entry
+
+    def verify(self, code, filepath):
+        """True if the recorded checksum matches the file on disk."""
+        entry = self.get(code)
+        if entry is None or not os.path.exists(filepath):
+            return entry is None
+        return scan_file(filepath) == entry
+
+    # ---------- CONSUMER WATERMARKS ----------
+    def watermark(self, consumer, code):
+        with self._lock:
+            row = self._db.execute(
+                "SELECT last_date, byte_offset FROM watermark "
+                "WHERE consumer = ? AND scheme_code = ?", (consumer, code)
+            ).fetchone()
+        if row and code in self._rewritten:
+            return row[0], REWRITTEN
+        return row if row else (None, 0)
+
+    def set_watermark(self, consumer, code, last_date, byte_offset):
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO watermark VALUES (?, ?, ?, ?)",
+                (consumer, code, last_date, byte_offset),
+            )
+            self._pending += 1
+            if self._pending >= COMMIT_EVERY:
+                self.commit()
+
+    def watermark_count(self, consumer):
+        with self._lock:
+            return self._db.execute(
+                "SELECT COUNT(*) FROM watermark WHERE consumer = ?", (consumer,)
+            ).fetchone()[0]
+
+    def clear_watermarks(self, consumer):
+        with self._lock:
+            self._db.execute("DELETE FROM watermark WHERE consumer = ?", (consumer,))
+
+    def reset_watermarks(self, code):
+        """Move every consumer's watermark for ``code`` to :data:`REWRITTEN`:
+        its byte offset may no longer fall on a row boundary."""
+        with self._lock:
+            if self.readonly:
+                self._rewritten.add(code)
+                return
+            self._db.execute(
+                "UPDATE watermark SET byte_offset = ? WHERE scheme_code = ?",
+                (REWRITTEN, code),
+            )
+
+    # ---------- RETRY QUEUE ----------
+    def queue_retry(self, consumer, code, error):
+        with self._lock:
+            self._db.execute(
+                "INSERT INTO retry_queue VALUES (?, ?, 1, ?, ?) "
+                "ON CONFLICT (consumer, scheme_code) DO UPDATE SET "
+                "attempts = attempts + 1, last_error = excluded.last_error, "
+                "updated_at = excluded.updated_at",
+                (consumer, code, error, datetime.now().isoformat(timespec="seconds")),
+            )
+
+    def clear_retry(self, consumer, code):
+        with self._lock:
+            self._db.execute(
+                "DELETE FROM retry_queue WHERE consumer = ? AND scheme_code = ?",
+                (consumer, code),
+            )
+
+    def retry_queue(self, consumer):
+        """``{scheme_code: attempts}`` left over from earlier runs."""
+        with self._lock:
+            return dict(self._db.execute(
+                "SELECT scheme_code, attempts FROM retry_queue WHERE consumer = ?",
+                (consumer,),
+            ).fetchall())
+
+    # ---------- FETCH SCHEDULE ----------
+    def schedules(self):
+        """``{scheme_code: Schedule}`` for every scheme with one."""
+        with self._lock:
+            return {row[0]: Schedule(*row[1:]) for row in self._db.execute(
+                "SELECT scheme_code, cadence, byte_size, misses, next_probe FROM fetch_schedule"
+            )}
+
+    def set_schedule(self, code, schedule):
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO fetch_schedule VALUES (?, ?, ?, ?, ?)",
+                (code, *schedule),
+            )
+            self._pending += 1
+            if self._pending >= COMMIT_EVERY:
+                self.commit()
+
+    # ---------- LIFECYCLE ----------
+    def commit(self):
+        with self._lock:
+            self._db.commit()
+            self._pending = 0
+
+    def close(self):
+        with self._lock:
+            self._db.commit()
+            self._db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Refresh or verify the NAV history state index")
+    parser.add_argument("--verify", action="store_true", help="Recompute every checksum and report mismatches")
+    parser.add_argument("--state", default=STATE_FILE, help="State database path")
+
+    args = parser.parse_args()
+
+    scheme_files = sorted(
+        f for f in os.listdir(NAV_DIR) if f.endswith(".csv")
+    )
+    print(f"📊 Schemes detected: {len(scheme_files)}")
+
+    bad = 0
+    with NavState(args.state) as state:
+        for fname in scheme_files:
+            code = os.path.splitext(fname)[0]
+            path = os.path.join(NAV_DIR, fname)
+            if args.verify and not state.verify(code, path):
+                bad += 1
+                print(f"🔴 {code} → checksum mismatch, rescanning")
+                state.reset_watermarks(code)
+                state._put(code, scan_file(path))
+            else:
+                state.lookup(code, path)
+
+    if args.verify:
+        print(f"✅ Verified {len(scheme_files)} schemes, {bad} repaired")
+    else:
+        print(f"✅ State index up to date → {args.state}")
+
+
+if __name__ == "__main__":
+    main()
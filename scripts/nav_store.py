@@ -0,0 +1,435 @@
+"""In-memory NAV history for analytics, cached as memory-mapped ``.npy``.
+
+All of ``data/nav_history`` goes into four flat arrays:
+
+* ``codes``   int64, sorted scheme codes, one per scheme
+* ``offsets`` int64, ``len(codes) + 1``; scheme ``i`` owns rows
+  ``offsets[i]:offsets[i + 1]``
+* ``keys``    int64 ``i << 32 | day`` (days since 1970-01-01, biased to
+  stay positive), sorted within each scheme, so the whole array is sorted
+  and one ``searchsorted`` finds a date for every scheme at once; a
+  repeated date keeps the last row
+* ``navs``    float64
+
+They are saved under ``.cache/nav_store/`` and opened with
+``mmap_mode="r"``, so loading is a few page maps rather than a CSV scan.
+:func:`refresh` brings the cache up to date using the state index: a
+scheme whose file only grew is extended by parsing just the new tail, a
+rewritten one is parsed again, and untouched schemes are copied across.
+
+Queries run over every scheme at once::
+
+    store = nav_store.open_store()
+    store.nav_on("2025-01-31")                  # forward-filled NAV per scheme
+    store.returns("2024-01-31", "2025-01-31")   # simple return per scheme
+    store.snapshot("2025-01-31", category="Equity", start="2024-01-31")
+
+Requires ``numpy``; :meth:`NavStore.snapshot` also needs ``pandas``.
+
+    python scripts/nav_store.py refresh
+    python scripts/nav_store.py nav 2025-01-31 119551 120503
+    python scripts/nav_store.py snapshot 2025-01-31 --category Equity --start 2024-01-31
+"""
+
+import argparse
+import json
+import os
+import shutil
+import time
+import zlib
+
+try:
+    import numpy as np
+except ImportError:  # optional dependency
+    np = None
+
+try:
+    import pandas as pd
+except ImportError:  # optional dependency
+    pd = None
+
+import nav_reader
+import nav_state
+
+NAV_DIR = nav_state.NAV_DIR
+STATE_FILE = nav_state.STATE_FILE
+STORE_DIR = ".cache/nav_store"
+CONSUMER = "nav_store"   # watermark: byte size of each file the store was synced at
+INDEX_FILE = "data/scheme_index.csv"
+
+ARRAYS = ("codes", "offsets", "keys", "navs")
+MANIFEST = "manifest.json"
+FORMAT = 1
+
+_DAY_BIAS = 1 << 31   # keeps (scheme << 32 | day) keys positive for any int32 day
+_DAY_MASK = (1 << 32) - 1
+
+
+def available():
+    return np is not None
+
+
+def to_day(value):
+    """Days since 1970-01-01 for an ISO string, ``date`` or ``datetime64``."""
+    return int(np.datetime64(value, "D").astype(np.int64))
+
+
+def to_days(value):
+    """:func:`to_day` for a scalar or an array (integers are taken as days)."""
+    arr = np.asarray(value)
+    if arr.dtype.kind in "iu":
+        return arr.astype(np.int64)
+    return arr.astype("datetime64[D]").astype(np.int64)
+
+
+# ---------- PARSING ----------
+def parse_bytes(header, data):
+    """``(days int32, navs float64)`` for the rows the exporters keep."""
+    dates, navs = [], []
+    for date_str, nav in nav_reader.parse_bytes(header, data):
+        if not date_str or not nav:
+            continue
+        d = nav_reader.iso_date(date_str)
+        if d is None:
+            continue
+        dates.append(d)
+        navs.append(nav)
+    try:
+        values = np.array(navs, dtype=np.float64)
+    except ValueError:
+        keep = []
+        for i, nav in enumerate(navs):
+            try:
+                float(nav)
+            except ValueError:
+                continue
+            keep.append(i)
+        dates = [dates[i] for i in keep]
+        values = np.array([navs[i] for i in keep], dtype=np.float64)
+    days = np.array(dates, dtype="datetime64[D]").astype(np.int32)
+    return days, values
+
+
+def _normalise(days, navs):
+    """Sort by date; a repeated date keeps its last row."""
+    if len(days) < 2 or bool(np.all(days[1:] > days[:-1])):
+        return days, navs
+    order = np.argsort(days, kind="stable")
+    days, navs = days[order], navs[order]
+    keep = np.ones(len(days), dtype=bool)
+    keep[:-1] = days[:-1] != days[1:]
+    return days[keep], navs[keep]
+
+
+def _prefix_crc(path, size):
+    crc = 0
+    with open(path, "rb") as f:
+        remaining = size
+        while remaining:
+            chunk = f.read(min(remaining, 1 << 20))
+            if not chunk:
+                break
+            crc = zlib.crc32(chunk, crc)
+            remaining -= len(chunk)
+    return crc
+
+
+# ---------- STORE ----------
+class NavStore:
+    """Flat NAV arrays for every scheme; see the module docstring."""
+
+    def __init__(self, codes, offsets, keys, navs, files=None):
+        self.codes = codes
+        self.offsets = offsets
+        self.keys = keys
+        self.navs = navs
+        self.files = files or {}   # code → [byte_size, crc32] of the parsed file
+
+    @classmethod
+    def from_days(cls, codes, offsets, days, navs, files=None):
+        seg = np.repeat(np.arange(len(codes), dtype=np.int64), np.diff(offsets))
+        keys = (seg << 32) | (days.astype(np.int64) + _DAY_BIAS)
+        return cls(codes, offsets, keys, navs, files)
+
+    @classmethod
+    def load(cls, store_dir=STORE_DIR, mmap=True):
+        """Open a saved store; ``None`` if it is missing or unreadable."""
+        try:
+            with open(os.path.join(store_dir, MANIFEST), encoding="utf-8") as f:
+                manifest = json.load(f)
+            if manifest.get("format") != FORMAT:
+                return None
+            mode = "r" if mmap else None
+            arrays = [np.load(os.path.join(store_dir, f"{name}.npy"), mmap_mode=mode)
+                      for name in ARRAYS]
+        except (OSError, ValueError):
+            return None
+        return cls(*arrays, files=manifest.get("files"))
+
+    def save(self, store_dir=STORE_DIR):
+        """Write to a sibling directory and swap it in, so readers never
+        see a half-written store."""
+        tmp = store_dir + ".tmp"
+        shutil.rmtree(tmp, ignore_errors=True)
+        os.makedirs(tmp)
+        for name in ARRAYS:
+            np.save(os.path.join(tmp, f"{name}.npy"), getattr(self, name))
+        with open(os.path.join(tmp, MANIFEST), "w", encoding="utf-8") as f:
+            json.dump({"format": FORMAT, "files": self.files}, f)
+        old = store_dir + ".old"
+        shutil.rmtree(old, ignore_errors=True)
+        if os.path.exists(store_dir):
+            os.replace(store_dir, old)
+        os.replace(tmp, store_dir)
+        shutil.rmtree(old, ignore_errors=True)
+
+    def __len__(self):
+        return len(self.codes)
+
+    @property
+    def rows(self):
+        return int(self.offsets[-1])
+
+    # ---------- LOOKUPS ----------
+    def index_of(self, codes):
+        """Positions of ``codes`` in :attr:`codes` (``-1`` where absent)."""
+        codes = np.asarray(codes, dtype=np.int64)
+        pos = np.searchsorted(self.codes, codes)
+        pos = np.minimum(pos, max(len(self.codes) - 1, 0))
+        found = (len(self.codes) > 0) & (self.codes[pos] == codes)
+        return np.where(found, pos, -1)
+
+    def days_at(self, rows):
+        """Days since 1970-01-01 (int32) of ``rows`` (an index or slice)."""
+        return ((self.keys[rows] & _DAY_MASK) - _DAY_BIAS).astype(np.int32)
+
+    def series(self, code):
+        """``(dates datetime64[D], navs)`` for one scheme (empty if unknown)."""
+        i = int(self.index_of([int(code)])[0])
+        if i < 0:
+            return np.array([], dtype="datetime64[D]"), np.array([], dtype=np.float64)
+        rows = slice(self.offsets[i], self.offsets[i + 1])
+        return self.days_at(rows).astype("datetime64[D]"), np.asarray(self.navs[rows])
+
+    def locate(self, date, codes=None, max_age=None):
+        """Row of the last NAV on or before ``date`` per scheme (``-1`` if none).
+
+        ``date`` is one date or one per scheme; ``codes`` limits and orders
+        the result (default: every scheme); ``max_age`` in days drops NAVs
+        older than that.
+        """
+        pos = np.arange(len(self.codes)) if codes is None else self.index_of(codes)
+        day = to_days(date)
+        safe = np.maximum(pos, 0).astype(np.int64)
+        target = (safe << 32) | (day + _DAY_BIAS)
+        row = np.searchsorted(self.keys, target, side="right") - 1
+        ok = (pos >= 0) & (row >= self.offsets[safe])
+        if max_age is not None:
+            ok &= day - self.days_at(np.maximum(row, 0)) <= max_age
+        return np.where(ok, row, -1)
+
+    # ---------- QUERIES ----------
+    def nav_on(self, date, codes=None, max_age=None):
+        """Forward-filled NAV on ``date`` per scheme (NaN if none yet)."""
+        row = self.locate(date, codes, max_age)
+        return np.where(row >= 0, self.navs[np.maximum(row, 0)], np.nan)
+
+    def nav_date(self, date, codes=None, max_age=None):
+        """Date of the NAV :meth:`nav_on` picked (NaT if none)."""
+        row = self.locate(date, codes, max_age)
+        days = self.days_at(np.maximum(row, 0)).astype("datetime64[D]")
+        return np.where(row >= 0, days, np.datetime64("NaT"))
+
+    def returns(self, start, end, codes=None, max_age=None, annualize=False):
+        """Return from ``start`` to ``end`` per scheme (NaN if either NAV is
+        missing); ``annualize`` gives CAGR over the calendar window."""
+        first = self.nav_on(start, codes, max_age)
+        last = self.nav_on(end, codes, max_age)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            ratio = np.where(first > 0, last / first, np.nan)
+            if annualize:
+                years = (to_days(end) - to_days(start)) / 365.25
+                return np.where(years > 0, ratio ** (1 / years) - 1, np.nan)
+            return ratio - 1
+
+    def trailing_returns(self, end, windows, codes=None, max_age=None):
+        """``{label: returns}`` for ``windows`` given as ``{label: days}``."""
+        end_day = to_day(end)
+        return {
+            label: self.returns(np.datetime64(end_day - days, "D"), end, codes, max_age)
+            for label, days in windows.items()
+        }
+
+    def snapshot(self, date, category=None, sub_category=None, start=None,
+                 max_age=None, index_file=INDEX_FILE):
+        """Cross-section on ``date`` joined with ``scheme_index.csv``.
+
+        One row per indexed scheme with ``NAV`` / ``NAVDate`` (and
+        ``Return`` since ``start`` when given), filtered by category.
+        """
+        if pd is None:
+            raise RuntimeError("snapshot requires pandas")
+        index = pd.read_csv(index_file, dtype=str, keep_default_na=False)
+        if category is not None:
+            index = index[index["Category"] == category]
+        if sub_category is not None:
+            index = index[index["SubCategory"] == sub_category]
+        index = index[index["SchemeCode"].str.isdigit()]
+        codes = index["SchemeCode"].astype(np.int64).to_numpy()
+
+        frame = index[["SchemeCode", "AMC", "SchemeName", "Category", "SubCategory"]].copy()
+        frame["NAV"] = self.nav_on(date, codes, max_age)
+        frame["NAVDate"] = self.nav_date(date, codes, max_age)
+        if start is not None:
+            frame["Return"] = self.returns(start, date, codes, max_age)
+        return frame.reset_index(drop=True)
+
+
+# ---------- BUILD / REFRESH ----------
+def refresh(state, nav_dir=NAV_DIR, store_dir=STORE_DIR, rebuild=False, consumer=CONSUMER):
+    """Bring the saved store in line with ``nav_dir``; returns
+    ``(store, stats)`` where ``stats`` counts kept/extended/parsed/dropped.
+
+    A scheme whose file grew is extended from the stored size when the
+    ``consumer`` watermark says the store was synced at that size (the
+    state index resets it if the file is rewritten); otherwise the prefix
+    is compared first.  Another store directory needs its own ``consumer``,
+    or ``None`` (always compare, e.g. with a read-only state index).
+    """
+    old = None if rebuild else NavStore.load(store_dir, mmap=True)
+    old_files = old.files if old is not None else {}
+
+    scheme_files = sorted(
+        (int(os.path.splitext(f)[0]), f) for f in os.listdir(nav_dir)
+        if f.endswith(".csv") and os.path.splitext(f)[0].isdigit()
+    )
+
+    stats = dict(kept=0, extended=0, parsed=0, dropped=0)
+    parts_days, parts_navs, codes, counts, files, marks = [], [], [], [], {}, []
+    for code, fname in scheme_files:
+        key = str(code)
+        path = os.path.join(nav_dir, fname)
+        entry = state.lookup(key, path)
+        before = old_files.get(key)
+
+        i = int(old.index_of([code])[0]) if before is not None else -1
+        if i >= 0:
+            lo, hi = int(old.offsets[i]), int(old.offsets[i + 1])
+            old_days, old_navs = old.days_at(slice(lo, hi)), old.navs[lo:hi]
+
+        if i >= 0 and before == [entry.size, entry.crc]:
+            days, navs = old_days, old_navs
+            stats["kept"] += 1
+        elif i >= 0 and 0 < before[0] < entry.size and (
+                (consumer is not None and state.watermark(consumer, key)[1] == before[0])
+                or _prefix_crc(path, before[0]) == before[1]):
+            tail_days, tail_navs = parse_bytes(*nav_state.read_tail(path, before[0]))
+            days, navs = _normalise(np.concatenate([old_days, tail_days]),
+                                    np.concatenate([old_navs, tail_navs]))
+            stats["extended"] += 1
+        else:
+            days, navs = _normalise(*parse_bytes(*nav_state.read_tail(path)))
+            stats["parsed"] += 1
+
+        codes.append(code)
+        counts.append(len(days))
+        parts_days.append(days)
+        parts_navs.append(navs)
+        files[key] = [entry.size, entry.crc]
+        marks.append((key, entry.last_date, entry.size))
+    state.commit()
+    stats["dropped"] = len(set(old_files) - set(files))
+
+    offsets = np.zeros(len(codes) + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+    store = NavStore.from_days(
+        np.array(codes, dtype=np.int64),
+        offsets,
+        np.concatenate(parts_days).astype(np.int32) if parts_days else np.array([], np.int32),
+        np.concatenate(parts_navs).astype(np.float64) if parts_navs else np.array([], np.float64),
+        files,
+    )
+    if old is None or stats["extended"] or stats["parsed"] or stats["dropped"]:
+        store.save(store_dir)
+    if consumer is not None:
+        for key, last_date, size in marks:
+            state.set_watermark(consumer, key, last_date, size)
+        state.commit()
+    return store, stats
+
+
+def open_store(nav_dir=NAV_DIR, store_dir=STORE_DIR, state_file=STATE_FILE, refresh_cache=True):
+    """The saved store, refreshed against ``nav_dir`` unless ``refresh_cache``
+    is false (then it is loaded as-is, or built if missing)."""
+    if not available():
+        raise RuntimeError("nav_store requires numpy")
+    if not refresh_cache:
+        store = NavStore.load(store_dir)
+        if store is not None:
+            return store
+    with nav_state.NavState(state_file) as state:
+        store, _ = refresh(state, nav_dir, store_dir)
+    return NavStore.load(store_dir) or store
+
+
+def _print_frame(frame, limit):
+    with pd.option_context("display.width", 200, "display.max_columns", None):
+        print(frame.head(limit).to_string(index=False))
+    if len(frame) > limit:
+        print(f"… {len(frame) - limit:,} more")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Memory-mapped NAV query store")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("refresh", help="Update .cache/nav_store from data/nav_history")
+    sub.add_parser("rebuild", help="Rebuild .cache/nav_store from scratch")
+    p_nav = sub.add_parser("nav", help="Forward-filled NAV on a date")
+    p_nav.add_argument("date")
+    p_nav.add_argument("codes", nargs="*", type=int)
+    p_snap = sub.add_parser("snapshot", help="Cross-section on a date by category")
+    p_snap.add_argument("date")
+    p_snap.add_argument("--category")
+    p_snap.add_argument("--sub-category")
+    p_snap.add_argument("--start", help="Add the return since this date")
+    p_snap.add_argument("--limit", type=int, default=20)
+    for p in (p_nav, p_snap):
+        p.add_argument("--max-age", type=int, help="Ignore NAVs older than this many days")
+    parser.add_argument("--store", default=STORE_DIR, help="Store directory")
+    parser.add_argument("--state", default=STATE_FILE, help="NAV history state index path")
+
+    args = parser.parse_args()
+
+    if not available():
+        parser.error("numpy is required (pip install numpy)")
+
+    if args.command in ("refresh", "rebuild"):
+        start = time.perf_counter()
+        with nav_state.NavState(args.state) as state:
+            store, stats = refresh(state, store_dir=args.store, rebuild=args.command == "rebuild")
+        print(f"✅ {len(store):,} schemes, {store.rows:,} rows in {time.perf_counter() - start:.1f}s "
+              f"(kept {stats['kept']:,}, extended {stats['extended']:,}, "
+              f"parsed {stats['parsed']:,}, dropped {stats['dropped']:,})")
+        return
+
+    store = open_store(store_dir=args.store, state_file=args.state)
+    start = time.perf_counter()
+    if args.command == "nav":
+        codes = args.codes or None
+        navs = store.nav_on(args.date, codes, args.max_age)
+        dates = store.nav_date(args.date, codes, args.max_age)
+        elapsed = time.perf_counter() - start
+        shown = args.codes or store.codes[:20].tolist()
+        for code, nav, d in zip(shown, navs, dates):
+            print(f"{code}\t{d}\t{nav:.5f}")
+        print(f"\n⏱️ {len(navs):,} schemes in {elapsed * 1000:.1f} ms")
+    else:
+        frame = store.snapshot(args.date, args.category, args.sub_category,
+                               args.start, args.max_age)
+        elapsed = time.perf_counter() - start
+        _print_frame(frame, args.limit)
+        print(f"\n⏱️ {len(frame):,} schemes in {elapsed * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
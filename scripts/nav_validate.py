@@ -0,0 +1,459 @@
+"""Data-quality checks for ``data/nav_history``.
+
+Every row written since the last run (past each scheme's ``nav_validate``
+watermark in the state index; every row with ``--full`` or on the first
+run) is checked, files packed into batches of about ``BATCH_BYTES`` and
+each batch parsed as one NumPy byte array, so memory stays bounded.
+
+Errors (the row is wrong; ``--quarantine`` moves it out of the file):
+
+* ``bad_date``        does not start with a valid ``YYYY-MM-DD,``
+* ``future_date``     later than tomorrow
+* ``non_numeric``     NAV is not a plain decimal number
+* ``negative``        NAV is below zero
+* ``duplicate_date``  same date as the row before
+* ``out_of_order``    earlier than a date already seen in the file
+
+Warnings (reported, never moved):
+
+* ``bad_header``      first line is not ``Date,NAV``
+* ``zero_nav``        NAV is exactly zero: mfapi publishes 0 for days some
+  schemes had no price, so the row is genuine but is not a price
+  (see :func:`priced`); jumps are measured across it
+* ``jump``            NAV changed by more than ``MAX_JUMP``× from the row before
+* ``gap``             more than ``GAP_DAYS`` trading days (and ``GAP_FACTOR``
+  times the scheme's usual spacing) missing; trading days come from
+  ``scheduler.Calendar`` learned on the current schemes
+
+The report (``--report``, default ``.cache/validate/anomalies.csv``) has one
+line per run of consecutive rows with the same problem in a scheme.
+Quarantined rows are appended to ``data/nav_quarantine/<SchemeCode>.csv``
+with their row number and check, and the history file is rewritten
+without them; the fetchers skip those dates from then on.  Quarantine is
+a manual step: the CSV exports only add rows, so they need a ``--rebuild``
+afterwards.  Exits 1 when the rows checked hold errors that were not
+quarantined, which fails the pipeline step and blocks the exports after it.
+
+    python scripts/nav_validate.py                  # rows added since the last run
+    python scripts/nav_validate.py --full           # the whole history
+    python scripts/nav_validate.py --quarantine     # move bad rows out
+"""
+
+import argparse
+import contextlib
+import csv
+import os
+import sys
+from collections import Counter
+from datetime import date, timedelta
+
+import numpy as np
+
+import instrument
+import nav_reader
+import nav_state
+import scheduler
+
+NAV_DIR = nav_state.NAV_DIR
+STATE_FILE = nav_state.STATE_FILE
+QUARANTINE_DIR = nav_state.QUARANTINE_DIR
+REPORT_FILE = ".cache/validate/anomalies.csv"
+CONSUMER = "nav_validate"
+
+BATCH_BYTES = 1024 * 1024     # history bytes parsed per NumPy batch
+CONTEXT_BYTES = 1024            # rows before the watermark re-read for sequence checks
+MAX_NAV_WIDTH = 24              # longer NAV fields are non_numeric
+MAX_JUMP = 1.5                  # day-over-day NAV ratio (or its inverse) that is flagged
+GAP_DAYS = 5                    # missing trading days before a gap is flagged ...
+GAP_FACTOR = 5                  # ... and this many times the scheme's median spacing
+
+ERRORS = ("bad_date", "future_date", "non_numeric", "negative",
+          "duplicate_date", "out_of_order")
+WARNINGS = ("bad_header", "zero_nav", "jump", "gap")
+REPORT_FIELDS = ["SchemeCode", "Check", "Rows", "FirstRow", "LastRow",
+                 "FirstDate", "LastDate", "Detail"]
+QUARANTINE_FIELDS = ["Row", "Check", "Line"]
+
+
+# ---------- PARSE ----------
+def _columns(buf, starts, width):
+    """The ``width`` bytes from each of ``starts`` as a ``(rows, width)``
+    array (zeros past the end of ``buf``)."""
+    padded = np.concatenate((buf, np.zeros(width, np.uint8)))
+    return padded[starts[:, None] + np.arange(width)]
+
+
+def parse_rows(buf, starts, lengths):
+    """``(days datetime64[D], date_ok, nav float64, numeric)`` for the
+    ``YYYY-MM-DD,<nav>`` rows of ``lengths`` bytes at ``starts`` in ``buf``.
+
+    A batch has only a few hundred distinct dates, so each is checked once
+    with ``nav_reader.iso_date`` (the exporters' rule; only the canonical
+    form passes).  A NAV is numeric when it is digits with at most one dot
+    and a leading minus sign; NumPy converts those fields to the same
+    values as ``float()``.
+    """
+    head = _columns(buf, starts, 11)
+    dates, inverse = np.unique(np.ascontiguousarray(head[:, :10]).view("S10").ravel(),
+                               return_inverse=True)
+    text = [d.decode("latin-1") for d in dates]
+    valid = np.array([nav_reader.iso_date(t) == t for t in text], bool)
+    date_days = np.array([t if ok else "1970-01-01" for t, ok in zip(text, valid)], "datetime64[D]")
+    date_ok = valid[inverse] & (lengths >= 11) & (head[:, 10] == ord(","))
+    days = np.where(date_ok, date_days[inverse], np.datetime64(0, "D"))
+
+    width = lengths - 11
+    field = _columns(buf, starts + 11, MAX_NAV_WIDTH)
+    inside = np.arange(MAX_NAV_WIDTH) < width[:, None]
+    field[~inside] = 0
+    digit = (field >= ord("0")) & (field <= ord("9"))
+    dot = field == ord(".")
+    sign = np.zeros_like(inside)
+    sign[:, 0] = field[:, 0] == ord("-")
+    numeric = ((width > 0) & (width <= MAX_NAV_WIDTH)
+               & ((digit | dot | sign) == inside).all(axis=1)
+               & (dot.sum(axis=1) <= 1) & digit.any(axis=1))
+    nav = np.zeros(len(starts))
+    nav[numeric] = field[numeric].view(f"S{MAX_NAV_WIDTH}").ravel().astype(np.float64)
+    return days, date_ok, nav, numeric
+
+
+# ---------- CHECK ----------
+def priced(navs):
+    """Mask of the NAVs that are prices: the ``zero_nav`` rows and the
+    ``negative`` errors are not, and metrics must leave them out."""
+    return navs > 0
+
+
+class Part:
+    """Bytes of one file in a batch: ``data`` read from ``offset``;
+    rows before ``first_new`` (a byte offset) are context only."""
+    __slots__ = ("code", "path", "offset", "data", "first_new", "row_base")
+
+    def __init__(self, code, path, offset, data, first_new, row_base):
+        self.code, self.path, self.offset, self.data = code, path, offset, data
+        self.first_new, self.row_base = first_new, row_base
+
+
+def check_batch(parts, calendar, today):
+    """Anomalies in ``parts`` as ``(part, row, start, end, check, date, detail)``
+    where ``row`` is the data row number and ``start:end`` its bytes."""
+    chunks, bases = [], []
+    pos = 0
+    for part in parts:
+        data = part.data if part.data.endswith(b"\n") else part.data + b"\n"
+        chunks.append(data)
+        bases.append(pos)
+        pos += len(data)
+    buf = np.frombuffer(b"".join(chunks), dtype=np.uint8)
+    bases = np.array(bases, dtype=np.int64)
+    if not len(buf):
+        return []
+
+    ends = np.flatnonzero(buf == 10)
+    starts = np.concatenate(([0], ends[:-1] + 1))
+    cr = (ends > starts) & (buf[np.maximum(ends - 1, 0)] == 13)
+    stops = ends - cr
+    fid = np.searchsorted(bases, starts, side="right") - 1
+    in_file = starts - bases[fid] + np.array([p.offset for p in parts])[fid]
+
+    header = (in_file == 0)
+    blank = stops == starts
+    rows = ~header & ~blank
+    out = []
+
+    for i in np.flatnonzero(header & (_first_new(parts)[fid] == 0)):
+        line = bytes(buf[starts[i]:stops[i]])
+        if line != b"Date,NAV":
+            out.append((parts[fid[i]], 0, int(in_file[i]), int(in_file[i] + ends[i] - starts[i] + 1),
+                        "bad_header", "", line[:40].decode("utf-8", "replace")))
+
+    idx = np.flatnonzero(rows)
+    if not len(idx):
+        return out
+    f = fid[idx]
+    lengths = stops[idx] - starts[idx]
+    days, date_ok, navs, numeric = parse_rows(buf, starts[idx], lengths)
+
+    # Data row number within the file (1 = first row after the header).
+    first_of_file = np.searchsorted(f, np.arange(len(parts)))
+    rowno = np.arange(len(idx)) - first_of_file[f] + np.array([p.row_base for p in parts])[f] + 1
+    new = in_file[idx] >= _first_new(parts)[f]
+
+    # problem: 0 for a good row, else 1 + index into ERRORS
+    limit = np.datetime64(today + timedelta(days=1), "D")
+    problem = np.zeros(len(idx), np.int8)
+    problem[~date_ok] = 1 + ERRORS.index("bad_date")
+    problem[date_ok & (days > limit)] = 1 + ERRORS.index("future_date")
+    dated = problem == 0
+    problem[dated & ~numeric] = 1 + ERRORS.index("non_numeric")
+    problem[dated & numeric & (navs < 0)] = 1 + ERRORS.index("negative")
+    zero = dated & numeric & (navs == 0)
+
+    # Order checks over rows with a usable date, per file (file id in the key).
+    d = np.flatnonzero(dated)
+    if len(d):
+        key = f[d].astype(np.int64) * 10 ** 7 + days[d].astype(np.int64)
+        seen = np.maximum.accumulate(key)
+        prev = np.concatenate(([-1], seen[:-1]))
+        same_file = np.concatenate(([False], f[d][1:] == f[d][:-1]))
+        dup = same_file & (key == prev)
+        back = same_file & (key < prev)
+        free = problem[d] == 0
+        problem[d[dup & free]] = 1 + ERRORS.index("duplicate_date")
+        problem[d[back & free]] = 1 + ERRORS.index("out_of_order")
+
+    # Gaps between consecutive good rows of a file, jumps between priced ones.
+    zero &= problem == 0
+    jump = np.zeros(len(idx), bool)
+    gap = np.zeros(len(idx), np.int64)
+    ratios = np.ones(len(idx))
+    g = np.flatnonzero(problem == 0)
+    if len(g) > 1:
+        pair = f[g][1:] == f[g][:-1]
+        cur, before = g[1:][pair], g[:-1][pair]
+        spacing = calendar.count_many(days[before], days[cur])
+        median = _median_by(f[cur], spacing, len(parts))
+        missing = spacing - 1
+        gap[cur] = np.where((missing > GAP_DAYS) & (spacing > GAP_FACTOR * median[f[cur]]),
+                            missing, 0)
+    g = g[~zero[g]]
+    if len(g) > 1:
+        pair = f[g][1:] == f[g][:-1]
+        cur, before = g[1:][pair], g[:-1][pair]
+        ratio = navs[cur] / navs[before]
+        jump[cur] = (ratio > MAX_JUMP) | (ratio < 1 / MAX_JUMP)
+        ratios[cur] = ratio
+
+    hits = np.flatnonzero(new & ((problem > 0) | zero | jump | (gap > 0)))
+    text = np.datetime_as_string(days[hits])
+    for i, when in zip(hits.tolist(), text.tolist()):
+        part = parts[f[i]]
+        a = int(in_file[idx[i]])
+        b = a + int(ends[idx[i]] - starts[idx[i]]) + 1
+        when = when if date_ok[i] else ""
+        if problem[i]:
+            field = bytes(buf[starts[idx[i]]:stops[idx[i]]]).decode("utf-8", "replace")
+            out.append((part, int(rowno[i]), a, b, ERRORS[problem[i] - 1], when, field[:40]))
+            continue
+        if zero[i]:
+            out.append((part, int(rowno[i]), a, b, "zero_nav", when, ""))
+        if jump[i]:
+            out.append((part, int(rowno[i]), a, b, "jump", when, f"×{ratios[i]:.3g}"))
+        if gap[i]:
+            out.append((part, int(rowno[i]), a, b, "gap", when, f"{gap[i]} trading days missing"))
+    return out
+
+
+def _first_new(parts):
+    return np.array([p.first_new for p in parts], dtype=np.int64)
+
+
+def _median_by(groups, values, n):
+    """Median of ``values`` per group id (``groups`` ascending), 1 where empty."""
+    out = np.ones(n)
+    if not len(values):
+        return out
+    # groups is sorted already, so sorting group-major keys keeps each group in place.
+    scale = int(values.max()) + 1
+    base = groups.astype(np.int64) * scale
+    v = np.sort(base + values) - base
+    first = np.searchsorted(groups, np.arange(n))
+    count = np.searchsorted(groups, np.arange(n), side="right") - first
+    has = count > 0
+    out[has] = v[first[has] + count[has] // 2]
+    return out
+
+
+# ---------- RUN ----------
+def _context_start(path, offset):
+    """Byte offset of a row boundary about ``CONTEXT_BYTES`` before ``offset``
+    (0 when that reaches the header)."""
+    if offset <= CONTEXT_BYTES:
+        return 0
+    with open(path, "rb") as fh:
+        fh.seek(offset - CONTEXT_BYTES)
+        chunk = fh.read(CONTEXT_BYTES)
+    cut = chunk.find(b"\n")
+    return offset - CONTEXT_BYTES + cut + 1 if 0 <= cut < len(chunk) - 1 else offset
+
+
+def _calendar(state, files, nav_dir):
+    """Trading calendar learned on the schemes that share the most common last date."""
+    last = {code: state.lookup(code, os.path.join(nav_dir, f"{code}.csv")).last_date for code in files}
+    common = Counter(d for d in last.values() if d).most_common(1)
+    current = [c for c, d in last.items() if common and d == common[0][0]]
+    step = max(1, len(current) // scheduler.CALENDAR_SAMPLE)
+    return scheduler.learn_calendar(
+        [os.path.join(nav_dir, f"{c}.csv") for c in current[::step][:scheduler.CALENDAR_SAMPLE]])
+
+
+def _parts(state, codes, nav_dir, full):
+    """Yield batches of :class:`Part` for the unchecked bytes of ``codes``,
+    with the entries they were read at."""
+    batch, size = [], 0
+    for code in codes:
+        path = os.path.join(nav_dir, f"{code}.csv")
+        entry = state.lookup(code, path)
+        wm_date, wm_offset = (None, 0) if full else state.watermark(CONSUMER, code)
+        if wm_offset == entry.size and wm_date == entry.last_date:
+            continue
+        if wm_offset > entry.size:
+            wm_offset = 0   # shrunk or rewritten: check it all again
+        start = _context_start(path, wm_offset)
+        with open(path, "rb") as fh:
+            fh.seek(start)
+            data = fh.read(entry.size - start)
+        row_base = entry.rows - nav_state.scan_bytes(data).rows if start else 0
+        batch.append((Part(code, path, start, data, wm_offset, row_base), entry))
+        size += len(data)
+        if size >= BATCH_BYTES:
+            yield batch
+            batch, size = [], 0
+    if batch:
+        yield batch
+
+
+def quarantine(path, code, anomalies, out_dir=QUARANTINE_DIR):
+    """Rewrite ``path`` without the error rows in ``anomalies`` and append
+    them to ``out_dir/<code>.csv``; returns the rows moved."""
+    cut = sorted({(a[2], a[3], a[1], a[4]) for a in anomalies if a[4] in ERRORS})
+    if not cut:
+        return 0
+    with open(path, "rb") as fh:
+        data = fh.read()
+    keep, pos = [], 0
+    for start, end, _, _ in cut:
+        keep.append(data[pos:start])
+        pos = end
+    keep.append(data[pos:])
+
+    os.makedirs(out_dir, exist_ok=True)
+    qpath = os.path.join(out_dir, f"{code}.csv")
+    new = not os.path.exists(qpath)
+    with open(qpath, "a", newline="", encoding="utf-8") as q:
+        writer = csv.writer(q)
+        if new:
+            writer.writerow(QUARANTINE_FIELDS)
+        for start, end, row, check in cut:
+            writer.writerow([row, check, data[start:end].decode("utf-8", "replace").rstrip("\r\n")])
+
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as fh:
+        fh.write(b"".join(keep))
+    os.replace(tmp, path)
+    return len(cut)
+
+
+def compact(anomalies):
+    """Report rows: one per run of consecutive data rows with the same check."""
+    rows = []
+    for a in sorted(anomalies, key=lambda a: (a[0].code, a[4], a[1])):
+        part, row, _, _, check, when, detail = a
+        last = rows[-1] if rows else None
+        if last and last["SchemeCode"] == part.code and last["Check"] == check \
+                and last["LastRow"] == row - 1:
+            last["Rows"] += 1
+            last["LastRow"] = row
+            last["LastDate"] = when or last["LastDate"]
+            continue
+        rows.append({"SchemeCode": part.code, "Check": check, "Rows": 1, "FirstRow": row,
+                     "LastRow": row, "FirstDate": when, "LastDate": when, "Detail": detail})
+    return rows
+
+
+def validate(state, nav_dir=NAV_DIR, full=False, move=False, quarantine_dir=QUARANTINE_DIR,
+             today=None):
+    """Check unchecked rows; returns ``(anomalies, rows moved, bytes checked)``.
+
+    Watermarks advance past every checked file except those with errors
+    left in place, so those are checked and reported again on every run
+    until they are quarantined or fixed.
+    """
+    today = today or date.today()
+    codes = sorted(f[:-4] for f in os.listdir(nav_dir) if f.endswith(".csv"))
+    if full:
+        state.clear_watermarks(CONSUMER)
+    calendar = _calendar(state, codes, nav_dir)
+
+    found, moved, checked = [], 0, 0
+    for batch in _parts(state, codes, nav_dir, full):
+        with instrument.stage("check"):
+            anomalies = check_batch([p for p, _ in batch], calendar, today)
+        checked += sum(len(p.data) for p, _ in batch)
+        found.extend(anomalies)
+
+        by_code = {}
+        for a in anomalies:
+            by_code.setdefault(a[0].code, []).append(a)
+        bad = {a[0].code for a in anomalies if a[4] in ERRORS}
+        for part, entry in batch:
+            if move and part.code in by_code:
+                moved += quarantine(part.path, part.code, by_code[part.code], quarantine_dir)
+                entry = state.lookup(part.code, part.path)
+            elif part.code in bad:
+                continue
+            state.set_watermark(CONSUMER, part.code, entry.last_date, entry.size)
+    state.commit()
+    instrument.count("bytes_read", checked)
+    return found, moved, checked
+
+
+def write_report(rows, path=REPORT_FILE):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp = path + ".tmp"
+    with open(tmp, "w", newline="", encoding="utf-8") as fh:
+        writer = csv.DictWriter(fh, fieldnames=REPORT_FIELDS)
+        writer.writeheader()
+        writer.writerows(rows)
+    os.replace(tmp, path)
+
+
+def main(argv=None, state=None):
+    parser = argparse.ArgumentParser(description="Validate NAV history rows")
+    parser.add_argument("--full", action="store_true", help="Check every row, not just new ones")
+    parser.add_argument("--quarantine", action="store_true",
+                        help=f"Move error rows to {QUARANTINE_DIR}/<SchemeCode>.csv")
+    parser.add_argument("--report", default=REPORT_FILE, help="Anomaly report (CSV)")
+    parser.add_argument("--state", default=STATE_FILE, help="NAV history state index path")
+    parser.add_argument("--nav-dir", default=NAV_DIR, help="Per-scheme NAV history directory")
+    instrument.add_arguments(parser)
+    args = parser.parse_args(argv)
+    instrument.start("nav_validate", args)
+
+    # The pipeline passes its shared connection; it is left open.
+    opened = nav_state.NavState(args.state) if state is None else contextlib.nullcontext(state)
+    with opened as state:
+        full = args.full or state.watermark_count(CONSUMER) == 0
+        print(f"🔍 Validating {'all' if full else 'new'} NAV history rows...")
+        found, moved, checked = validate(state, args.nav_dir, full, args.quarantine)
+
+    rows = compact(found)
+    write_report(rows, args.report)
+    counts = Counter(a[4] for a in found)
+    for check in ERRORS + WARNINGS:
+        if counts[check]:
+            instrument.count(f"anomalies_{check}", counts[check])
+            schemes = len({a[0].code for a in found if a[4] == check})
+            icon = "🔴" if check in ERRORS else "🟡"
+            print(f"{icon} {check}: {counts[check]:,} rows in {schemes:,} schemes")
+    for row in rows[:20]:
+        instrument.detail(f"   {row['SchemeCode']} {row['Check']} rows {row['FirstRow']}"
+                          f"-{row['LastRow']} {row['FirstDate']} {row['Detail']}")
+    print(f"📄 {checked / 2 ** 20:,.1f} MB checked, report → {args.report} ({len(rows):,} lines)")
+
+    errors = sum(counts[c] for c in ERRORS)
+    if moved:
+        print(f"🧹 Rows quarantined → {QUARANTINE_DIR}: {moved:,}")
+        print("🔁 CSV exports keep the old rows until rebuilt: export_nav_year.py --rebuild, "
+              "export_nav_history_all.py --rebuild")
+    if errors > moved:
+        print(f"❌ {errors - moved:,} invalid rows left in {args.nav_dir} (--quarantine moves them)")
+        return 1
+    print(f"✅ {'NAV history' if full else 'New NAV history rows'} valid"
+          + (" (warnings above)" if found and not errors else ""))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,471 @@
+"""Sidecar index for ``data/nav_year/nav_year_YYYY.csv`` and a reader on top.
+
+Year files are sorted by (SchemeCode, Date).  ``export_nav_year.py`` writes
+a ``nav_year_YYYY.idx`` for each file it produces under ``INDEX_DIR`` (one
+folder per year-file directory), outside the committed tree: every new
+row shifts the offsets after it, so the sidecars would be a fresh blob in
+every data commit::
+
+    b"NAVYIDX1\\n"
+    {"size": ..., "crc32": ..., "rows": N, "codes": [...], "dates": [...]}\\n
+    uint32 row_offsets[N + 1]    byte offset of each data row, then EOF
+    uint32 scheme_first[S + 1]   first row of codes[i]; the last is N
+    uint32 date_first[D + 1]     start of dates[j] in date_rows
+    uint32 date_rows[N]          row numbers grouped by date, file order
+
+(little-endian; ``Q`` instead of ``I`` when the file is 4 GiB or more.)
+:class:`YearFile` maps the CSV, loads the sidecar and answers a scheme, a
+date range within a scheme or every scheme on one date by bisecting those
+arrays and parsing only the rows it returns.  A sidecar whose recorded
+size does not match the CSV is stale; the reader then indexes the file
+and saves the sidecar (:class:`NotSorted` if the file is out of order,
+which ``export_nav_year.py`` repairs on its next merge).
+
+    python scripts/nav_year_index.py                       # index every year file
+    python scripts/nav_year_index.py get 2025 119551 --start 2025-03-01
+    python scripts/nav_year_index.py date 2025 2025-03-03
+"""
+
+import argparse
+import array
+import json
+import mmap
+import os
+import sys
+import zlib
+from collections import defaultdict
+
+try:
+    import numpy as np
+except ImportError:  # optional dependency
+    np = None
+
+OUT_DIR = "data/nav_year"
+INDEX_DIR = ".cache/nav_year_index"
+MAGIC = b"NAVYIDX1\n"
+SUFFIX = ".idx"
+
+
+class NotSorted(ValueError):
+    pass
+
+
+def index_path(year_file):
+    folder = os.path.dirname(os.path.abspath(year_file))
+    name = os.path.splitext(os.path.basename(year_file))[0] + SUFFIX
+    return os.path.join(INDEX_DIR, f"{zlib.crc32(folder.encode('utf-8')):08x}", name)
+
+
+def _legacy_path(year_file):
+    # Where sidecars used to be written, next to the year file.
+    return os.path.splitext(year_file)[0] + SUFFIX
+
+
+def _typecode(size):
+    return "I" if size < 1 << 32 else "Q"
+
+
+def _key(line):
+    parts = line.split(b",", 2)
+    return parts[0], parts[1] if len(parts) > 1 else b""
+
+
+# ---------- BUILD ----------
+def build(data):
+    """Index the bytes of a year file; raises :class:`NotSorted`.
+
+    Vectorised with NumPy when it is installed and every row has the usual
+    ``code,date,...`` shape; otherwise (or for odd files) a line-by-line scan.
+    """
+    if np is not None:
+        built = _build_vectorised(data)
+        if built is not None:
+            return built
+
+    start = data.find(b"\n") + 1 if data else 0
+    tc = _typecode(len(data))
+    row_offsets = array.array(tc)
+    scheme_first = array.array(tc)
+    codes = []
+    by_date = defaultdict(list)
+
+    prev = None
+    pos = start
+    row = 0
+    for line in data[start:].split(b"\n"):
+        end = pos + len(line) + 1
+        if line.strip():
+            key = _key(line.rstrip(b"\r"))
+            if prev is not None and key < prev:
+                raise NotSorted(f"row {row}: {key} after {prev}")
+            if prev is None or key[0] != prev[0]:
+                codes.append(key[0].decode("ascii", "replace"))
+                scheme_first.append(row)
+            by_date[key[1]].append(row)
+            row_offsets.append(pos)
+            prev = key
+            row += 1
+        pos = end
+    row_offsets.append(len(data))
+    scheme_first.append(row)
+
+    dates = sorted(by_date)
+    date_first = array.array(tc, [0])
+    date_rows = array.array(tc)
+    for d in dates:
+        date_rows.extend(by_date[d])
+        date_first.append(len(date_rows))
+
+    header = {
+        "size": len(data),
+        "crc32": zlib.crc32(data),
+        "typecode": tc,
+        "rows": row,
+        "codes": codes,
+        "dates": [d.decode("ascii", "replace") for d in dates],
+    }
+    return header, (row_offsets, scheme_first, date_first, date_rows)
+
+
+# Top ``w`` bytes of a big-endian word, for ``w`` = 0..8.
+_KEEP = None if np is None else np.array(
+    [((1 << 64) - 1) ^ ((1 << 8 * (8 - w)) - 1) for w in range(9)], dtype=np.uint64)
+_FIELD_WIDTH = 16   # code and date fields longer than this take the slow path
+
+
+def _build_vectorised(data):
+    """:func:`build` over NumPy arrays; ``None`` if a line is not a plain
+    ``code,date,...`` row or blank.
+
+    Each code and date is read as two big-endian words (zero padded), which
+    order the same way as the bytes, so the sort check, the scheme starts
+    and the grouping by date are array operations.
+    """
+    start = data.find(b"\n") + 1 if data else 0
+    buf = np.frombuffer(data, dtype=np.uint8)
+    ends = np.flatnonzero(buf[start:] == 10) + start
+    begins = np.concatenate(([start], ends + 1))
+    stops = np.concatenate((ends, [len(data)]))
+    if len(buf):
+        stops -= (stops > begins) & (buf[np.maximum(stops - 1, 0)] == 13)
+
+    commas = np.flatnonzero(buf[start:] == 44) + start
+    if (len(commas) == 2 * len(begins) and np.all(commas[::2] >= begins)
+            and np.all(commas[1::2] < stops)):
+        c1, c2 = commas[::2], commas[1::2]      # exactly two in every line
+    else:
+        first = np.searchsorted(commas, begins)
+        padded_commas = np.concatenate((commas, [len(data), len(data)]))
+        c1, c2 = padded_commas[first], padded_commas[first + 1]
+    row = c2 < stops
+    blank = stops == begins
+    if not np.all(row | blank):
+        return None
+    begins, c1, c2 = begins[row], c1[row], c2[row]
+    code_width, date_width = c1 - begins, c2 - c1 - 1
+    if len(begins) and max(code_width.max(), date_width.max()) > _FIELD_WIDTH:
+        return None
+
+    padded = np.concatenate((buf, np.zeros(_FIELD_WIDTH, np.uint8)))
+    words = np.ndarray((len(padded) - 7,), ">u8", padded, strides=(1,))
+
+    def field(at, width):
+        return [words[at + k].astype(np.uint64) & _KEEP[np.clip(width - k, 0, 8)]
+                for k in range(0, _FIELD_WIDTH, 8)]
+
+    code = field(begins, code_width)
+    date = field(c1 + 1, date_width)
+    n = len(begins)
+
+    # Sort check: each key against the one before, column by column.
+    before = np.zeros(max(n - 1, 0), bool)
+    same = np.ones(max(n - 1, 0), bool)
+    for i, col in enumerate(code + date):
+        if i == len(code):
+            new_code = ~same
+        before |= same & (col[1:] < col[:-1])
+        same &= col[1:] == col[:-1]
+    if before.any():
+        i = int(np.argmax(before)) + 1
+        key, prev = ((data[begins[r]:c1[r]], data[c1[r] + 1:c2[r]]) for r in (i, i - 1))
+        raise NotSorted(f"row {i}: {key} after {prev}")
+
+    tc = _typecode(len(data))
+    dtype = np.uint32 if tc == "I" else np.uint64
+    firsts = np.flatnonzero(np.concatenate(([n > 0], new_code)))
+
+    order = _date_order(date, date_width)       # by date, file order within one
+    sorted_date = [col[order] for col in date]
+    change = np.zeros(n, bool)
+    change[:1] = True
+    for col in sorted_date:
+        change[1:] |= col[1:] != col[:-1]
+    date_starts = np.flatnonzero(change)
+
+    def packed(values):
+        out = array.array(tc)
+        out.frombytes(np.asarray(values, dtype=dtype).tobytes())
+        return out
+
+    header = {
+        "size": len(data),
+        "crc32": zlib.crc32(data),
+        "typecode": tc,
+        "rows": n,
+        "codes": [data[begins[i]:c1[i]].decode("ascii", "replace") for i in firsts.tolist()],
+        "dates": [data[c1[i] + 1:c2[i]].decode("ascii", "replace")
+                  for i in order[date_starts].tolist()],
+    }
+    arrays = (
+        packed(np.append(begins, len(data))),
+        packed(np.append(firsts, n)),
+        packed(np.append(date_starts, n)),
+        packed(order),
+    )
+    return header, arrays
+
+
+def _date_order(date, width):
+    """Stable order of rows by their ``date`` words.
+
+    Dates in one file share a long prefix, so the bits that differ usually
+    fit one word and a single argsort replaces the two-key lexsort.
+    """
+    hi, lo = date
+    if not len(hi):
+        return np.zeros(0, np.int64)
+    varying = int(np.bitwise_or.reduce(hi ^ hi[0])).bit_length()
+    tail = 8 * max(0, int(width.max()) - 8)     # bits of the date in ``lo``
+    if varying + tail > 64:
+        return np.lexsort((lo, hi))
+    key = hi & np.uint64((1 << varying) - 1)
+    if tail:
+        key = (key << np.uint64(tail)) | (lo >> np.uint64(64 - tail))
+    return np.argsort(key, kind="stable")
+
+
+def _read(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def write(year_file):
+    """(Re)write the sidecar for ``year_file``; ``False`` (and no sidecar)
+    if the file is not in (SchemeCode, Date) order."""
+    out = index_path(year_file)
+    try:
+        header, arrays = build(_read(year_file))
+    except NotSorted:
+        if os.path.exists(out):
+            os.remove(out)
+        return False
+    _save(out, header, arrays)
+    return True
+
+
+def _save(out, header, arrays):
+    os.makedirs(os.path.dirname(out), exist_ok=True)
+    tmp = out + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(MAGIC)
+        f.write(json.dumps(header, separators=(",", ":")).encode("ascii") + b"\n")
+        for arr in arrays:
+            if sys.byteorder != "little":
+                arr = array.array(arr.typecode, arr)
+                arr.byteswap()
+            f.write(arr.tobytes())
+    os.replace(tmp, out)
+
+
+def _read_header(path):
+    try:
+        with open(path, "rb") as f:
+            if f.readline() != MAGIC:
+                return None
+            return json.loads(f.readline()), f.tell()
+    except (OSError, ValueError):
+        return None
+
+
+def is_fresh(year_file):
+    """Sidecar exists and was written for a file of this size."""
+    found = _read_header(index_path(year_file))
+    return found is not None and found[0].get("size") == os.path.getsize(year_file)
+
+
+def ensure(out_dir=OUT_DIR):
+    """Index every year file in ``out_dir`` that has no fresh sidecar, and
+    drop sidecars left next to the year files by older versions."""
+    written = 0
+    for f in sorted(os.listdir(out_dir)):
+        if f.startswith("nav_year_") and f.endswith(".csv"):
+            path = os.path.join(out_dir, f)
+            if os.path.exists(_legacy_path(path)):
+                os.remove(_legacy_path(path))
+            if not is_fresh(path) and write(path):
+                written += 1
+    return written
+
+
+# ---------- READ ----------
+class YearFile:
+    """Read-only, memory-mapped year file; use as a context manager.
+
+    Rows come back as ``(SchemeCode, Date, NAV)`` strings exactly as
+    written.  ``verify=True`` also checks the CRC of the whole file.
+    """
+
+    def __init__(self, year_file, verify=False):
+        self.path = year_file
+        self._f = open(year_file, "rb")
+        size = os.fstat(self._f.fileno()).st_size
+        self._mm = mmap.mmap(self._f.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+        self.stale = False
+
+        found = _read_header(index_path(year_file))
+        header = found[0] if found else None
+        if header is not None and header.get("size") == size and (
+                not verify or header.get("crc32") == zlib.crc32(self._mm)):
+            self._load_sidecar(header, found[1])
+        else:
+            # Missing or stale sidecar: index the file and cache the result.
+            self.stale = True
+            header, arrays = build(self._mm)
+            self._set(header, arrays)
+            try:
+                _save(index_path(year_file), header, arrays)
+            except OSError:
+                pass
+
+    def _load_sidecar(self, header, start):
+        # A few bytes per row; reading them is cheaper than mapping them.
+        lengths = (header["rows"] + 1, len(header["codes"]) + 1,
+                   len(header["dates"]) + 1, header["rows"])
+        arrays = []
+        with open(index_path(self.path), "rb") as f:
+            f.seek(start)
+            for n in lengths:
+                arr = array.array(header["typecode"])
+                arr.fromfile(f, n)
+                if sys.byteorder != "little":
+                    arr.byteswap()
+                arrays.append(arr)
+        self._set(header, arrays)
+
+    def _set(self, header, arrays):
+        self.codes = header["codes"]
+        self.dates = header["dates"]
+        self.rows = header["rows"]
+        self._row_offsets, self._scheme_first, self._date_first, self._date_rows = arrays
+        self._code_pos = {c: i for i, c in enumerate(self.codes)}
+
+    def close(self):
+        if isinstance(self._mm, mmap.mmap):
+            self._mm.close()
+        self._f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def __len__(self):
+        return self.rows
+
+    # ---------- ROWS ----------
+    def _line(self, row):
+        lo, hi = self._row_offsets[row], self._row_offsets[row + 1]
+        return self._mm[lo:hi].rstrip(b"\r\n")
+
+    def row(self, row):
+        return tuple(self._line(row).decode("utf-8").split(",", 2))
+
+    def _date_of(self, row, skip):
+        lo = self._row_offsets[row] + skip
+        return self._mm[lo:lo + 10]
+
+    def scheme_range(self, code):
+        """``(first_row, end_row)`` of ``code``; empty if absent."""
+        i = self._code_pos.get(str(code))
+        if i is None:
+            return 0, 0
+        return self._scheme_first[i], self._scheme_first[i + 1]
+
+    def _bisect(self, lo, hi, date, skip):
+        # First row in [lo, hi) whose date is >= ``date``.
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._date_of(mid, skip) < date:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    # ---------- QUERIES ----------
+    def scheme(self, code, start=None, end=None):
+        """Rows of ``code`` with ``start <= Date <= end`` (ISO strings)."""
+        lo, hi = self.scheme_range(code)
+        skip = len(str(code)) + 1
+        if start is not None:
+            lo = self._bisect(lo, hi, start.encode("ascii"), skip)
+        if end is not None:
+            # Dates are fixed-width, so "<= end" is "< end + one char past".
+            hi = self._bisect(lo, hi, end.encode("ascii") + b"\xff", skip)
+        return [self.row(r) for r in range(lo, hi)]
+
+    def nav(self, code, date):
+        """NAV of ``code`` on exactly ``date``, or ``None``."""
+        rows = self.scheme(code, date, date)
+        return rows[0][2] if rows else None
+
+    def on_date(self, date):
+        """Every row dated ``date``, in SchemeCode order."""
+        lo, hi = 0, len(self.dates)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.dates[mid] < date:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo == len(self.dates) or self.dates[lo] != date:
+            return []
+        first, last = self._date_first[lo], self._date_first[lo + 1]
+        return [self.row(self._date_rows[i]) for i in range(first, last)]
+
+
+def year_file(year, out_dir=OUT_DIR):
+    return os.path.join(out_dir, f"nav_year_{year}.csv")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Index and query year-wise NAV files")
+    parser.add_argument("--out-dir", default=OUT_DIR, help="Year-wise output directory")
+    sub = parser.add_subparsers(dest="command")
+    p_get = sub.add_parser("get", help="Rows of one scheme in a year")
+    p_get.add_argument("year", type=int)
+    p_get.add_argument("code")
+    p_get.add_argument("--start")
+    p_get.add_argument("--end")
+    p_date = sub.add_parser("date", help="Every scheme's row on one date")
+    p_date.add_argument("year", type=int)
+    p_date.add_argument("date")
+
+    args = parser.parse_args()
+
+    if args.command is None:
+        n = ensure(args.out_dir)
+        print(f"✅ Year file indexes up to date ({n} written)")
+        return
+
+    with YearFile(year_file(args.year, args.out_dir)) as yf:
+        if yf.stale:
+            print("⚠️ Sidecar index missing or stale, re-indexed", file=sys.stderr)
+        rows = yf.scheme(args.code, args.start, args.end) if args.command == "get" \
+            else yf.on_date(args.date)
+        for r in rows:
+            print(",".join(r))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+"""Parsing helpers for AMFI's ``NAVAll.txt`` (latest NAV for every scheme).
+
+Lines are ``;``-separated::
+
+    Scheme Code;ISIN Div Payout/ ISIN Growth;ISIN Div Reinvestment;Scheme Name;Net Asset Value;Date
+
+with bare AMC names on their own line ahead of each AMC's schemes.
+:func:`parse` takes any iterable of lines, so it runs over a streamed
+body as well as over ``text.splitlines()``.
+"""
+
+import time
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+
+import requests
+
+import instrument
+
+URL = "https://www.amfiindia.com/spages/NAVAll.txt"
+TIMEOUT = 20
+
+FIELDNAMES = ["SchemeCode", "AMC", "SchemeName", "ISIN", "NAV", "Date"]
+
+
+def download(url=URL, timeout=TIMEOUT):
+    start = time.monotonic()
+    response = requests.get(url, timeout=timeout)
+    instrument.http(response.status_code, time.monotonic() - start, len(response.content))
+    response.raise_for_status()
+    return response.text
+
+
+def fetch(cache, url=URL, timeout=TIMEOUT, store_body=False, conditional=True):
+    """Conditional download through an ``http_cache.HttpCache``.
+
+    Returns the cache result; ``decode(result.content)`` gives the text.
+    The caller commits it once the file has been processed.
+    """
+    with requests.Session() as session:
+        result = cache.get(session, url, store_body=store_body,
+                           conditional=conditional, timeout=timeout)
+    if result.status != 200:
+        raise requests.HTTPError(f"{result.status} for {url}")
+    return result
+
+
+def stream(cache, url=URL, timeout=TIMEOUT, conditional=True):
+    """Open a streamed conditional download (``http_cache.CacheStream``).
+
+    Feed ``decode_lines(result.iter_lines())`` to :func:`parse`, then call
+    ``result.finish()``, which also closes the session opened here; the
+    body is never held in memory as a whole.
+    """
+    session = requests.Session()
+    try:
+        result = cache.stream(session, url, conditional=conditional,
+                              own_session=True, timeout=timeout)
+    except Exception:
+        session.close()
+        raise
+    if result.status not in (200, 304) or (result.status == 304 and not result.not_modified):
+        result.close()
+        raise requests.HTTPError(f"{result.status} for {url}")
+    return result
+
+
+def decode_lines(raw_lines):
+    for line in raw_lines:
+        yield decode(line)
+
+
+def decode(content):
+    """Text of a raw NAVAll.txt body (served without a charset)."""
+    try:
+        return content.decode("utf-8")
+    except UnicodeDecodeError:
+        return content.decode("latin-1")
+
+
+def parse(lines):
+    """Yield one ``FIELDNAMES`` dict per scheme line in ``lines``."""
+    current_amc = ""
+
+    for line in lines:
+        line = line.strip()
+
+        if not line:
+            continue
+
+        parts = line.split(";")
+
+        # ---------- AMC NAME ----------
+        if len(parts) == 1 and not parts[0].isdigit():
+            current_amc = parts[0].strip()
+            continue
+
+        # ---------- SCHEME DATA ----------
+        if len(parts) >= 6 and parts[0].isdigit():
+            yield {
+                "SchemeCode": parts[0].strip(),
+                "AMC": current_amc,
+                "SchemeName": parts[3].strip(),
+                "ISIN": parts[1].strip() or parts[2].strip(),
+                "NAV": parts[4].strip(),
+                "Date": parts[5].strip(),
+            }
+
+
+def iso_date(amfi_date):
+    """``30-Jan-2026`` → ``2026-01-30``; ``None`` if unparseable."""
+    try:
+        return datetime.strptime(amfi_date, "%d-%b-%Y").date().isoformat()
+    except (TypeError, ValueError):
+        return None
+
+
+def history_nav(amfi_nav):
+    """Format an AMFI NAV like mfapi history rows (5 decimals); ``None`` if not numeric."""
+    try:
+        value = Decimal(amfi_nav)
+    except (TypeError, InvalidOperation):
+        return None
+    if not value.is_finite() or value <= 0:
+        return None
+    return f"{value:.5f}"
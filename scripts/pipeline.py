@@ -0,0 +1,432 @@
+"""Run the data pipeline as one process: a DAG of steps with declared files.
+
+Each step lists the paths it reads and writes; ordering comes from those
+declarations (a step runs after any earlier step that writes what it reads,
+reads what it writes or writes the same path), so steps that share nothing
+run concurrently in a thread pool.  Steps are the existing scripts run
+in-process, which keeps imports warm.  ``nav_validate``, ``nav_year`` and
+``scheme_metrics`` share the ``Context``'s ``NavState`` connection; the
+two fetch steps close it and open their own, as their scripts do when run
+alone.  Data passes between steps only through the files: handing the
+fetched rows or a refreshed NAV store to later steps in memory is out of
+scope, since each reader re-reads what it needs past its own watermark.
+
+Before a step runs its inputs and outputs are fingerprinted by content, so
+a fresh checkout (new mtimes, same bytes) still skips: per-scheme history
+files by the size and CRC32 the state index already keeps, everything else
+by a SHA-256 that is only recomputed when a file's size or mtime moved
+(``.cache/pipeline/state.json`` keeps both the digests and the last
+fingerprints).  A step whose inputs and outputs are as it left them is skipped;
+network steps always run, since their input is remote, and rely on their
+own conditional requests to stay cheap.  The run ends with a per-step
+timing report; ``--report`` writes it as JSON together with the
+``instrument`` metrics (each step is a stage, with the stages, counters and
+HTTP latencies its script records nested under it).  ``--quiet`` drops the
+per-scheme lines of every step.
+
+    python -m scripts.pipeline                       # everything
+    python -m scripts.pipeline --steps nav_history,nav_year,scheme_metrics
+    python -m scripts.pipeline --list
+    python -m scripts.pipeline --force --report run.json
+    python -m scripts.pipeline --quiet --profile run.prof --tracemalloc
+"""
+
+import argparse
+import hashlib
+import io
+import json
+import os
+import runpy
+import sys
+import threading
+import time
+import traceback
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+if SCRIPTS_DIR not in sys.path:   # ``python -m scripts.pipeline`` from the repo root
+    sys.path.insert(0, SCRIPTS_DIR)
+
+import instrument  # noqa: E402
+import nav_state  # noqa: E402
+
+STATE_DIR = ".cache/pipeline"
+STATE_FILE = os.path.join(STATE_DIR, "state.json")
+JOBS = 3
+VALIDATE_REPORT = ".cache/validate/anomalies.csv"   # nav_validate.REPORT_FILE
+
+
+class Step:
+    __slots__ = ("name", "run", "inputs", "outputs", "always")
+
+    def __init__(self, name, run, inputs=(), outputs=(), always=False):
+        self.name = name
+        self.run = run
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        self.always = always   # reads remote data: never skipped
+
+
+class Context:
+    """One lazily opened ``NavState`` for the steps that take a state;
+    steps that open their own call :meth:`release_state` first."""
+
+    def __init__(self, state_file=nav_state.STATE_FILE):
+        self.state_file = state_file
+        self._state = None
+        self._lock = threading.Lock()
+
+    def state(self):
+        with self._lock:
+            if self._state is None:
+                self._state = nav_state.NavState(self.state_file)
+            return self._state
+
+    def commit(self):
+        with self._lock:
+            if self._state is not None:
+                self._state.commit()
+
+    def release_state(self):
+        """Commit and close, so a step with its own connection sees it all."""
+        with self._lock:
+            if self._state is not None:
+                self._state.close()
+                self._state = None
+
+
+# ---------- STEPS ----------
+def run_script(name):
+    """Execute a top-level script in-process; ``sys.exit(0)`` counts as done."""
+    try:
+        runpy.run_path(os.path.join(SCRIPTS_DIR, name), run_name="__main__")
+    except SystemExit as e:
+        if e.code not in (None, 0):
+            raise
+
+
+def step_scheme_codes(ctx):
+    run_script("fetch_scheme_codes.py")
+
+
+def step_scheme_categories(ctx):
+    ctx.release_state()
+    run_script("fetch_scheme_categories.py")
+
+
+def step_nav_history(ctx):
+    import fetch_nav_history
+    ctx.release_state()
+    fetch_nav_history.main(["--delta", "--schedule"])
+
+
+def step_nav_validate(ctx):
+    import nav_validate
+    # Errors left in the history fail the step, which blocks the exports below.
+    if nav_validate.main([], state=ctx.state()):
+        raise RuntimeError(f"invalid NAV history rows, see {VALIDATE_REPORT}")
+
+
+def step_scheme_index(ctx):
+    import merge_scheme_metadata
+    merge_scheme_metadata.merge()
+
+
+def step_nav_year(ctx):
+    import export_nav_year
+    total = export_nav_year.export(ctx.state())
+    print(f"🎉 Year-wise NAV files updated ✅ ({total:,} rows)")
+
+
+def step_scheme_metrics(ctx):
+    import nav_metrics
+    nav_metrics.run(ctx.state())
+
+
+STEPS = [
+    Step("scheme_codes", step_scheme_codes,
+         outputs=["data/scheme_codes.csv"], always=True),
+    Step("scheme_categories", step_scheme_categories,
+         inputs=["data/scheme_codes.csv"],
+         outputs=["data/scheme_categories.csv", "data/nav_history"], always=True),
+    Step("nav_history", step_nav_history,
+         inputs=["data/scheme_codes.csv"],
+         outputs=["data/nav_history", "data/scheme_categories.csv"], always=True),
+    Step("nav_validate", step_nav_validate,
+         inputs=["data/nav_history"], outputs=[VALIDATE_REPORT]),
+    Step("scheme_index", step_scheme_index,
+         inputs=["data/scheme_codes.csv", "data/scheme_categories.csv"],
+         outputs=["data/scheme_index.csv"]),
+    # The report is an input of the exports so they wait for the check and
+    # are blocked when it fails.
+    Step("nav_year", step_nav_year,
+         inputs=["data/nav_history", VALIDATE_REPORT], outputs=["data/nav_year"]),
+    Step("scheme_metrics", step_scheme_metrics,
+         inputs=["data/nav_history", VALIDATE_REPORT], outputs=["data/scheme_metrics.csv"]),
+]
+
+
+# ---------- DAG ----------
+def _overlaps(a, b):
+    a, b = os.path.normpath(a), os.path.normpath(b)
+    return a == b or a.startswith(b + os.sep) or b.startswith(a + os.sep)
+
+
+def _touches(xs, ys):
+    return any(_overlaps(x, y) for x in xs for y in ys)
+
+
+def dependencies(steps):
+    """``{name: {names it waits for}}`` from declaration order and paths."""
+    deps = {s.name: set() for s in steps}
+    for j, later in enumerate(steps):
+        for earlier in steps[:j]:
+            if (_touches(later.inputs, earlier.outputs)
+                    or _touches(later.outputs, earlier.inputs)
+                    or _touches(later.outputs, earlier.outputs)):
+                deps[later.name].add(earlier.name)
+    return deps
+
+
+# ---------- FINGERPRINTS ----------
+def file_digest(path, st, digests):
+    """SHA-256 of ``path``; ``digests`` maps path → [size, mtime_ns, hex] and
+    saves re-reading files that have not been touched since the last hash."""
+    memo = digests.get(path)
+    if memo and memo[0] == st.st_size and memo[1] == st.st_mtime_ns:
+        return memo[2]
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    digests[path] = [st.st_size, st.st_mtime_ns, h.hexdigest()]
+    return digests[path][2]
+
+
+def fingerprint(paths, digests, state=None):
+    """Hash of (path, content) for every file under ``paths``.
+
+    With ``state``, files directly in ``nav_state.NAV_DIR`` are identified
+    by their state record (size and CRC32) instead of being read.
+    """
+    nav_dir = os.path.normpath(nav_state.NAV_DIR)
+    h = hashlib.sha256()
+    for root in paths:
+        if os.path.isdir(root):
+            for dirpath, dirnames, filenames in os.walk(root):
+                dirnames.sort()
+                by_state = state is not None and os.path.normpath(dirpath) == nav_dir
+                for name in sorted(filenames):
+                    if name.endswith(".tmp"):
+                        continue
+                    full = os.path.join(dirpath, name)
+                    try:
+                        if by_state and name.endswith(".csv"):
+                            entry = state.lookup(name[:-4], full)
+                            content = f"{entry.size}:{entry.crc}"
+                        else:
+                            content = file_digest(full, os.stat(full), digests)
+                    except OSError:
+                        continue
+                    h.update(f"{full}\0{content}\n".encode())
+        elif os.path.exists(root):
+            h.update(f"{root}\0{file_digest(root, os.stat(root), digests)}\n".encode())
+        else:
+            h.update(f"{root}\0-\n".encode())
+    return h.hexdigest()
+
+
+def load_state(path=STATE_FILE):
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_state(state, path=STATE_FILE):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(state, f, indent=1, sort_keys=True)
+    os.replace(tmp, path)
+
+
+# ---------- OUTPUT ----------
+class StepOutput(io.TextIOBase):
+    """``sys.stdout`` stand-in that prefixes each line with the step that
+    printed it, so concurrent steps stay readable."""
+
+    def __init__(self, target):
+        self.target = target
+        self.local = threading.local()
+        self.lock = threading.Lock()
+
+    def write(self, s):
+        name = getattr(self.local, "step", None)
+        if name is None:
+            with self.lock:
+                return self.target.write(s)
+        buf = getattr(self.local, "buf", "") + s
+        *lines, self.local.buf = buf.split("\n")
+        if lines:
+            with self.lock:
+                self.target.write("".join(f"[{name}] {line}\n" for line in lines))
+        return len(s)
+
+    def flush(self):
+        name = getattr(self.local, "step", None)
+        rest = getattr(self.local, "buf", "")
+        if name is not None and rest:
+            self.local.buf = ""
+            with self.lock:
+                self.target.write(f"[{name}] {rest}\n")
+        self.target.flush()
+
+
+# ---------- RUN ----------
+def _execute(step, ctx, out):
+    out.local.step = step.name
+    start, cpu = time.perf_counter(), time.thread_time()
+    error = None
+    try:
+        with instrument.stage(step.name):
+            step.run(ctx)
+    except BaseException:   # a step's SystemExit must not end the run
+        error = traceback.format_exc()
+        print(error)
+    finally:
+        out.flush()
+        out.local.step = None
+    return time.perf_counter() - start, time.thread_time() - cpu, error
+
+
+def run(steps, jobs=JOBS, force=False, dry_run=False, state_path=STATE_FILE, ctx=None):
+    """Run ``steps`` in dependency order; returns the report rows."""
+    deps = dependencies(steps)
+    names = {s.name for s in steps}
+    by_name = {s.name: s for s in steps}
+    saved = load_state(state_path)
+    digests = saved.setdefault("_digests", {})
+    ctx = ctx or Context()
+
+    def fp(paths):
+        uses_state = _touches(paths, [nav_state.NAV_DIR])
+        return fingerprint(paths, digests, ctx.state() if uses_state else None)
+    report = {s.name: {"step": s.name, "status": "pending"} for s in steps}
+    done, failed = set(), set()
+
+    out = StepOutput(sys.stdout)
+    real_stdout, sys.stdout = sys.stdout, out
+    started = time.perf_counter()
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, jobs)) as pool:
+            running = {}
+            while len(done) + len(failed) < len(steps):
+                for s in steps:
+                    if s.name in done or s.name in failed or s.name in running.values():
+                        continue
+                    waits = deps[s.name] & names
+                    if waits & failed:
+                        failed.add(s.name)
+                        report[s.name].update(status="blocked", reason="upstream failed")
+                        continue
+                    if not waits <= done:
+                        continue
+
+                    inputs_fp = fp(s.inputs)
+                    prev = saved.get(s.name, {})
+                    unchanged = (prev.get("inputs") == inputs_fp
+                                 and prev.get("outputs") == fp(s.outputs))
+                    skip = unchanged and not s.always and not force
+                    reason = ("inputs unchanged" if skip else "forced" if force
+                              else "remote input" if s.always
+                              else "inputs changed" if prev else "first run")
+                    report[s.name]["reason"] = reason
+                    if skip or dry_run:
+                        done.add(s.name)
+                        report[s.name]["status"] = (
+                            "skipped" if skip else "run") if not dry_run else (
+                            "-> skip" if skip else "-> run")
+                        continue
+
+                    report[s.name]["inputs"] = inputs_fp
+                    running[pool.submit(_execute, s, ctx, out)] = s.name
+
+                if not running:
+                    continue
+                finished, _ = wait(list(running), return_when=FIRST_COMPLETED)
+                for fut in finished:
+                    name = running.pop(fut)
+                    wall, cpu, error = fut.result()
+                    report[name].update(wall=round(wall, 3), cpu=round(cpu, 3))
+                    if error:
+                        failed.add(name)
+                        report[name]["status"] = "failed"
+                        continue
+                    done.add(name)
+                    report[name]["status"] = "ran"
+                    ctx.commit()   # watermarks land with the files they describe
+                    saved[name] = {
+                        "inputs": report[name].pop("inputs"),
+                        "outputs": fp(by_name[name].outputs),
+                    }
+                    save_state(saved, state_path)
+    finally:
+        sys.stdout = real_stdout
+        ctx.release_state()
+
+    rows = [report[s.name] for s in steps]
+    for r in rows:
+        r.pop("inputs", None)
+    return rows, time.perf_counter() - started
+
+
+def print_report(rows, total):
+    print("\n⏱️ Pipeline report")
+    print(f"   {'step':<18} {'status':<8} {'wall s':>8} {'cpu s':>8}  reason")
+    for r in rows:
+        wall = f"{r['wall']:8.2f}" if "wall" in r else f"{'-':>8}"
+        cpu = f"{r['cpu']:8.2f}" if "cpu" in r else f"{'-':>8}"
+        print(f"   {r['step']:<18} {r['status']:<8} {wall} {cpu}  {r.get('reason', '')}")
+    busy = sum(r.get("wall", 0) for r in rows)
+    print(f"   total {total:.2f}s wall for {busy:.2f}s of step time")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the MF data pipeline as a DAG")
+    parser.add_argument("--steps", help="Comma-separated subset of steps to run, in DAG order")
+    parser.add_argument("--jobs", type=int, default=JOBS, help="Steps allowed to run at once")
+    parser.add_argument("--force", action="store_true", help="Run steps even if nothing changed")
+    parser.add_argument("--dry-run", action="store_true", help="Show the plan without running")
+    parser.add_argument("--list", action="store_true", help="List steps and their dependencies")
+    instrument.add_arguments(parser, metrics_flag="--report")
+    args = parser.parse_args(argv)
+
+    steps = STEPS
+    if args.steps:
+        wanted = [n.strip() for n in args.steps.split(",") if n.strip()]
+        unknown = set(wanted) - {s.name for s in STEPS}
+        if unknown:
+            parser.error(f"unknown steps: {', '.join(sorted(unknown))}")
+        steps = [s for s in STEPS if s.name in wanted]
+
+    if args.list:
+        deps = dependencies(STEPS)
+        for s in STEPS:
+            after = ", ".join(sorted(deps[s.name])) or "-"
+            print(f"{s.name:<18} after: {after:<40} {'(remote)' if s.always else ''}")
+        return 0
+
+    instrument.start("pipeline", args)
+    rows, total = run(steps, jobs=args.jobs, force=args.force, dry_run=args.dry_run)
+    print_report(rows, total)
+
+    instrument.annotate("steps", rows)
+    instrument.finish()
+
+    return 1 if any(r["status"] in ("failed", "blocked") for r in rows) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,305 @@
+"""Decide which schemes a fetch run spends its API requests on.
+
+Most schemes publish one NAV per trading day, some weekly or monthly, and
+a few thousand (matured FMPs, wound-up or merged plans) have not published
+for years.  ``fetch_nav_history.py --schedule`` asks :func:`plan` for the
+schemes that probably have a new NAV, most overdue first, instead of
+requesting every one:
+
+* ``retry``   queued after failing in an earlier run
+* ``new``     no history on disk yet
+* ``behind``  AMFI's ``Date`` (``scheme_codes.csv`` or NAVAll.txt) is newer
+  than the file's last date
+* ``due``     the scheme's cadence says its next NAV is out by today and
+  AMFI's list is too old to say otherwise
+* ``probe``   an inactive scheme whose back-off has run out
+
+The rest are skipped: ``waiting`` until the next NAV is due, ``dormant``
+until the next probe.  A scheme is inactive once it is more than
+``DORMANT_AFTER`` trading days (or ``DORMANT_FACTOR`` cadences) late; each
+probe that finds nothing doubles the wait before the next one, up to
+``PROBE_MAX`` days, and any new row resets it.
+
+Trading days are weekdays minus market holidays learned from the recent
+rows of schemes AMFI lists as current: a weekday on which most of them
+published nothing is a holiday.  A scheme's cadence is the median number of
+trading days between its recent NAVs, measured again whenever its file
+grows and kept with the probe back-off in the state index.
+
+    python scripts/scheduler.py                     # what the next run would fetch
+    python scripts/scheduler.py --budget 500 --show 20
+
+:class:`Calendar` and :func:`plan` require ``numpy``; :func:`learn_holidays`
+(used by the ``--delta`` gap check) does not.
+"""
+
+import argparse
+import csv
+import os
+import statistics
+import zlib
+from collections import Counter, namedtuple
+from datetime import date, timedelta
+
+try:
+    import numpy as np
+except ImportError:  # optional dependency
+    np = None
+
+import nav_state
+import navall
+
+CODES_FILE = "data/scheme_codes.csv"
+NAV_DIR = nav_state.NAV_DIR
+STATE_FILE = nav_state.STATE_FILE
+RETRY_CONSUMER = "nav_history"
+
+TAIL_BYTES = 1024        # recent rows read to measure a cadence (~45 rows)
+CALENDAR_SAMPLE = 200    # current schemes whose recent rows define trading days
+CALENDAR_BYTES = 4096    # ~180 trading days each
+MIN_SPANNING = 20        # fewer recent histories than this can't call a holiday
+DORMANT_AFTER = 20       # trading days late before a scheme counts as inactive
+DORMANT_FACTOR = 4       # ... or this many cadences, whichever is longer
+PROBE_MAX = 64           # days; waits between probes go ~2, 4, 8, ... up to this
+
+# Reasons to fetch, in priority order, and reasons to skip.
+FETCH = ("retry", "new", "behind", "due", "probe")
+SKIP = ("waiting", "dormant")
+
+Plan = namedtuple("Plan", "schemes reasons schedules counts deferred calendar")
+
+
+def available():
+    return np is not None
+
+
+# ---------- TRADING CALENDAR ----------
+class Calendar:
+    """Weekdays minus ``holidays`` (ISO dates); dates in and out are ISO strings."""
+
+    def __init__(self, holidays=()):
+        self.holidays = sorted(holidays)
+        self._cal = np.busdaycalendar(holidays=self.holidays)
+
+    def count(self, start, end):
+        """Trading days after ``start`` up to and including ``end``."""
+        d0 = np.datetime64(start, "D") + 1
+        d1 = np.datetime64(end, "D") + 1
+        return int(np.busday_count(d0, d1, busdaycal=self._cal)) if d1 > d0 else 0
+
+    def count_many(self, starts, ends):
+        """:meth:`count` over ``datetime64[D]`` arrays with ``ends > starts``."""
+        return np.busday_count(starts + 1, ends + 1, busdaycal=self._cal)
+
+    def offset(self, start, n):
+        """The ``n``-th trading day after ``start``."""
+        d = np.busday_offset(np.datetime64(start, "D"), n, roll="backward", busdaycal=self._cal)
+        return str(d)
+
+
+def recent_dates(path, size=TAIL_BYTES):
+    """Dates of the rows in the last ``size`` bytes of a history file."""
+    try:
+        with open(path, "rb") as f:
+            end = f.seek(0, os.SEEK_END)
+            f.seek(max(0, end - size))
+            lines = f.read().splitlines()
+    except OSError:
+        return []
+    if end > size:
+        lines = lines[1:]  # cut mid-row
+    dates = []
+    for line in lines:
+        d = line.split(b",", 1)[0].strip()
+        if len(d) == 10 and d[4:5] == b"-":
+            dates.append(d.decode("ascii"))
+    return dates
+
+
+def learn_holidays(paths):
+    """Weekdays (ISO dates) on which fewer than half of the ``paths`` whose
+    recent rows span that day have a row (some funds publish every
+    calendar day, so "none of them" is too strict)."""
+    tails = [d for d in (recent_dates(p, CALENDAR_BYTES) for p in paths) if len(d) > 1]
+    if not tails:
+        return []
+    published = Counter(d for t in tails for d in t)
+    day = date.fromisoformat(min(t[0] for t in tails))
+    end = date.fromisoformat(max(t[-1] for t in tails))
+    holidays = []
+    while day <= end:
+        iso = day.isoformat()
+        if day.weekday() < 5:
+            spanning = sum(t[0] <= iso <= t[-1] for t in tails)
+            if spanning >= MIN_SPANNING and published[iso] * 2 < spanning:
+                holidays.append(iso)
+        day += timedelta(days=1)
+    return holidays
+
+
+def learn_calendar(paths):
+    """Calendar with the holidays :func:`learn_holidays` finds in ``paths``."""
+    return Calendar(learn_holidays(paths))
+
+
+def cadence(dates, calendar):
+    """Median trading days between consecutive ``dates`` (at least 1)."""
+    gaps = [calendar.count(a, b) for a, b in zip(dates, dates[1:]) if b > a]
+    return max(1.0, statistics.median(gaps)) if gaps else 1.0
+
+
+# ---------- PLAN ----------
+def amfi_dates(schemes, latest=None):
+    """``{code: ISO date}`` of each scheme's latest NAV according to AMFI:
+    NAVAll.txt rows (``load_latest_navs``) if given, else the ``Date``
+    column of ``scheme_codes.csv``."""
+    if latest is not None:
+        return {code: d for code, (d, _) in latest.items() if d}
+    out = {}
+    for s in schemes:
+        try:
+            out[s["SchemeCode"]] = navall.iso_date(s.get("Date") or "")
+        except ValueError:
+            pass
+    return {code: d for code, d in out.items() if d}
+
+
+def list_date(amfi):
+    """The date AMFI's list is for: the one most schemes carry (a few
+    funds also publish on weekends)."""
+    return Counter(amfi.values()).most_common(1)[0][0] if amfi else None
+
+
+def calendar_paths(listed, amfi, nav_dir=NAV_DIR):
+    """History files of up to ``CALENDAR_SAMPLE`` schemes, spread over
+    ``listed``, whose AMFI date is the list's own date."""
+    as_of = list_date(amfi)
+    current = [s["SchemeCode"] for s in listed if amfi.get(s["SchemeCode"]) == as_of]
+    step = max(1, len(current) // CALENDAR_SAMPLE)
+    return [os.path.join(nav_dir, f"{code}.csv") for code in current[::step][:CALENDAR_SAMPLE]]
+
+
+def plan(schemes, state, amfi, listed=None, queued=(), nav_dir=NAV_DIR,
+         today=None, budget=None):
+    """Order ``schemes`` by how likely they are to have a new NAV and drop
+    the ones that are not due.  ``amfi`` comes from :func:`amfi_dates`;
+    ``listed`` (default ``schemes``) is every scheme AMFI lists, used to
+    learn the trading calendar.  New cadences are saved to ``state``."""
+    today = (today or date.today()).isoformat()
+    as_of = list_date(amfi)
+    calendar = learn_calendar(calendar_paths(listed or schemes, amfi, nav_dir))
+    known = state.schedules()
+
+    ranked = []
+    reasons = {}
+    schedules = {}
+    counts = Counter()
+    for scheme in schemes:
+        code = scheme["SchemeCode"]
+        path = os.path.join(nav_dir, f"{code}.csv")
+        entry = state.lookup(code, path)
+        last = entry.last_date
+        listed_date = amfi.get(code)
+
+        if code in queued:
+            reason, key = "retry", 0
+        elif not last:
+            reason, key = "new", 0
+        elif listed_date and listed_date > last:
+            reason, key = "behind", -calendar.count(last, listed_date)
+        else:
+            sched = known.get(code)
+            if sched is None or sched.size != entry.size:
+                # New rows (or none measured yet): re-measure, reset the back-off.
+                sched = nav_state.Schedule(cadence(recent_dates(path), calendar), entry.size, 0, None)
+                state.set_schedule(code, sched)
+            schedules[code] = sched
+
+            late = calendar.count(last, today) - sched.cadence
+            if late > max(DORMANT_AFTER, DORMANT_FACTOR * sched.cadence):
+                due = sched.next_probe is None or sched.next_probe <= today
+                reason, key = ("probe", sched.misses) if due else ("dormant", 0)
+            else:
+                expected = calendar.offset(last, round(sched.cadence))
+                if listed_date == last and as_of:
+                    # AMFI's list shows nothing newer up to its own date.
+                    expected = max(expected, calendar.offset(as_of, 1))
+                if expected <= today:
+                    reason, key = "due", -calendar.count(expected, today)
+                else:
+                    reason, key = "waiting", 0
+
+        reasons[code] = reason
+        counts[reason] += 1
+        if reason in FETCH:
+            ranked.append((FETCH.index(reason), key, code, scheme))
+
+    ranked.sort(key=lambda r: r[:3])
+    deferred = 0
+    if budget is not None and len(ranked) > budget:
+        deferred = len(ranked) - budget
+        for _, _, code, _ in ranked[budget:]:
+            counts[reasons.pop(code)] -= 1
+        ranked = ranked[:budget]
+    counts["deferred"] = deferred
+    state.commit()
+    return Plan([r[3] for r in ranked], reasons, schedules, counts, deferred, calendar)
+
+
+def record(state, plan, nav_dir=NAV_DIR, today=None):
+    """After the fetch: double the wait of probed schemes that got nothing
+    new.  Schemes that did grow are reset by the next :func:`plan`."""
+    today = today or date.today()
+    for code, reason in plan.reasons.items():
+        if reason != "probe":
+            continue
+        sched = plan.schedules[code]
+        if state.lookup(code, os.path.join(nav_dir, f"{code}.csv")).size != sched.size:
+            continue
+        misses = sched.misses + 1
+        wait = min(2 ** misses, PROBE_MAX)
+        # Up to half the wait earlier, fixed per scheme, so schemes that went
+        # quiet together do not all come due on the same run.
+        wait -= zlib.crc32(code.encode("ascii")) % (wait // 2 + 1)
+        state.set_schedule(code, sched._replace(
+            misses=misses, next_probe=(today + timedelta(days=wait)).isoformat()))
+    state.commit()
+
+
+def summary(plan):
+    """One line per fetch / skip reason with its count."""
+    parts = [f"{reason} {plan.counts[reason]:,}" for reason in FETCH + SKIP if plan.counts[reason]]
+    if plan.deferred:
+        parts.append(f"over budget {plan.deferred:,}")
+    return " · ".join(parts)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Show which schemes the next scheduled fetch would request")
+    parser.add_argument("--budget", type=int, help="At most this many requests")
+    parser.add_argument("--today", type=date.fromisoformat, help="Plan as of this date (YYYY-MM-DD)")
+    parser.add_argument("--show", type=int, default=10, help="Print the first N schemes of the plan")
+    parser.add_argument("--state", default=STATE_FILE, help="NAV history state index path")
+    args = parser.parse_args()
+
+    if not available():
+        parser.error("numpy is required (pip install numpy)")
+
+    with open(CODES_FILE, newline="", encoding="utf-8") as f:
+        schemes = list(csv.DictReader(f))
+    amfi = amfi_dates(schemes)
+    with nav_state.NavState(args.state) as state:
+        queued = state.retry_queue(RETRY_CONSUMER)
+        result = plan(schemes, state, amfi, queued=queued, today=args.today, budget=args.budget)
+
+    print(f"📊 Schemes: {len(schemes):,}, AMFI list dated {list_date(amfi) or '-'}")
+    print(f"📅 Market holidays learned: {', '.join(result.calendar.holidays[-8:]) or 'none'}")
+    print(f"🗓️ Plan: {summary(result)}")
+    print(f"🚀 Requests: {len(result.schemes):,} of {len(schemes):,}")
+    for scheme in result.schemes[:args.show]:
+        code = scheme["SchemeCode"]
+        print(f"   {code:>8} {result.reasons[code]:<7} {scheme.get('SchemeName', '')[:70]}")
+
+
+if __name__ == "__main__":
+    main()